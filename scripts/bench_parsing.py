@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark response parsing: the previous BeautifulSoup code against parsing.py
+
+Builds decoder pages like the ones the service returns (queue listing, upload
+form, upload result), checks that both implementations extract the same
+fields and prints the time per page.
+"""
+
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import bs4
+
+import parsing
+
+from rich.console import Console
+from rich.table import Table
+from rich import box
+
+console = Console()
+
+
+def bs4_queued_file_ids(content: bytes):
+    soup = bs4.BeautifulSoup(content, "html.parser")
+    return [
+        inp["value"]
+        for inp in soup.find_all("input", attrs={"name": "file[]"})
+        if inp.get("value")
+    ]
+
+
+def bs4_upload_input_name(content: bytes):
+    soup = bs4.BeautifulSoup(content, "html.parser")
+    upload_input = (
+        soup.find("input", id="uploadfileblue")
+        or soup.find("input", type="file")
+        or soup.find("input", attrs={"name": lambda x: x and "file" in x.lower()})
+    )
+    return upload_input.get("name", "uploadfile[]") if upload_input else None
+
+
+def bs4_upload_result(content: bytes):
+    soup = bs4.BeautifulSoup(content, "html.parser")
+    success, failure = [], []
+    for el in soup.find_all(["div", "span"], class_=["alert-success", "success"]):
+        parts = el.get_text().split()
+        if len(parts) > 1:
+            success.append(parts[1])
+    for el in soup.find_all(["div", "span"], class_=["alert-danger", "error", "danger"]):
+        parts = el.get_text().split()
+        if len(parts) > 3:
+            failure.append(parts[3])
+    return success, failure
+
+
+def page(body: str) -> bytes:
+    # Navigation, scripts and a login box around the interesting part, like
+    # the real pages
+    nav = "".join(f'<li class="nav-item"><a href="/page{i}">Page {i}</a></li>' for i in range(40))
+    return f"""<!DOCTYPE html>
+<html><head><title>easytoyou.eu</title>
+<script>var tpl = '<input name="file[]" value="not-a-file">';</script>
+<style>.alert-success {{ color: green; }}</style></head>
+<body><nav><ul>{nav}</ul></nav>
+<!-- <div class="alert-danger">Could not decode commented.php</div> -->
+<div class="container"><div class="row"><div class="col">{body}</div></div></div>
+<footer><p>&copy; easytoyou.eu</p></footer></body></html>""".encode("utf-8")
+
+
+def queue_page(files: int) -> bytes:
+    rows = "".join(
+        f'<tr><td><input type="checkbox" name="file[]" value="{i:08x}_f{i}.php"></td>'
+        f"<td>f{i}.php</td><td>ready</td></tr>"
+        for i in range(files)
+    )
+    form = (
+        '<form method="post" enctype="multipart/form-data">'
+        '<input type="file" id="uploadfileblue" name="uploadfile[]" multiple>'
+        '<input type="submit" name="submit" value="Decode"></form>'
+    )
+    return page(f"{form}<form method=post><table>{rows}</table>"
+                f'<input type="submit" name="submit" value="Delete"></form>')
+
+
+def result_page(files: int) -> bytes:
+    alerts = "".join(
+        f'<div class="alert alert-success">File f{i}.php <b>decoded</b> successfully</div>'
+        if i % 10 else
+        f'<div class="alert alert-danger">Could not decode f{i}.php: unsupported&nbsp;version</div>'
+        for i in range(files)
+    )
+    return page(alerts) + queue_page(min(files, 10))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark decoder page parsing")
+    parser.add_argument("--files", type=int, default=50, metavar="N", help="files listed per page (default: 50)")
+    parser.add_argument("--number", type=int, default=200, metavar="N", help="parses per measurement (default: 200)")
+    args = parser.parse_args()
+
+    queue = queue_page(args.files)
+    result = result_page(args.files)
+    cases = [
+        ("queue ids", queue, bs4_queued_file_ids, parsing.queued_file_ids),
+        ("upload input", queue, bs4_upload_input_name, parsing.upload_input_name),
+        ("upload result", result, bs4_upload_result, parsing.upload_result),
+    ]
+
+    table = Table(box=box.ROUNDED)
+    table.add_column("Page")
+    table.add_column("Size", justify="right")
+    table.add_column("bs4", justify="right")
+    table.add_column("parsing", justify="right")
+    table.add_column("Speedup", justify="right", style="bold")
+    for name, content, old, new in cases:
+        expected, got = old(content), new(content)
+        if expected != got:
+            console.print(f"[red]{name}: results differ[/]\n  bs4:     {expected}\n  parsing: {got}")
+            return 1
+        old_s = min(timeit.repeat(lambda: old(content), number=args.number, repeat=3)) / args.number
+        new_s = min(timeit.repeat(lambda: new(content), number=args.number, repeat=3)) / args.number
+        table.add_row(
+            name,
+            f"{len(content) / 1024:.1f} KB",
+            f"{old_s * 1000:.3f} ms",
+            f"{new_s * 1000:.3f} ms",
+            f"{old_s / new_s:.0f}x",
+        )
+    console.print(table)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
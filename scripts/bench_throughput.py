@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark against the local mock server
+
+Generates synthetic source trees of several sizes and shapes, runs
+decode_directory on each against mock_server.MockServer and prints files/sec,
+the requests the server saw and the peak RSS of the decoding process. Every
+case runs in a fresh process, so its peak RSS is its own.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from mock_server import MockServer
+
+from rich.console import Console
+from rich.table import Table
+from rich import box
+
+console = Console()
+
+SHAPES = ("flat", "nested", "mixed")
+
+
+def make_tree(root: str, files: int, shape: str, file_kb: int, seed: int = 0) -> int:
+    """
+    Write a synthetic source tree and return its number of ionCube files
+
+    Shapes:
+        flat: every file in one directory
+        nested: a few files per directory, four levels deep
+        mixed: nested, plus plain PHP and asset files and duplicated plugins
+    """
+    encoded = 0
+    for i in range(files):
+        if shape == "flat":
+            directory = root
+        else:
+            directory = os.path.join(root, *(f"d{(i // 5) % (4 ** level)}" for level in range(1, 5)))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"f{i}.php")
+
+        if shape == "mixed" and i % 4 == 3:
+            # Plain PHP and assets are copied, not uploaded
+            with open(path, "w") as f:
+                f.write(f"<?php echo {i};\n")
+            with open(os.path.join(directory, f"style{i}.css"), "w") as f:
+                f.write("body { margin: 0; }\n")
+            continue
+        # In the mixed tree every tenth file is a copy of an earlier one, as
+        # with a plugin bundled twice
+        content_id = i - 9 if shape == "mixed" and i % 10 == 9 else i
+        block = hashlib.sha256(f"{seed}:{content_id}".encode()).hexdigest().encode()
+        with open(path, "wb") as f:
+            f.write(b"<?php // ionCube Loader\n")
+            f.write((block * (file_kb * 1024 // len(block) + 1))[:file_kb * 1024])
+        encoded += 1
+    return encoded
+
+
+def _peak_rss_kb() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _run_case(conn, base_url: str, source: str, dest: str, options: Dict) -> None:
+    # Runs in a child process
+    sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+    logging.basicConfig(level=options.pop("log_level"))
+    import decoder
+    from async_decoder import AsyncIonicubeDecoder
+
+    decoder.console.quiet = True
+    use_async = options.pop("use_async")
+    cls = AsyncIonicubeDecoder if use_async else decoder.IonicubeDecoder
+    instance = cls("bench", "bench", base_url=base_url, use_scan_cache=False, **options)
+
+    started = time.perf_counter()
+    if use_async:
+        asyncio.run(instance.decode_directory(source, dest))
+    else:
+        instance.decode_directory(source, dest)
+    elapsed = time.perf_counter() - started
+
+    conn.send({
+        "elapsed": elapsed,
+        "decoded": instance.processed_count,
+        "failed": len(instance.not_decoded),
+        "peak_rss_kb": _peak_rss_kb(),
+    })
+    conn.close()
+
+
+def run_case(server: MockServer, source: str, options: Dict) -> Dict:
+    """Decode source in a fresh process against server and return its measurements"""
+    server.reset()
+    dest = tempfile.mkdtemp(prefix="bench-out-")
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_case, args=(child, server.url, source, dest, dict(options)))
+    try:
+        process.start()
+        child.close()
+        result = parent.recv()
+        process.join()
+    except EOFError:
+        process.join()
+        raise RuntimeError(f"benchmark process exited with code {process.exitcode}")
+    finally:
+        shutil.rmtree(dest, ignore_errors=True)
+    result["server"] = server.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark decode throughput against a local mock server")
+    parser.add_argument("--sizes", default="50,200,500", help="comma-separated tree sizes in files (default: 50,200,500)")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help=f"comma-separated tree shapes: {', '.join(SHAPES)} (default: all)")
+    parser.add_argument("--file-kb", type=int, default=8, metavar="KB", help="size of each encoded file (default: 8)")
+    parser.add_argument("--workers", type=int, default=2, metavar="N", help="decoder sessions (default: 2)")
+    parser.add_argument("--batch-size", type=int, default=20, metavar="N", help="files per upload (default: 20)")
+    parser.add_argument("--pipeline", action="store_true", help="use the pipelined engine")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the asyncio engine")
+    parser.add_argument("--rate", type=float, default=0, metavar="N", help="client rate limit in req/s (default: 0, off)")
+    parser.add_argument("--latency", type=float, default=0.02, metavar="SEC", help="server delay per request (default: 0.02)")
+    parser.add_argument("--decode-latency", type=float, default=0.005, metavar="SEC", help="server delay per uploaded file (default: 0.005)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, metavar="P", help="fraction of requests answered with 502")
+    parser.add_argument("--expire-after", type=int, default=0, metavar="N", help="log sessions out after N requests")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the trees and injected failures")
+    parser.add_argument("--json", metavar="FILE", help="also write the results to FILE")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the decoder log")
+    args = parser.parse_args()
+
+    shapes = [s.strip() for s in args.shapes.split(",") if s.strip()]
+    unknown = set(shapes) - set(SHAPES)
+    if unknown:
+        parser.error(f"unknown shapes: {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    options = {
+        "workers": args.workers,
+        "batch_size": args.batch_size,
+        "pipeline": args.pipeline,
+        "use_async": args.use_async,
+        "rate_limit": args.rate,
+        "log_level": logging.INFO if args.verbose else logging.ERROR,
+    }
+
+    table = Table(box=box.ROUNDED)
+    for column in ("Tree", "Decoded", "Time", "Files/s", "Requests", "Uploads", "MB up/down", "Peak RSS"):
+        table.add_column(column, justify="left" if column == "Tree" else "right")
+
+    results: List[Dict] = []
+    work = tempfile.mkdtemp(prefix="bench-src-")
+    server = MockServer(
+        latency=args.latency,
+        decode_latency=args.decode_latency,
+        failure_rate=args.failure_rate,
+        expire_after=args.expire_after,
+        seed=args.seed,
+    )
+    try:
+        with server:
+            for shape in shapes:
+                for size in sizes:
+                    source = os.path.join(work, f"{shape}-{size}")
+                    encoded = make_tree(source, size, shape, args.file_kb, args.seed)
+                    console.print(f"[dim]{shape} tree, {size} files ({encoded} encoded)...[/]")
+                    result = run_case(server, source, options)
+                    result.update(shape=shape, files=size, encoded=encoded)
+                    results.append(result)
+
+                    served = result["server"]
+                    rss = result["peak_rss_kb"]
+                    table.add_row(
+                        f"{shape} {size}",
+                        f"{result['decoded']}/{encoded}",
+                        f"{result['elapsed']:.2f} s",
+                        f"{result['decoded'] / result['elapsed']:.1f}",
+                        str(served.get("requests", 0)),
+                        str(served.get("uploads", 0)),
+                        f"{served.get('bytes_in', 0) / 1048576:.2f}/{served.get('bytes_out', 0) / 1048576:.2f}",
+                        f"{rss / 1024:.0f} MB" if rss is not None else "n/a",
+                    )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    console.print(table)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
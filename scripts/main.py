@@ -3,13 +3,16 @@
 import os
 import sys
 import argparse
+import asyncio
 import logging
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
 
 from decoder import IonicubeDecoder
+from async_decoder import AsyncIonicubeDecoder
 from exceptions import EasyToYouError, LoginError
+from tracing import ThreadProfiler
 
 from rich.console import Console
 from rich.panel import Panel
@@ -50,6 +53,29 @@ Examples:
     parser.add_argument("-v", "--verbose", action="store_true", help="verbose logging")
     parser.add_argument("--watermark", help="custom watermark text")
     parser.add_argument("--retry", type=int, default=4, metavar="N", help="max retry attempts per batch (default: 4)")
+    parser.add_argument("--retry-budget", type=int, default=50, metavar="N", help="retries allowed across the whole run; failures are no longer retried once spent (default: 50)")
+    parser.add_argument("--batch-size", type=int, default=20, metavar="N", help="files per upload; the starting point for adaptive batches (default: 20)")
+    parser.add_argument("--batch-mb", type=float, default=8, metavar="MB", help="bytes per upload; the starting point for adaptive batches (default: 8)")
+    parser.add_argument("--max-request-mb", type=float, default=0, metavar="MB", help="largest upload request; bigger batches are split into several requests, bigger files are not uploaded (default: 0, no limit)")
+    parser.add_argument("--fixed-batches", action="store_true", help="always upload --batch-size files instead of adapting to latency and timeouts")
+    parser.add_argument("--rate", type=float, default=5.0, metavar="N", help="max requests per second shared by all sessions, lowered automatically on HTTP 429 (default: 5, 0 = unlimited)")
+    parser.add_argument("--workers", type=int, default=1, metavar="N", help="concurrent batch workers, each with its own session (default: 1)")
+    parser.add_argument("--pipeline", action="store_true", help="overlap upload, download and extraction across batches")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="drive all sessions from one asyncio event loop (requires aiohttp)")
+    parser.add_argument("--process-workers", type=int, default=0, metavar="N", help="watermark and write decoded files in N worker processes (default: 0, in-process)")
+    parser.add_argument("--cache-dir", metavar="DIR", help="reuse decoded output across runs from this content-addressed cache")
+    parser.add_argument("--cache-size", type=int, default=1024, metavar="MB", help="decode cache size cap, least recently used entries are evicted (default: 1024)")
+    parser.add_argument("--selective", type=int, default=5, metavar="N", help="download batches of up to N decoded files by queue ID when the queue holds other files (default: 5, 0 = always the whole queue)")
+    parser.add_argument("--spool-mb", type=int, default=8, metavar="MB", help="keep downloaded archives up to MB in memory, spill larger ones to disk (default: 8)")
+    parser.add_argument("--no-dedupe", action="store_true", help="upload every copy of identical encoded files instead of one per content")
+    parser.add_argument("--cookie-cache", metavar="FILE", help="reuse logged-in sessions across runs; cookies are stored encrypted with a key derived from the credentials (requires cryptography)")
+    parser.add_argument("--metrics", metavar="FILE", help="write a JSON run report with per-phase timings, bytes and counters to FILE")
+    parser.add_argument("--prometheus", metavar="FILE", help="write the metrics in the Prometheus textfile format to FILE")
+    parser.add_argument("--metrics-interval", type=float, default=10, metavar="SEC", help="rewrite the metrics files every SEC seconds during the run (default: 10)")
+    parser.add_argument("--profile", metavar="FILE", help="write a Chrome trace of the run (login, queue clears, uploads, downloads, extraction, ...) to FILE; open it in ui.perfetto.dev or chrome://tracing")
+    parser.add_argument("--cprofile", metavar="FILE", help="also profile every thread with cProfile and write the stats to FILE")
+    parser.add_argument("--base-url", default="https://easytoyou.eu", metavar="URL", help="service URL, e.g. a local mock_server.py (default: https://easytoyou.eu)")
+    parser.add_argument("--rescan", action="store_true", help="ignore the scan cache and re-read every PHP file header")
 
     args = parser.parse_args()
 
@@ -70,24 +96,65 @@ Examples:
     info_table.add_row("Output", args.destination)
     info_table.add_row("Decoder", args.decoder)
     info_table.add_row("Overwrite", str(args.overwrite))
-    info_table.add_row("Max retries", str(args.retry))
+    info_table.add_row("Max retries", f"{args.retry} per batch, {args.retry_budget} per run")
+    info_table.add_row("Batches", f"{args.batch_size} files" + (" (fixed)" if args.fixed_batches else f" / {args.batch_mb:g} MB (adaptive)"))
+    info_table.add_row("Workers", str(args.workers))
+    info_table.add_row("Rate limit", f"{args.rate:g} req/s" if args.rate > 0 else "off")
+    info_table.add_row("Pipeline", str(args.pipeline))
+    info_table.add_row("Engine", "asyncio" if args.use_async else "threads")
     info_table.add_row("Watermark", "custom" if args.watermark else "RBW-Tech default")
     console.print(Panel(info_table, title="[bold]easy-to-you-automation[/]", border_style="cyan"))
 
     try:
-        decoder = IonicubeDecoder(
+        decoder_class = AsyncIonicubeDecoder if args.use_async else IonicubeDecoder
+        decoder = decoder_class(
             args.username,
             args.password,
             args.decoder,
             custom_watermark=args.watermark,
             max_retries=args.retry,
+            rescan=args.rescan,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            adaptive_batching=not args.fixed_batches,
+            batch_bytes=int(args.batch_mb * 1024 * 1024),
+            max_request_bytes=int(args.max_request_mb * 1024 * 1024),
+            pipeline=args.pipeline,
+            spool_threshold=args.spool_mb * 1024 * 1024,
+            process_workers=args.process_workers,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size * 1024 * 1024,
+            dedupe=not args.no_dedupe,
+            rate_limit=args.rate,
+            cookie_cache=args.cookie_cache,
+            retry_budget=args.retry_budget,
+            selective_download=args.selective,
+            metrics_file=args.metrics,
+            prometheus_file=args.prometheus,
+            metrics_interval=args.metrics_interval,
+            base_url=args.base_url,
+            profile_file=args.profile,
         )
     except Exception as e:
         logger.error(f"Failed to initialize decoder: {e}")
         return 1
 
+    profiler = ThreadProfiler() if args.cprofile else None
     try:
-        success = decoder.decode_directory(args.source, args.destination, args.overwrite)
+        if profiler is not None:
+            profiler.start()
+        try:
+            if args.use_async:
+                success = asyncio.run(
+                    decoder.decode_directory(args.source, args.destination, args.overwrite)
+                )
+            else:
+                success = decoder.decode_directory(args.source, args.destination, args.overwrite)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                profiler.dump(args.cprofile)
+                logger.info(f"cProfile stats written to {args.cprofile}")
 
         total    = getattr(decoder, "processed_count", 0)
         failed   = getattr(decoder, "not_decoded", [])
@@ -97,6 +164,11 @@ Examples:
         summary.add_column(justify="right", style="bold")
         summary.add_row("Decoded", f"[green]{total}[/]")
         summary.add_row("Failed", f"[red]{len(failed)}[/]")
+        cache = getattr(decoder, "decode_cache", None)
+        if cache is not None:
+            summary.add_row("Cache hits", f"{cache.hits} ({cache.hit_rate:.0%})")
+        if getattr(decoder, "dedup_saved", 0):
+            summary.add_row("Uploads saved", f"{decoder.dedup_saved} (duplicates)")
         summary.add_row("Output", args.destination)
         console.print(Panel(
             summary,
@@ -62,6 +62,12 @@ setup(
     python_requires=">=3.8",
     install_requires=requirements,
     extras_require={
+        'async': [
+            'aiohttp>=3.8.0',
+        ],
+        'cookies': [
+            'cryptography>=41.0.0',
+        ],
         'dev': [
             'pytest>=7.0.0',
             'pytest-cov>=4.0.0',
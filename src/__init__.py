@@ -2,20 +2,24 @@
 __author__ = "RBW-Tech"
 
 from decoder import IonicubeDecoder
+from async_decoder import AsyncIonicubeDecoder
 from exceptions import (
     EasyToYouError,
     LoginError,
     UploadError,
     DownloadError,
     NetworkError,
+    SessionExpiredError,
 )
 
 __all__ = [
     "IonicubeDecoder",
+    "AsyncIonicubeDecoder",
     "EasyToYouError",
     "LoginError",
     "UploadError",
     "DownloadError",
     "NetworkError",
+    "SessionExpiredError",
 ]
 
@@ -0,0 +1,419 @@
+"""
+asyncio engine for the EasyToYou decoder
+"""
+
+import asyncio
+import functools
+import logging
+import time
+import urllib.parse
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from rich.progress import Progress, TaskID
+
+from async_session import AsyncSessionManager
+from batching import BatchItem
+from decoder import CHUNK_SIZE, QUEUE_RECHECK_INTERVAL, UPLOAD_FIELDS, IonicubeDecoder, _is_timeout
+from exceptions import DownloadError, SessionExpiredError, UploadError
+from multipart import FilePart, MultipartEncoder
+from retry import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class AsyncIonicubeDecoder(IonicubeDecoder):
+    """
+    IonicubeDecoder driven by a single asyncio event loop
+
+    Every worker session is an AsyncSessionManager with its own decoder queue.
+    Batches wait for a free session, clear its queue, upload and download
+    without blocking a thread; backoff uses asyncio.sleep(). Scanning, file
+    reads and archive extraction run in the default thread executor, so the
+    next batch is already on the wire while the previous one is written.
+    """
+
+    # Created by IonicubeDecoder.__init__; restated for type checkers
+    _process_pool: Optional[ProcessPoolExecutor]
+
+    async def _in_thread(self, fn: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(fn, *args))
+
+    async def _aretry(self, fn: Callable[[], Awaitable[T]]) -> T:
+        result: T = await self.retry_policy.acall(fn)
+        return result
+
+    async def _aauthenticate(self, session_manager: AsyncSessionManager, slot: int) -> bool:
+        with self.metrics.phase("login"):
+            return await self._arestore_or_login(session_manager, slot)
+
+    async def _arestore_or_login(self, session_manager: AsyncSessionManager, slot: int) -> bool:
+        # Async counterpart of _restore_or_login()
+        cache = self.cookie_cache
+        restored = False
+        if cache is not None:
+            async def save_cookies(sm: AsyncSessionManager) -> None:
+                await self._in_thread(cache.save, slot, sm.export_cookies())
+
+            session_manager.on_login = save_cookies
+            restored = await session_manager.restore(cache.load(slot))
+        if restored:
+            session_manager.credentials = (self.username, self.password)
+            logger.info(f"Resumed saved session {slot}")
+            return True
+        return await self._aretry(lambda: session_manager.login(self.username, self.password))
+
+    async def _atimed(self, fn: Callable[[], Awaitable[T]]) -> T:
+        # Async counterpart of _timed()
+        if self.batcher is None:
+            return await fn()
+        started = time.monotonic()
+        try:
+            result = await fn()
+        except Exception as e:
+            self.batcher.record(time.monotonic() - started, False, _is_timeout(e))
+            raise
+        self.batcher.record(time.monotonic() - started, True)
+        return result
+
+    async def _aclear_decoder_queue(self, session_manager: AsyncSessionManager) -> None:
+        decoder_url = f"{self.base_url}/decoder/{self.decoder}"
+        session_manager.queue_ids = None
+        self.metrics.inc("queue_clears")
+        cleared = 0
+        consecutive_empty = 0
+
+        while True:
+            try:
+                polled = time.monotonic()
+                async with session_manager.get(decoder_url, timeout=30) as response:
+                    response.raise_for_status()
+                    content = await response.read()
+
+                vals = self._queued_file_ids(content)
+                if not vals:
+                    consecutive_empty += 1
+                    if consecutive_empty >= 2:
+                        session_manager.queue_ids = []
+                        break
+                    wait = QUEUE_RECHECK_INTERVAL - (time.monotonic() - polled)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    continue
+
+                consecutive_empty = 0
+                async with session_manager.post(
+                    decoder_url,
+                    data=[("file[]", v) for v in vals] + [("submit", "Delete")],
+                    headers={"Referer": decoder_url},
+                    timeout=30,
+                ) as response:
+                    await response.read()
+                cleared += len(vals)
+                logger.debug(f"Queue clear: deleted {len(vals)} (total {cleared})")
+
+            except Exception as e:
+                logger.warning(f"Queue clear error: {e}")
+                break
+
+        if cleared:
+            logger.info(f"Queue cleared ({cleared} files removed)")
+
+    async def _aprepare_queue(self, session_manager: AsyncSessionManager) -> None:
+        # Async counterpart of _prepare_queue()
+        known = session_manager.queue_ids
+        if known is None:
+            await self._aclear_decoder_queue(session_manager)
+            return
+
+        with self._lock:
+            self.clears_skipped += 1
+        if not known:
+            return
+
+        decoder_url = f"{self.base_url}/decoder/{self.decoder}"
+        try:
+            async with session_manager.post(
+                decoder_url,
+                data=[("file[]", v) for v in known] + [("submit", "Delete")],
+                headers={"Referer": decoder_url},
+                timeout=30,
+            ) as response:
+                response.raise_for_status()
+                await response.read()
+        except Exception as e:
+            logger.warning(f"Deleting {len(known)} known queue entries failed: {e}")
+            await self._aclear_decoder_queue(session_manager)
+            return
+        session_manager.queue_ids = []
+
+    @staticmethod
+    def _file_parts(input_name: str, batch: List[BatchItem]) -> List[FilePart]:
+        parts = []
+        for item in batch:
+            try:
+                parts.append(FilePart(input_name, item.upload_name, item.source_path, "application/x-php"))
+            except OSError as e:
+                logger.warning(f"Could not open {item.source_path}: {e}")
+        return parts
+
+    async def _apost_upload(self, session_manager: AsyncSessionManager, parts: List[FilePart]) -> bytes:
+        # Async counterpart of _post_upload(); file reads run in the thread
+        # executor, one chunk at a time
+        decoder_url = f"{self.base_url}/decoder/{self.decoder}"
+        body = MultipartEncoder(parts, UPLOAD_FIELDS)
+
+        async def stream() -> AsyncIterator[bytes]:
+            # A fresh generator for every send, starting from the top
+            await self._in_thread(body.seek, 0)
+            while True:
+                chunk = await self._in_thread(body.read, CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+        headers = {
+            "Referer": decoder_url,
+            "Content-Type": body.content_type,
+            # Sent with a length rather than chunked, like the sync engine
+            "Content-Length": str(len(body)),
+        }
+        try:
+            with self.metrics.phase("upload"):
+                async with session_manager.post(
+                    decoder_url, headers=headers, data=stream, timeout=120
+                ) as post_response:
+                    post_response.raise_for_status()
+                    result: bytes = await post_response.read()
+        except Exception as e:
+            session_manager.queue_ids = None
+            logger.error(f"Upload failed: {e}")
+            raise UploadError(f"Failed to upload files: {e}") from e
+        finally:
+            await self._in_thread(body.close)
+        self.metrics.inc("bytes_up", sum(part.size for part in parts))
+        self.metrics.inc("files_uploaded", len(parts))
+        return result
+
+    async def _aupload_batch(
+        self, session_manager: AsyncSessionManager, batch: List[BatchItem]
+    ) -> Tuple[List[str], List[str]]:
+        with self.metrics.phase("queue_clear"):
+            await self._aprepare_queue(session_manager)
+
+        decoder_url = f"{self.base_url}/decoder/{self.decoder}"
+        async with session_manager.get(decoder_url, timeout=60) as response:
+            response.raise_for_status()
+            content = await response.read()
+        input_name = self._upload_input_name(content)
+
+        parts = await self._in_thread(self._file_parts, input_name, batch)
+        if not parts:
+            return [], [item.upload_name for item in batch]
+
+        # Retried with the whole batch, like IonicubeDecoder.upload_files()
+        groups, failure = self._split_upload(parts)
+        success: List[str] = []
+        result = b""
+        for group in groups:
+            result = await self._apost_upload(session_manager, group)
+            group_success, group_failure = self._parse_upload_html(result)
+            success.extend(group_success)
+            failure.extend(group_failure)
+        if groups:
+            self._note_queue(session_manager, result, len(success))
+        return success, failure
+
+    async def _afetch_archive(self, session_manager: AsyncSessionManager) -> IO[bytes]:
+        async with session_manager.get(f"{self.base_url}/download.php?id=all", timeout=120) as response:
+            response.raise_for_status()
+
+            if not response.headers.get("content-type", "").startswith("application/zip"):
+                raise DownloadError("Response is not a ZIP archive")
+
+            # Same spooling rules as the sync engine; writes happen off the loop
+            archive: IO[bytes] = self._new_archive()
+            size = 0
+            try:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    await self._in_thread(archive.write, chunk)
+                    size += len(chunk)
+                archive.seek(0)
+            except BaseException:
+                self._discard_archive(archive)
+                raise
+            self.metrics.inc("bytes_down", size)
+            return archive
+
+    async def _afetch_results(self, session_manager: AsyncSessionManager, success: List[str]) -> IO[bytes]:
+        # Async counterpart of _fetch_results()
+        with self.metrics.phase("download"):
+            ids = self._selected_ids(session_manager, success)
+            if ids is None:
+                return await self._afetch_archive(session_manager)
+            return await self._afetch_files(session_manager, ids)
+
+    async def _afetch_files(self, session_manager: AsyncSessionManager, ids: Dict[str, str]) -> IO[bytes]:
+        bodies: List[Tuple[str, str, bytes]] = []
+        for file_id, name in ids.items():
+            url = f"{self.base_url}/download.php?id={urllib.parse.quote(file_id)}"
+            async with session_manager.get(url, timeout=120) as response:
+                response.raise_for_status()
+                bodies.append((name, response.headers.get("content-type", ""), await response.read()))
+
+        def pack() -> Tuple[IO[bytes], int]:
+            archive = self._new_archive()
+            try:
+                with zipfile.ZipFile(archive, "w") as zf:
+                    size = sum(self._add_member(zf, *body) for body in bodies)
+                archive.seek(0)
+            except BaseException:
+                self._discard_archive(archive)
+                raise
+            return archive, size
+
+        archive, size = await self._in_thread(pack)
+        self._note_selective(ids, size, len(session_manager.queue_ids or ()))
+        return archive
+
+    async def _aupload_and_fetch(
+        self, session_manager: AsyncSessionManager, batch: List[BatchItem]
+    ) -> Tuple[Optional[IO[bytes]], List[str]]:
+        # See IonicubeDecoder._upload_and_fetch()
+        for _ in range(2):
+            logins = session_manager.logins
+            success, failure = await self._atimed(lambda: self._aupload_batch(session_manager, batch))
+            archive = (
+                await self._atimed(lambda: self._afetch_results(session_manager, success))
+                if success else None
+            )
+            if session_manager.logins == logins:
+                return archive, failure
+            if archive is not None:
+                self._discard_archive(archive)
+            logger.warning("Session renewed during a batch, uploading it again")
+        raise SessionExpiredError("Session expired repeatedly during one batch")
+
+    async def _aprocess_batch(
+        self,
+        session_manager: AsyncSessionManager,
+        idle: Optional["asyncio.Queue[AsyncSessionManager]"],
+        batch: List[BatchItem],
+        batch_label: str,
+        progress: Progress,
+        task_id: TaskID,
+        policy: Optional[RetryPolicy] = None,
+    ) -> bool:
+        # The session is held from queue clear to download, because the next
+        # upload on it clears the queue; extraction runs after it is returned.
+        # Halves of a failed batch (idle is None) run on the held session.
+        policy = policy or self.retry_policy
+        with self.tracer.span("batch", label=batch_label, files=len(batch)):
+            try:
+                if self._aborted is not None:
+                    return False
+                try:
+                    archive, failure = await policy.acall(
+                        lambda: self._aupload_and_fetch(session_manager, batch)
+                    )
+                except Exception as e:
+                    if self._abort_on(e):
+                        return False
+                    if not self._bisectable(batch, e):
+                        self._mark_batch_failed(batch, batch_label, e, progress, task_id)
+                        return False
+                    results = []
+                    for half, label in self._halves(batch, batch_label, e):
+                        results.append(await self._aprocess_batch(
+                            session_manager, None, half, label, progress, task_id, self.bisect_policy
+                        ))
+                    return all(results)
+            finally:
+                if idle is not None:
+                    idle.put_nowait(session_manager)
+            return await self._in_thread(
+                self._complete_batch, batch, batch_label, archive, failure, progress, task_id
+            )
+
+    async def _arun_batches(
+        self,
+        sessions: List[AsyncSessionManager],
+        batches: Iterable[List[BatchItem]],
+        progress: Progress,
+        task_id: TaskID,
+    ) -> None:
+        idle: "asyncio.Queue[AsyncSessionManager]" = asyncio.Queue()
+        for session_manager in sessions:
+            idle.put_nowait(session_manager)
+
+        logger.info(f"Processing batches on {len(sessions)} async sessions")
+        tasks = []
+        try:
+            # A batch is packed only once a session is free, so adaptive sizing
+            # sees the feedback of every batch finished so far
+            for i, batch in enumerate(batches):
+                session_manager = await idle.get()
+                if self._aborted is not None:
+                    break
+                if self.process_workers and self._process_pool is None:
+                    self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers)
+                tasks.append(asyncio.ensure_future(self._aprocess_batch(
+                    session_manager, idle, batch, f"batch {i + 1}", progress, task_id
+                )))
+            await asyncio.gather(*tasks)
+        finally:
+            if self._process_pool is not None:
+                # Wait for outstanding extractions so every batch is recorded
+                await self._in_thread(self._process_pool.shutdown, True)
+                self._process_pool = None
+        if self._aborted is not None:
+            raise self._aborted
+
+    async def decode_directory(  # type: ignore[override]
+        self, source_path: str, dest_path: str, overwrite: bool = False
+    ) -> bool:
+        logger.info(f"Starting decode: {source_path} -> {dest_path}")
+
+        sessions = [
+            AsyncSessionManager(self.base_url, limiter=self.rate_limiter, metrics=self.metrics)
+            for _ in range(self.workers)
+        ]
+        with self._run_exports():
+            await self._arun(sessions, source_path, dest_path, overwrite)
+            self._report()
+        return True
+
+    async def _arun(
+        self, sessions: List[AsyncSessionManager], source_path: str, dest_path: str, overwrite: bool
+    ) -> None:
+        try:
+            await asyncio.gather(*(
+                self._aauthenticate(session_manager, slot)
+                for slot, session_manager in enumerate(sessions)
+            ))
+
+            with self.metrics.phase("plan"):
+                items, copy_jobs = await self._in_thread(self._plan, source_path, dest_path, overwrite)
+
+            with self._progress() as progress:
+                task = progress.add_task("[bold]Decoding[/]", total=max(self.total_files, 1))
+
+                for root, dest_dir, other_files in copy_jobs:
+                    await self._in_thread(self.copy_files, root, dest_dir, other_files)
+
+                items = await self._in_thread(self._serve_cached, items, progress, task)
+
+                try:
+                    await self._arun_batches(sessions, self._batches(items, progress, task), progress, task)
+                    retry = await self._in_thread(self._take_failed, items, progress, task)
+                    if retry:
+                        await self._arun_batches(sessions, self._batches(retry, progress, task), progress, task)
+                finally:
+                    if self._journal is not None:
+                        await self._in_thread(self._journal.close)
+        finally:
+            await asyncio.gather(*(session_manager.close() for session_manager in sessions))
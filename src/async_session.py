@@ -0,0 +1,271 @@
+"""
+asyncio session management for EasyToYou decoder
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import bs4
+
+from exceptions import EasyToYouError, LoginError, NetworkError, SessionExpiredError
+from metrics import Metrics
+from session import BROWSER_HEADERS, RateLimiter, SessionManager, is_login_page, parse_retry_after
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:  # optional dependency, only needed by the async engine
+    aiohttp = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSessionManager:
+    """
+    aiohttp counterpart of SessionManager
+
+    get() and post() return async context managers, so responses are used as
+    ``async with session_manager.get(url) as response:``. ``data`` may be a
+    callable returning the body, for bodies that can only be sent once
+    (aiohttp.FormData) but may need to be replayed.
+    """
+
+    max_throttle_retries = SessionManager.max_throttle_retries
+
+    def __init__(
+        self,
+        base_url: str = "https://easytoyou.eu",
+        pool_size: int = 20,
+        limiter: Optional[RateLimiter] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        if aiohttp is None:
+            raise ImportError("The asyncio engine requires aiohttp (pip install aiohttp)")
+        self.base_url = base_url
+        # Shared with the other sessions; waits happen with asyncio.sleep()
+        self.limiter = limiter
+        self.metrics = metrics
+        self.pool_size = pool_size
+        self.session: Optional["aiohttp.ClientSession"] = None
+        self.is_authenticated = False
+        # Same meaning as SessionManager.queue_ids
+        self.queue_ids: Optional[List[str]] = None
+        # Called (and awaited if it returns an awaitable) after every login
+        self.on_login: Optional[Callable[["AsyncSessionManager"], Any]] = None
+        self.credentials: Optional[Tuple[str, str]] = None
+        self.logins = 0
+
+        self.headers = dict(BROWSER_HEADERS)
+        # aiohttp only decodes brotli when the optional Brotli package is present
+        self.headers["Accept-Encoding"] = "gzip, deflate"
+
+    def setup_session(self) -> "aiohttp.ClientSession":
+        """Setup session with a bounded connection pool"""
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        # unsafe=True also keeps cookies of hosts given as an IP address
+        cookie_jar = aiohttp.CookieJar(unsafe=True)
+        self.session = aiohttp.ClientSession(
+            headers=self.headers, connector=connector, cookie_jar=cookie_jar
+        )
+        return self.session
+
+    async def login(self, username: str, password: str) -> bool:
+        """
+        Login to easytoyou.eu
+
+        Args:
+            username: easytoyou.eu username
+            password: easytoyou.eu password
+
+        Returns:
+            True if login successful
+
+        Raises:
+            LoginError: If login fails
+            NetworkError: If network request fails
+        """
+        logger.info("Attempting to login...")
+
+        if not self.session:
+            self.setup_session()
+
+        login_page = f"{self.base_url}/login"
+        try:
+            async with self.get(login_page, timeout=30) as response:
+                response.raise_for_status()
+                content = await response.read()
+
+            soup = bs4.BeautifulSoup(content, "html.parser")
+            login_form = soup.find("form")
+
+            login_data = {
+                "loginname": username,
+                "password": password,
+            }
+            if login_form:
+                for hidden_input in login_form.find_all("input", type="hidden"):
+                    if hidden_input.get("name") and hidden_input.get("value"):
+                        login_data[str(hidden_input["name"])] = str(hidden_input["value"])
+
+            post_headers = {
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Origin": self.base_url,
+                "Referer": login_page,
+            }
+            async with self.post(
+                login_page, headers=post_headers, data=login_data, allow_redirects=True, timeout=30
+            ) as resp:
+                resp.raise_for_status()
+                final_url = str(resp.url)
+                content = await resp.read()
+        except aiohttp.ClientError as e:
+            logger.error(f"Login request failed: {e}")
+            raise NetworkError(f"Network error during login: {e}")
+        except asyncio.TimeoutError:
+            logger.error("Login request timed out")
+            raise NetworkError("Network error during login: timeout")
+
+        if "/account" in final_url or "dashboard" in final_url.lower():
+            logger.info("Login successful!")
+            self.is_authenticated = True
+            self.credentials = (username, password)
+            self.logins += 1
+            self.queue_ids = None
+            if self.on_login is not None:
+                result = self.on_login(self)
+                if asyncio.iscoroutine(result):
+                    await result
+            return True
+
+        logger.error(f"Login failed. Redirected to: {final_url}")
+        self.is_authenticated = False
+        soup = bs4.BeautifulSoup(content, "html.parser")
+        error_text = " ".join(
+            msg.get_text().strip()
+            for msg in soup.find_all(["div", "span"], class_=["error", "alert-danger"])
+        )
+        raise LoginError(f"Login failed: {error_text}")
+
+    def export_cookies(self) -> List[Dict[str, Any]]:
+        """Return the session cookies in the format of SessionManager.export_cookies()"""
+        if not self.session:
+            return []
+        return [
+            {
+                "name": morsel.key,
+                "value": morsel.value,
+                "domain": morsel["domain"],
+                "path": morsel["path"] or "/",
+                "expires": None,
+                "secure": bool(morsel["secure"]),
+            }
+            for morsel in self.session.cookie_jar
+        ]
+
+    async def restore(self, cookies: List[Dict[str, Any]]) -> bool:
+        """Resume an authenticated session from saved cookies; see SessionManager.restore()"""
+        if not cookies:
+            return False
+        session = self.session or self.setup_session()
+        base = URL(self.base_url)
+        for c in cookies:
+            url = base.with_host(c["domain"].lstrip(".")) if c.get("domain") else base
+            session.cookie_jar.update_cookies({c["name"]: c["value"]}, response_url=url)
+        try:
+            async with self.get(f"{self.base_url}/account", timeout=30) as response:
+                valid = response.status < 400 and "/login" not in str(response.url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Could not validate saved session: {e}")
+            valid = False
+        if not valid:
+            session.cookie_jar.clear()
+        self.is_authenticated = valid
+        return valid
+
+    async def _send(self, method: str, url: str, **kwargs: Any) -> "aiohttp.ClientResponse":
+        # Goes through the rate limiter, backing off on 429
+        timeout = kwargs.get("timeout")
+        if isinstance(timeout, (int, float)):
+            # Same meaning as a requests timeout: connect and per-read limits,
+            # not a cap on the whole transfer
+            kwargs["timeout"] = aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+        data = kwargs.get("data")
+
+        attempt = 0
+        while True:
+            if callable(data):
+                kwargs["data"] = data()
+            if self.limiter is not None:
+                await asyncio.sleep(self.limiter.reserve())
+            response = await self._perform(method, url, **kwargs)
+            if self.limiter is None or response.status != 429 or attempt >= self.max_throttle_retries:
+                break
+            self.limiter.throttle(parse_retry_after(response.headers.get("Retry-After")))
+            response.release()
+            attempt += 1
+
+        if self.limiter is not None and response.status != 429:
+            self.limiter.success()
+        return response
+
+    async def _perform(self, method: str, url: str, **kwargs: Any) -> "aiohttp.ClientResponse":
+        # Same measurements as SessionManager._perform()
+        session = self.session
+        if not session:
+            raise NetworkError("Session not initialized")
+        if self.metrics is None:
+            return await session.request(method, url, **kwargs)
+        try:
+            with self.metrics.phase("http"):
+                response = await session.request(method, url, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.metrics.inc("http_requests", method=method, status="error")
+            raise
+        self.metrics.inc("http_requests", method=method, status=str(response.status))
+        return response
+
+    @staticmethod
+    async def _logged_out(response: "aiohttp.ClientResponse") -> bool:
+        content_type = response.headers.get("content-type", "")
+        # Only HTML is read here; aiohttp keeps the body for later read() calls
+        body = await response.read() if content_type.startswith("text/html") else None
+        logged_out: bool = is_login_page(str(response.url), content_type, body)
+        return logged_out
+
+    @asynccontextmanager
+    async def _request(self, method: str, url: str, **kwargs: Any) -> AsyncIterator["aiohttp.ClientResponse"]:
+        # Same expiry handling as SessionManager.request()
+        response = await self._send(method, url, **kwargs)
+        if self.credentials is not None and "/login" not in url and await self._logged_out(response):
+            logger.warning("Session expired, logging in again")
+            response.release()
+            try:
+                await self.login(*self.credentials)
+            except EasyToYouError as e:
+                raise SessionExpiredError(f"Session expired and login failed: {e}") from e
+            response = await self._send(method, url, **kwargs)
+            if await self._logged_out(response):
+                response.release()
+                raise SessionExpiredError(f"Still logged out after logging in again: {url}")
+        try:
+            yield response
+        finally:
+            response.release()
+
+    def get(self, url: str, **kwargs: Any) -> AsyncContextManager["aiohttp.ClientResponse"]:
+        """Make GET request with session"""
+        return self._request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> AsyncContextManager["aiohttp.ClientResponse"]:
+        """Make POST request with session"""
+        return self._request("POST", url, **kwargs)
+
+    async def close(self) -> None:
+        """Close session"""
+        if self.session:
+            await self.session.close()
+            self.session = None
+            self.is_authenticated = False
+            self.queue_ids = None
@@ -0,0 +1,210 @@
+"""
+Batch planning for EasyToYou uploads
+"""
+
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Set
+
+
+class BatchItem:
+    """A single encoded file scheduled for upload"""
+
+    __slots__ = ("source_path", "dest_path", "rel_path", "upload_name", "digest", "copies", "size")
+
+    def __init__(self, source_path: str, dest_path: str, rel_path: str):
+        self.source_path = source_path
+        self.dest_path = dest_path
+        # Key used in the progress file (relative to the source root, "/" separated)
+        self.rel_path = rel_path
+        # Name the file is uploaded as; unique within its batch
+        self.upload_name = os.path.basename(source_path)
+        # SHA-256 of the encoded content, when a content cache needs it
+        self.digest: Optional[str] = None
+        # Files with identical content that receive this item's decoded output
+        self.copies: List["BatchItem"] = []
+        # Encoded size in bytes; 0 if unknown
+        self.size = 0
+
+    def __repr__(self) -> str:
+        return f"BatchItem({self.rel_path!r} as {self.upload_name!r})"
+
+
+def with_copies(batch: List[BatchItem]) -> List[BatchItem]:
+    """Return the items of a batch followed by all of their duplicates"""
+    return batch + [copy for item in batch for copy in item.copies]
+
+
+def dedupe_items(items: List[BatchItem]) -> List[BatchItem]:
+    """
+    Keep one representative per distinct content digest
+
+    Later items with the same digest are attached to the first one as copies.
+    Items without a digest are always kept.
+
+    Args:
+        items: Files to upload, in scan order
+
+    Returns:
+        The representatives, in scan order
+    """
+    unique: Dict[str, BatchItem] = {}
+    result = []
+    for item in items:
+        representative = unique.get(item.digest) if item.digest else None
+        if representative is None:
+            if item.digest:
+                unique[item.digest] = item
+            result.append(item)
+        else:
+            representative.copies.append(item)
+    return result
+
+
+def unique_upload_name(filename: str, taken: Set[str]) -> str:
+    """
+    Return an upload name for filename that does not collide with taken
+
+    The service names decoded files after the uploaded name, so two files with
+    the same basename in one batch could not be told apart in the archive.
+
+    Args:
+        filename: Original basename
+        taken: Lower-cased names already used in the batch
+
+    Returns:
+        filename itself if free, otherwise "name_N.ext"
+    """
+    if filename.lower() not in taken:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    n = 2
+    while f"{stem}_{n}{ext}".lower() in taken:
+        n += 1
+    return f"{stem}_{n}{ext}"
+
+
+def pack_batches(items: List[BatchItem], batch_size: int = 20) -> List[List[BatchItem]]:
+    """
+    Pack items into upload batches regardless of their directory
+
+    Every batch except the last is filled to batch_size. Items keep their scan
+    order, so files of the same directory still tend to travel together.
+
+    Args:
+        items: Files to upload
+        batch_size: Maximum number of files per upload
+
+    Returns:
+        List of batches with unique upload names inside each batch
+    """
+    batches = []
+    for i in range(0, len(items), batch_size):
+        batch = items[i:i + batch_size]
+        assign_upload_names(batch)
+        batches.append(batch)
+    return batches
+
+
+def assign_upload_names(batch: List[BatchItem]) -> None:
+    """Give every item of a batch an upload name unique within the batch"""
+    taken: Set[str] = set()
+    for item in batch:
+        item.upload_name = unique_upload_name(os.path.basename(item.source_path), taken)
+        taken.add(item.upload_name.lower())
+
+
+class AdaptiveBatcher:
+    """
+    Sizes upload batches from observed request latency, failures and timeouts
+
+    Every batch is capped by a file count and a byte budget. Both limits grow
+    while requests finish well inside target_latency without failures, shrink
+    when requests get slow or keep failing, and are halved on a timeout.
+    record() may be called from several threads.
+    """
+
+    def __init__(
+        self,
+        start_files: int = 20,
+        max_files: int = 100,
+        start_bytes: int = 8 * 1024 * 1024,
+        min_bytes: int = 256 * 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        target_latency: float = 30.0,
+    ):
+        """
+        Args:
+            start_files: Initial file limit per batch
+            max_files: Upper bound for the file limit
+            start_bytes: Initial byte budget per batch
+            min_bytes: Lower bound for the byte budget
+            max_bytes: Upper bound for the byte budget
+            target_latency: Seconds an upload or download should stay under
+        """
+        self.max_files = max(1, max_files)
+        self.min_bytes = min_bytes
+        self.max_bytes = max(min_bytes, max_bytes)
+        self.target_latency = target_latency
+        self.file_limit = min(max(1, start_files), self.max_files)
+        self.byte_limit = min(max(start_bytes, self.min_bytes), self.max_bytes)
+        # Exponentially weighted share of failed requests
+        self.failure_rate = 0.0
+        self._lock = threading.Lock()
+
+    def _scale(self, factor: float) -> None:
+        if factor > 1:
+            files = max(self.file_limit + 1, int(self.file_limit * factor))
+        else:
+            files = int(self.file_limit * factor)
+        self.file_limit = min(max(1, files), self.max_files)
+        self.byte_limit = min(max(int(self.byte_limit * factor), self.min_bytes), self.max_bytes)
+
+    def record(self, latency: float, ok: bool, timed_out: bool = False) -> None:
+        """
+        Feed back the outcome of one upload or download request
+
+        Args:
+            latency: Seconds the request took
+            ok: Whether it succeeded
+            timed_out: Whether it failed with a timeout
+        """
+        with self._lock:
+            self.failure_rate = 0.8 * self.failure_rate + (0.0 if ok else 0.2)
+            if timed_out:
+                self._scale(0.5)
+            elif latency > self.target_latency or self.failure_rate > 0.25:
+                self._scale(0.75)
+            elif ok and latency < self.target_latency / 2 and self.failure_rate < 0.1:
+                self._scale(1.25)
+
+    def take(self, pending: Deque[BatchItem]) -> List[BatchItem]:
+        """
+        Remove the next batch from the front of pending
+
+        A single file larger than the byte budget still makes up a batch of
+        its own.
+        """
+        with self._lock:
+            file_limit, byte_limit = self.file_limit, self.byte_limit
+        batch: List[BatchItem] = []
+        size = 0
+        while pending and len(batch) < file_limit:
+            if batch and size + pending[0].size > byte_limit:
+                break
+            item = pending.popleft()
+            batch.append(item)
+            size += item.size
+        assign_upload_names(batch)
+        return batch
+
+    def batches(self, items: Iterable[BatchItem]) -> Iterator[List[BatchItem]]:
+        """Yield batches lazily, so each one is sized with the latest feedback"""
+        pending = deque(items)
+        while pending:
+            yield self.take(pending)
+
+    def describe(self) -> str:
+        with self._lock:
+            return f"{self.file_limit} files / {self.byte_limit / (1024 * 1024):.1f} MB"
@@ -0,0 +1,104 @@
+"""
+Encrypted cache of authenticated session cookies
+"""
+
+import base64
+import io
+import json
+import os
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+except ImportError:  # optional dependency, only needed for the cookie cache
+    Fernet = None  # type: ignore[assignment,misc]
+
+from decode_cache import write_atomic
+
+logger = logging.getLogger(__name__)
+
+_SALT_SIZE = 16
+_KDF_ITERATIONS = 200_000
+
+Cookie = Dict[str, Any]
+
+
+class CookieCache:
+    """
+    Session cookies of previous runs, encrypted at rest
+
+    The file holds a random salt followed by a Fernet token. The key is
+    derived from the account credentials with PBKDF2, so the file is useless
+    without them and a password change simply invalidates it. Cookies are
+    stored per session slot, because every worker session has its own
+    decoder queue on the server.
+    """
+
+    def __init__(self, path: str, username: str, password: str):
+        """
+        Args:
+            path: Cache file
+            username: Account the cookies belong to
+            password: Account password; part of the encryption key
+
+        Raises:
+            ImportError: If the cryptography package is not installed
+        """
+        if Fernet is None:
+            raise ImportError("The cookie cache requires cryptography (pip install cryptography)")
+        self.path = path
+        self._secret = f"{username}\0{password}".encode("utf-8")
+        self._salt: Optional[bytes] = None
+        self._fernet: Optional["Fernet"] = None
+        self._slots: Dict[str, List[Cookie]] = {}
+        self._lock = threading.Lock()
+        self._read()
+
+    def _key(self, salt: bytes) -> "Fernet":
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=_KDF_ITERATIONS)
+        return Fernet(base64.urlsafe_b64encode(kdf.derive(self._secret)))
+
+    def _read(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"Could not read cookie cache {self.path}: {e}")
+            return
+        salt, token = blob[:_SALT_SIZE], blob[_SALT_SIZE:]
+        try:
+            fernet = self._key(salt)
+            self._slots = json.loads(fernet.decrypt(token))
+        except (InvalidToken, ValueError):
+            # Other credentials, or a damaged file: start over
+            logger.info("Cookie cache not readable with these credentials, ignoring it")
+            return
+        self._salt, self._fernet = salt, fernet
+
+    def load(self, slot: int = 0) -> List[Cookie]:
+        """Return the unexpired cookies stored for a session slot"""
+        now = time.time()
+        with self._lock:
+            cookies = self._slots.get(str(slot), [])
+        return [c for c in cookies if not c.get("expires") or c["expires"] > now]
+
+    def save(self, slot: int, cookies: List[Cookie]) -> None:
+        """Store the cookies of a session slot and rewrite the file"""
+        with self._lock:
+            self._slots[str(slot)] = cookies
+            if self._salt is None or self._fernet is None:
+                self._salt = os.urandom(_SALT_SIZE)
+                self._fernet = self._key(self._salt)
+            blob = self._salt + self._fernet.encrypt(json.dumps(self._slots).encode("utf-8"))
+            try:
+                # Created readable by the owner only
+                write_atomic(os.path.abspath(self.path), io.BytesIO(blob))
+            except OSError as e:
+                logger.warning(f"Could not save cookie cache {self.path}: {e}")
@@ -0,0 +1,142 @@
+"""
+Content-addressed cache of decoded files
+"""
+
+import os
+import tempfile
+import threading
+import logging
+from typing import IO, Optional
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def write_atomic(path: str, src: IO[bytes]) -> int:
+    """
+    Copy src to path through a temporary file in the same directory
+
+    Readers never see a partially written entry, even if several processes
+    store the same entry at once. The file is readable by the owner only.
+
+    Returns:
+        Number of bytes written
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as dst:
+            while True:
+                chunk = src.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return size
+
+
+class DecodeCache:
+    """
+    Maps the hash of an encoded file to its decoded output
+
+    Entries are stored before watermarking, per decoder version, so the same
+    vendor file is decoded by the service only once across runs and projects.
+    The total size is capped; the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory: str, decoder: str, max_bytes: int = 1024 * 1024 * 1024):
+        """
+        Args:
+            directory: Cache root, shared between runs
+            decoder: Decoder version; part of every key
+            max_bytes: Size cap for the whole cache
+        """
+        self.directory = directory
+        self.decoder = decoder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = self._measure()
+
+    def _measure(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def path_for(self, digest: str) -> str:
+        """Location of the entry for an encoded file's digest"""
+        return os.path.join(self.directory, self.decoder, digest[:2], digest)
+
+    def get(self, digest: str) -> Optional[str]:
+        """Return the path of a cached entry, or None on a miss"""
+        path = self.path_for(digest)
+        try:
+            # mtime doubles as the last-used time for LRU eviction
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, digest: str, src: IO[bytes]) -> None:
+        """Store the decoded output read from src"""
+        self.added(write_atomic(self.path_for(digest), src))
+
+    def added(self, size: int) -> None:
+        """Account for an entry written directly to path_for(), e.g. by a worker process"""
+        with self._lock:
+            self._size += size
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache is under 90% of its cap"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+
+        with self._lock:
+            self._size = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 9 // 10
+            removed = 0
+            for _, size, path in entries:
+                if self._size <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                self._size -= size
+                removed += 1
+        if removed:
+            logger.info(f"Decode cache: evicted {removed} entries")
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
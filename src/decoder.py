@@ -1,31 +1,49 @@
-﻿import json
+﻿import asyncio
+import io
+import itertools
 import os
 import re
+import socket
 import sys
 import shutil
+import tempfile
 import threading
 import urllib.parse
 import zipfile
-from io import BytesIO
-from typing import Callable, List, Optional, Tuple, TypeVar
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait,
+)
+from contextlib import contextmanager
+from typing import IO, TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar, Union
 
-import bs4
 import requests
 import time
 import logging
 
 from rich.progress import (
-    Progress, SpinnerColumn, BarColumn, TextColumn,
+    Progress, SpinnerColumn, BarColumn, TaskID, TextColumn,
     TimeElapsedColumn, TimeRemainingColumn,
 )
 from rich.console import Console
 
-from session import SessionManager
+from cookie_cache import CookieCache
+from batching import AdaptiveBatcher, BatchItem, dedupe_items, pack_batches, with_copies
+from decode_cache import DecodeCache, write_atomic
+from journal import ProgressJournal
+from metrics import Metrics, MetricsReporter
+from multipart import FilePart, MultipartEncoder, split_parts
+from tracing import Tracer
+import parsing
+from pipeline import Pipeline, Stage
+from retry import FATAL, RetryPolicy, classify
+from watermark import WatermarkEngine
+from session import RateLimiter, SessionManager
+from scan_cache import ScanCache
 from utils import (
-    is_ioncube_file,
-    find_ioncube_files,
+    ScanIndex,
+    scan_tree,
     create_directory,
-    batch_list,
+    file_digest,
     get_file_info,
 )
 from exceptions import (
@@ -34,13 +52,92 @@ from exceptions import (
     UploadError,
     DownloadError,
     FormNotFoundError,
+    SessionExpiredError,
 )
 
+if TYPE_CHECKING:
+    from async_session import AsyncSessionManager
+
 logger = logging.getLogger(__name__)
 console = Console()
 
 T = TypeVar("T")
 
+CHUNK_SIZE = 64 * 1024
+
+# Plain fields of an upload request, after the files
+UPLOAD_FIELDS = [("submit", "Decode")]
+
+# Smallest gap between the two empty-queue checks of a queue clear. Kept even
+# when the rate limiter is off (--rate 0), so the checks are never back to back
+QUEUE_RECHECK_INTERVAL = 0.5
+
+
+_engines: Dict[str, WatermarkEngine] = {}
+
+
+def _is_timeout(exc: Optional[BaseException]) -> bool:
+    # Timeouts are often wrapped (e.g. in UploadError), so follow the chain
+    seen = 0
+    while exc is not None and seen < 10:
+        if isinstance(exc, (requests.exceptions.Timeout, asyncio.TimeoutError, socket.timeout)):
+            return True
+        exc = exc.__cause__ or exc.__context__
+        seen += 1
+    return False
+
+
+def _write_member(engine: WatermarkEngine, src: IO[bytes], dst: IO[bytes], is_php: bool) -> None:
+    if not is_php:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        return
+    try:
+        engine.rewrite_stream(src, dst)
+    except Exception as e:
+        # Nothing is written before the header is rewritten; copy it unchanged
+        logger.warning(f"Watermark replacement failed: {e}")
+        src.seek(0)
+        dst.seek(0)
+        dst.truncate()
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def _extract_member(
+    archive_path: str, name: str, dest_path: str, watermark: str, cache_path: Optional[str] = None
+) -> int:
+    # Runs in a worker process: reopens the archive by path so only the member
+    # name travels between processes, never its content. Returns the number
+    # of bytes added to the decode cache.
+    engine = _engines.get(watermark)
+    if engine is None:
+        engine = _engines[watermark] = WatermarkEngine(watermark)
+    with zipfile.ZipFile(archive_path) as zf:
+        with zf.open(name) as src, open(dest_path, "wb") as dst:
+            _write_member(engine, src, dst, os.path.basename(name).lower().endswith(".php"))
+        if cache_path is None:
+            return 0
+        try:
+            with zf.open(name) as src:
+                written: int = write_atomic(cache_path, src)
+                return written
+        except Exception as e:
+            logger.warning(f"Could not store {name} in decode cache: {e}")
+            return 0
+
+
+class _PipelineJob:
+    """A batch travelling through the upload/download/extract pipeline"""
+
+    def __init__(self, batch: List[BatchItem], label: str):
+        self.batch = batch
+        self.label = label
+        self.session: Optional[SessionManager] = None
+        self.success: List[str] = []
+        self.failure: List[str] = []
+        self.archive: Optional[IO[bytes]] = None
+        # Session login count at upload time; see _upload_and_fetch()
+        self.logins = 0
+
 
 class IonicubeDecoder:
 
@@ -51,85 +148,211 @@ class IonicubeDecoder:
         decoder: str = "ic11php74",
         custom_watermark: Optional[str] = None,
         max_retries: int = 4,
+        use_scan_cache: bool = True,
+        rescan: bool = False,
+        workers: int = 1,
+        batch_size: int = 20,
+        adaptive_batching: bool = True,
+        batch_bytes: int = 8 * 1024 * 1024,
+        pipeline: bool = False,
+        spool_threshold: int = 8 * 1024 * 1024,
+        process_workers: int = 0,
+        cache_dir: Optional[str] = None,
+        cache_size: int = 1024 * 1024 * 1024,
+        dedupe: bool = True,
+        rate_limit: float = 5.0,
+        cookie_cache: Optional[str] = None,
+        retry_budget: int = 50,
+        selective_download: int = 5,
+        metrics_file: Optional[str] = None,
+        prometheus_file: Optional[str] = None,
+        metrics_interval: float = 10.0,
+        base_url: str = "https://easytoyou.eu",
+        profile_file: Optional[str] = None,
+        max_request_bytes: int = 0,
     ):
         self.username = username
         self.password = password
         self.decoder = decoder
         self.max_retries = max_retries
-        self.base_url = "https://easytoyou.eu"
+        # The only retry layer: max_retries attempts per batch, retry_budget
+        # retries per run, and one circuit breaker for all workers
+        self.retry_policy = RetryPolicy(max_attempts=max_retries, run_budget=retry_budget)
+        # Halves of a failed batch get a short policy, drawing from the same
+        # run budget; see _batch_failed()
+        self.bisect_policy = self.retry_policy.derive(max_attempts=2, base_delay=1.0, max_delay=10.0)
+        self.bisected = 0
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        # Largest upload request body; larger batches are sent in several
+        # requests. 0 leaves the size to the batch limits
+        self.max_request_bytes = max(0, max_request_bytes)
+        # batch_size and batch_bytes are starting points that follow observed
+        # latency, failures and timeouts; fixed-size batches otherwise
+        self.batcher: Optional[AdaptiveBatcher] = (
+            AdaptiveBatcher(
+                start_files=self.batch_size,
+                max_files=max(self.batch_size, 100),
+                start_bytes=batch_bytes,
+                max_bytes=min(64 * 1024 * 1024, self.max_request_bytes or 64 * 1024 * 1024),
+            )
+            if adaptive_batching else None
+        )
+        self.pipeline = pipeline
+        # Downloaded archives larger than this spill from memory to a temp file
+        self.spool_threshold = spool_threshold
+        # Watermarking and writes go to a process pool when this is > 0
+        self.process_workers = max(0, process_workers)
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        # Decoded output shared across runs, keyed by encoded content
+        self.decode_cache: Optional[DecodeCache] = (
+            DecodeCache(cache_dir, decoder, cache_size) if cache_dir else None
+        )
+        # Upload identical files once and copy the result to every duplicate
+        self.dedupe = dedupe
+        self.dedup_saved = 0
+        # Batches with up to this many decoded files fetch them by queue ID
+        # instead of the id=all archive of the whole queue; 0 disables it
+        self.selective_download = max(0, selective_download)
+        self.selective_batches = 0
+        self.selective_skipped = 0
+        self._selective_bytes = 0
+        self._selective_files = 0
+        # Service root; a local mock_server.MockServer in benchmarks
+        self.base_url = base_url.rstrip("/")
 
         self.custom_watermark = custom_watermark or (
             "/*\n * Decoded by RBW-Tech\n * https://rbwtech.io\n */\n\n"
         )
 
-        self.session_manager = SessionManager(self.base_url)
+        self._watermark_engine = WatermarkEngine(self.custom_watermark)
+
+        # Spans for a Chrome trace of the run; recorded only with a profile file
+        self.profile_file = profile_file
+        self.tracer = Tracer(enabled=profile_file is not None)
+        # Phase timings and counters of the run, optionally exported while it runs
+        self.metrics = Metrics(self.tracer)
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        self.metrics_interval = metrics_interval
+
+        # One token bucket paces every session of this decoder; 0 disables it
+        self.rate_limiter: Optional[RateLimiter] = RateLimiter(rate_limit) if rate_limit > 0 else None
+        self._session_manager = SessionManager(self.base_url, self.rate_limiter, self.metrics)
+        # Worker threads bind their own session; see _bind_session()
+        self._local = threading.local()
+        self._worker_sessions: List[SessionManager] = []
+        # Logged in ahead of the run, for the first worker thread to take over
+        self._spare_sessions: List[SessionManager] = []
+        # Slot 0 is the main session; worker sessions take the following ones
+        self._next_slot = 1
+        # Set by the first rejected login; stops the run; see _abort_on()
+        self._aborted: Optional[LoginError] = None
+
+        # Saved session cookies, so short runs can skip the login flow
+        self.cookie_cache: Optional[CookieCache] = None
+        if cookie_cache:
+            try:
+                self.cookie_cache = CookieCache(cookie_cache, username, password)
+            except ImportError as e:
+                logger.warning(f"{e}; logging in without the cookie cache")
 
         self.not_decoded: List[str] = []
         self.processed_count = 0
+        # Uploads that needed no queue clear because the queue state was known
+        self.clears_skipped = 0
         self.total_files = 0
         self._lock = threading.Lock()
         self.progress_file: str = ""
         self._done_files: set = set()
+        self._journal: Optional[ProgressJournal] = None
         self._source_root: str = ""
+        self.scan_index: Optional[ScanIndex] = None
+        self.use_scan_cache = use_scan_cache
+        self.rescan = rescan
+        self.scan_cache_file: str = ""
+
+    @property
+    def session_manager(self) -> SessionManager:
+        return getattr(self._local, "session_manager", None) or self._session_manager
+
+    @contextmanager
+    def _bind_session(self, session_manager: SessionManager) -> Iterator[SessionManager]:
+        # Route session_manager to the given session for the current thread
+        previous = getattr(self._local, "session_manager", None)
+        self._local.session_manager = session_manager
+        try:
+            yield session_manager
+        finally:
+            self._local.session_manager = previous
 
-    def _retry(self, fn: Callable[[], T], delays: Optional[List[int]] = None) -> T:
-        if delays is None:
-            delays = [5, 15, 45, 120]
-        last_exc: Optional[Exception] = None
-        for attempt in range(self.max_retries):
-            try:
-                return fn()
-            except Exception as exc:
-                last_exc = exc
-                if attempt < self.max_retries - 1:
-                    wait = delays[min(attempt, len(delays) - 1)]
-                    logger.warning(f"Attempt {attempt + 1}/{self.max_retries} failed: {exc}. Retrying in {wait}s")
-                    time.sleep(wait)
-                else:
-                    logger.error(f"All {self.max_retries} attempts exhausted: {exc}")
-        raise last_exc  # type: ignore[misc]
-
-    def _replace_watermark(self, content: bytes) -> bytes:
+    def _worker_session(self) -> SessionManager:
+        # Each worker thread logs in once and keeps its own session and queue
+        session_manager = getattr(self._local, "worker_session", None)
+        if session_manager is None:
+            with self._lock:
+                session_manager = self._spare_sessions.pop() if self._spare_sessions else None
+            if session_manager is None:
+                session_manager, _ = self._open_worker_session()
+            self._local.worker_session = session_manager
+        return session_manager
+
+    def _open_worker_session(self) -> Tuple[SessionManager, bool]:
+        session_manager = SessionManager(self.base_url, self.rate_limiter, self.metrics)
+        with self._lock:
+            slot = self._next_slot
+            self._next_slot += 1
+            # Closed with the others even if the login fails
+            self._worker_sessions.append(session_manager)
+        return session_manager, self._authenticate(session_manager, slot)
+
+    def _login_workers(self) -> bool:
+        # Only the first worker session logs in before the run, so rejected
+        # credentials stop it with one attempt instead of one per worker
+        logged_in = False
         try:
-            content_str: str
-            if isinstance(content, bytes):
-                for encoding in ("utf-8", "latin-1", "cp1252"):
-                    try:
-                        content_str = content.decode(encoding)
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                else:
-                    content_str = content.decode("utf-8", errors="replace")
-            else:
-                content_str = content
-
-            patterns = [
-                r"/\*\s*\*\s*@\s*https://EasyToYou\.eu.*?\*/\s*\n*",
-                r"/\*[^*]*\*\s*@\s*https://EasyToYou\.eu.*?\*/\s*\n*",
-                r"//\s*Decoded\s*file\s*for\s*php\s*version.*?\n",
-                r"/\*.*?EasyToYou\.eu.*?\*/\s*\n*",
-                r"//.*?EasyToYou\.eu.*?\n",
-            ]
-            for pattern in patterns:
-                content_str = re.sub(pattern, "", content_str, flags=re.DOTALL | re.IGNORECASE)
-
-            content_str = re.sub(r"//\s*Decoder\s*version:.*?\n", "", content_str, flags=re.IGNORECASE)
-            content_str = re.sub(r"//\s*Release:.*?\n", "", content_str, flags=re.IGNORECASE)
-            content_str = re.sub(r"//\s*PHP\s*\d+\.\d+.*?\n", "", content_str, flags=re.IGNORECASE)
-
-            php_pattern = r"(<\?php\s*)"
-            if re.search(php_pattern, content_str, re.IGNORECASE):
-                content_str = re.sub(
-                    php_pattern, r"\1\n" + self.custom_watermark,
-                    content_str, count=1, flags=re.IGNORECASE,
-                )
-            else:
-                content_str = self.custom_watermark + content_str
+            session_manager, logged_in = self._open_worker_session()
+        finally:
+            if not logged_in:
+                self._close_worker_sessions()
+        if not logged_in:
+            return False
+        with self._lock:
+            self._spare_sessions.append(session_manager)
+        return True
 
-            content_str = re.sub(r"\n{3,}", "\n\n", content_str)
-            return content_str.encode("utf-8")
+    def _close_worker_sessions(self) -> None:
+        with self._lock:
+            sessions, self._worker_sessions = self._worker_sessions, []
+            self._spare_sessions = []
+        for session_manager in sessions:
+            session_manager.close()
+
+    def _abort_on(self, exc: BaseException) -> bool:
+        """
+        Stop the run if exc is a rejected login
+
+        Every later batch would fail the same way, and repeated failed logins
+        risk locking the account. Returns whether the run is stopping.
+        """
+        if not isinstance(exc, LoginError):
+            return False
+        with self._lock:
+            if self._aborted is None:
+                self._aborted = exc
+                logger.error(f"Login rejected, stopping the run: {exc}")
+        return True
 
+    def _retry(self, fn: Callable[[], T]) -> T:
+        result: T = self.retry_policy.call(fn)
+        return result
+
+    def _replace_watermark(self, content: bytes) -> bytes:
+        try:
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            rewritten: bytes = self._watermark_engine.rewrite(content)
+            return rewritten
         except Exception as e:
             logger.warning(f"Watermark replacement failed: {e}")
             return content
@@ -137,33 +360,64 @@ class IonicubeDecoder:
     def replace_watermark(self, content: bytes) -> bytes:
         return self._replace_watermark(content)
 
+    def _authenticate(self, session_manager: SessionManager, slot: int) -> bool:
+        with self.metrics.phase("login"):
+            return self._restore_or_login(session_manager, slot)
+
+    def _restore_or_login(self, session_manager: SessionManager, slot: int) -> bool:
+        # Saved cookies are tried first (one request); full login otherwise.
+        # Every later login, including re-logins after expiry, refreshes them.
+        cache = self.cookie_cache
+        restored = False
+        if cache is not None:
+            session_manager.on_login = lambda sm: cache.save(slot, sm.export_cookies())
+            restored = session_manager.restore(cache.load(slot))
+        if restored:
+            # Lets the session log in again by itself if it expires mid-run
+            session_manager.credentials = (self.username, self.password)
+            logger.info(f"Resumed saved session {slot}")
+            return True
+        # Network errors are retried; a rejected login (LoginError) is not
+        logged_in: bool = self._retry(lambda: session_manager.login(self.username, self.password))
+        return logged_in
+
     def login(self) -> bool:
-        return self.session_manager.login(self.username, self.password)
+        return self._authenticate(self.session_manager, 0)
+
+    def file_info(self, filepath: str) -> dict:
+        # Reuses the last scan so the file header is not sniffed again
+        info: dict = get_file_info(filepath, self.scan_index)
+        return info
 
     def clear_decoder_queue(self) -> None:
         # Page 1 always shows the first 10; after deleting, the next batch slides into page 1.
         # Loop on page 1 until it's empty -- no need to paginate.
         decoder_url = f"{self.base_url}/decoder/{self.decoder}"
+        session_manager = self.session_manager
+        session_manager.queue_ids = None
+        self.metrics.inc("queue_clears")
         cleared = 0
         consecutive_empty = 0
 
         while True:
             try:
+                polled = time.monotonic()
                 response = self.session_manager.get(decoder_url, timeout=30)
                 response.raise_for_status()
 
-                soup = bs4.BeautifulSoup(response.content, "html.parser")
-                file_inputs = soup.find_all("input", attrs={"name": "file[]"})
-
-                if not file_inputs:
+                vals = self._queued_file_ids(response.content)
+                if not vals:
+                    # Checked twice, with some time in between
                     consecutive_empty += 1
                     if consecutive_empty >= 2:
+                        session_manager.queue_ids = []
                         break
-                    time.sleep(0.5)
+                    wait = QUEUE_RECHECK_INTERVAL - (time.monotonic() - polled)
+                    if wait > 0:
+                        time.sleep(wait)
                     continue
 
                 consecutive_empty = 0
-                vals = [inp["value"] for inp in file_inputs if inp.get("value")]
                 self.session_manager.post(
                     decoder_url,
                     data={"file[]": vals, "submit": "Delete"},
@@ -172,7 +426,6 @@ class IonicubeDecoder:
                 )
                 cleared += len(vals)
                 logger.debug(f"Queue clear: deleted {len(vals)} (total {cleared})")
-                time.sleep(0.3)
 
             except Exception as e:
                 logger.warning(f"Queue clear error: {e}")
@@ -181,7 +434,63 @@ class IonicubeDecoder:
         if cleared:
             logger.info(f"Queue cleared ({cleared} files removed)")
 
-    def upload_files(self, source_dir: str, files: List[str]) -> Tuple[List[str], List[str]]:
+    def _prepare_queue(self) -> None:
+        """Empty the session's decoder queue before an upload, as cheaply as possible"""
+        session_manager = self.session_manager
+        known = session_manager.queue_ids
+        if known is None:
+            # Fresh session, resumed run or an earlier error: full clear
+            self.clear_decoder_queue()
+            return
+
+        with self._lock:
+            self.clears_skipped += 1
+        if not known:
+            logger.debug("Queue known empty, skipping clear")
+            return
+
+        decoder_url = f"{self.base_url}/decoder/{self.decoder}"
+        try:
+            response = session_manager.post(
+                decoder_url,
+                data={"file[]": known, "submit": "Delete"},
+                headers={"Referer": decoder_url},
+                timeout=30,
+            )
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Deleting {len(known)} known queue entries failed: {e}")
+            self.clear_decoder_queue()
+            return
+        session_manager.queue_ids = []
+        logger.debug(f"Queue: deleted {len(known)} known entries")
+
+    def _note_queue(
+        self, session_manager: Union[SessionManager, "AsyncSessionManager"], content: bytes, uploaded: int
+    ) -> None:
+        # The decoder page lists the queue (first page only). Before the upload
+        # the queue was empty, so the listing is complete if it shows at least
+        # every uploaded file; otherwise the state is unknown.
+        ids = self._queued_file_ids(content)
+        session_manager.queue_ids = ids if len(ids) >= uploaded else None
+
+    @staticmethod
+    def _queued_file_ids(content: bytes) -> List[str]:
+        ids: List[str] = parsing.queued_file_ids(content)
+        return ids
+
+    @staticmethod
+    def _upload_input_name(content: bytes) -> str:
+        name: Optional[str] = parsing.upload_input_name(content)
+        if name is None:
+            raise FormNotFoundError("Upload form not found on page")
+        return name
+
+    def upload_files(
+        self, source_dir: str, files: List[str], upload_names: Optional[List[str]] = None
+    ) -> Tuple[List[str], List[str]]:
+        # upload_names, if given, runs parallel to files and sets the name each
+        # file is uploaded (and later downloaded) as.
         if not files:
             return [], []
 
@@ -190,121 +499,345 @@ class IonicubeDecoder:
         )
         response.raise_for_status()
 
-        soup = bs4.BeautifulSoup(response.content, "html.parser")
-        upload_input = (
-            soup.find("input", id="uploadfileblue")
-            or soup.find("input", type="file")
-            or soup.find("input", attrs={"name": lambda x: x and "file" in x.lower()})
-        )
-
-        if not upload_input:
-            raise FormNotFoundError("Upload form not found on page")
-
-        input_name = upload_input.get("name", "uploadfile[]")
-
-        file_objects = []
-        upload_fields = []
+        input_name = self._upload_input_name(response.content)
 
+        parts = []
+        for i, filename in enumerate(files):
+            filepath = os.path.join(source_dir, filename)
+            upload_name = upload_names[i] if upload_names else filename
+            if filename.lower().endswith(".php") and os.path.exists(filepath):
+                try:
+                    parts.append(FilePart(input_name, upload_name, filepath, "application/x-php"))
+                except OSError as e:
+                    logger.warning(f"Could not open {filename}: {e}")
+
+        if not parts:
+            return [], files
+
+        groups, failure = self._split_upload(parts)
+        success: List[str] = []
+        content = b""
+        for group in groups:
+            post_response = self._post_upload(group)
+            group_success, group_failure = self._parse_upload_result(post_response)
+            success.extend(group_success)
+            failure.extend(group_failure)
+            content = post_response.content
+        if groups:
+            # The last answer lists the queue with the files of every request
+            self._note_queue(self.session_manager, content, len(success))
+        return success, failure
+
+    def _split_upload(self, parts: List[FilePart]) -> Tuple[List[List[FilePart]], List[str]]:
+        # Returns the request groups and the names of files too large to send
+        groups, too_large = split_parts(parts, self.max_request_bytes, UPLOAD_FIELDS)
+        for part in too_large:
+            logger.error(
+                f"{part.filename} ({part.size / 1024 / 1024:.1f} MB) exceeds the "
+                f"{self.max_request_bytes / 1024 / 1024:.1f} MB request limit, not uploading it"
+            )
+        if len(groups) > 1:
+            logger.info(f"Upload of {len(parts)} files split into {len(groups)} requests")
+        return groups, [part.filename for part in too_large]
+
+    def _post_upload(self, parts: List[FilePart]) -> requests.Response:
+        # The body is streamed from the files as it is sent. Not retried here:
+        # the caller's retry policy repeats the whole batch, including the
+        # queue clear this upload depends on.
+        decoder_url = f"{self.base_url}/decoder/{self.decoder}"
+        body = MultipartEncoder(parts, UPLOAD_FIELDS)
         try:
-            for filename in files:
-                filepath = os.path.join(source_dir, filename)
-                if filename.endswith(".php") and os.path.exists(filepath):
-                    try:
-                        fobj = open(filepath, "rb")
-                        file_objects.append(fobj)
-                        upload_fields.append((input_name, (filename, fobj, "application/x-php")))
-                    except Exception as e:
-                        logger.warning(f"Could not open {filename}: {e}")
-
-            if not upload_fields:
-                return [], files
-
-            upload_fields.append(("submit", (None, "Decode")))
-
-            def do_post() -> requests.Response:
-                return self.session_manager.post(
-                    f"{self.base_url}/decoder/{self.decoder}",
-                    headers={"Referer": f"{self.base_url}/decoder/{self.decoder}"},
-                    files=upload_fields,
+            # The service decodes before it answers, so this includes the
+            # server-side decode time
+            with self.metrics.phase("upload"):
+                post_response = self.session_manager.post(
+                    decoder_url,
+                    headers={"Referer": decoder_url, "Content-Type": body.content_type},
+                    data=body,
                     timeout=120,
                 )
-
-            post_response = self._retry(do_post)
             post_response.raise_for_status()
-
         except Exception as e:
+            self.session_manager.queue_ids = None
             logger.error(f"Upload failed: {e}")
-            raise UploadError(f"Failed to upload files: {e}")
+            raise UploadError(f"Failed to upload files: {e}") from e
         finally:
-            for fobj in file_objects:
-                try:
-                    fobj.close()
-                except Exception:
-                    pass
-
-        return self._parse_upload_result(post_response)
+            body.close()
+        self.metrics.inc("bytes_up", sum(part.size for part in parts))
+        self.metrics.inc("files_uploaded", len(parts))
+        return post_response
 
     def _parse_upload_result(self, response) -> Tuple[List[str], List[str]]:
+        return self._parse_upload_html(response.content)
+
+    def _parse_upload_html(self, content: bytes) -> Tuple[List[str], List[str]]:
         try:
-            soup = bs4.BeautifulSoup(response.content, "html.parser")
-            success, failure = [], []
+            result: Tuple[List[str], List[str]] = parsing.upload_result(content)
+            return result
+        except Exception as e:
+            logger.error(f"Error parsing upload result: {e}")
+            return [], []
 
-            for el in soup.find_all(["div", "span"], class_=["alert-success", "success"]):
-                parts = el.get_text().split()
-                if len(parts) > 1:
-                    success.append(parts[1])
+    def _fetch_archive(self) -> IO[bytes]:
+        response = self.session_manager.get(
+            f"{self.base_url}/download.php?id=all", timeout=120, stream=True
+        )
+        try:
+            response.raise_for_status()
 
-            for el in soup.find_all(["div", "span"], class_=["alert-danger", "error", "danger"]):
-                parts = el.get_text().split()
-                if len(parts) > 3:
-                    failure.append(parts[3])
+            if not response.headers.get("content-type", "").startswith("application/zip"):
+                raise DownloadError("Response is not a ZIP archive")
+
+            archive = self._new_archive()
+            size = 0
+            try:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    archive.write(chunk)
+                    size += len(chunk)
+                archive.seek(0)
+            except BaseException:
+                self._discard_archive(archive)
+                raise
+            self.metrics.inc("bytes_down", size)
+            return archive
+        finally:
+            response.close()
+
+    def _new_archive(self) -> IO[bytes]:
+        # A spooled file: small archives stay in memory, large ones go to
+        # disk, so memory use does not grow with the batch. Pool workers
+        # reopen the archive by name, so then it must be on disk.
+        if self._process_pool is not None:
+            return tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_threshold)
+
+    def _selected_ids(
+        self, session_manager: Union[SessionManager, "AsyncSessionManager"], success: List[str]
+    ) -> Optional[Dict[str, str]]:
+        """
+        Map queue IDs to the decoded files of the current batch
+
+        Returns:
+            {queue ID: upload name} when the batch is small enough to fetch
+            file by file, the queue holds other entries as well, and every
+            decoded file has exactly one queue entry
+            (an ID equal to the name, else the one ID containing it); None to
+            download the id=all archive
+        """
+        if not self.selective_download or not success or len(success) > self.selective_download:
+            return None
+        queue = session_manager.queue_ids
+        if not queue:
+            return None
+        ids: Dict[str, str] = {}
+        for name in success:
+            matches = [file_id for file_id in queue if file_id == name] or [
+                file_id for file_id in queue if name.lower() in file_id.lower()
+            ]
+            if len(matches) != 1:
+                return None
+            ids[matches[0]] = name
+        if len(ids) == len(queue):
+            # Nothing else is queued, so one archive request fetches the same
+            return None
+        return ids
+
+    def _add_member(self, zf: zipfile.ZipFile, name: str, content_type: str, body: bytes) -> int:
+        # Packs one downloaded queue entry into the batch archive
+        if content_type.startswith("application/zip"):
+            with zipfile.ZipFile(io.BytesIO(body)) as single:
+                for info in single.infolist():
+                    zf.writestr(info.filename, single.read(info))
+        elif content_type.startswith("text/html") and not body.lstrip().startswith(b"<?php"):
+            raise DownloadError(f"Response for {name} is not a decoded file")
+        else:
+            zf.writestr(name, body)
+        return len(body)
+
+    def _note_selective(self, ids: Dict[str, str], size: int, queued: int) -> None:
+        skipped = queued - len(ids)
+        self.metrics.inc("bytes_down", size)
+        with self._lock:
+            self.selective_batches += 1
+            self.selective_skipped += skipped
+            self._selective_bytes += size
+            self._selective_files += len(ids)
+        logger.debug(f"Fetched {len(ids)} files by ID ({size / 1024:.1f} KB), skipped {skipped} queue entries")
+
+    def _fetch_results(self, success: List[str]) -> IO[bytes]:
+        """
+        Download the decoded files of the current batch on the bound session
+
+        When the queue holds more than this batch, small batches are fetched
+        file by file (``download.php?id=<queue ID>``) and packed into an
+        archive like the id=all one, so the other entries are not downloaded.
+        Otherwise the id=all archive is used.
+        """
+        with self.metrics.phase("download"):
+            ids = self._selected_ids(self.session_manager, success)
+            if ids is None:
+                return self._fetch_archive()
+            return self._fetch_files(ids)
+
+    def _fetch_files(self, ids: Dict[str, str]) -> IO[bytes]:
+        session_manager = self.session_manager
+        archive = self._new_archive()
+        size = 0
+        try:
+            with zipfile.ZipFile(archive, "w") as zf:
+                for file_id, name in ids.items():
+                    response = session_manager.get(
+                        f"{self.base_url}/download.php?id={urllib.parse.quote(file_id)}", timeout=120
+                    )
+                    response.raise_for_status()
+                    size += self._add_member(
+                        zf, name, response.headers.get("content-type", ""), response.content
+                    )
+            archive.seek(0)
+        except BaseException:
+            self._discard_archive(archive)
+            raise
+        self._note_selective(ids, size, len(session_manager.queue_ids or ()))
+        return archive
+
+    @staticmethod
+    def _discard_archive(archive: IO[bytes]) -> None:
+        archive.close()
+        name = getattr(archive, "name", None)
+        if isinstance(name, str) and os.path.exists(name):
+            os.unlink(name)
+
+    def _select_members(
+        self,
+        zf: zipfile.ZipFile,
+        destination_dir: str,
+        allowed_names: Optional[set] = None,
+        targets: Optional[Dict[str, str]] = None,
+    ) -> List[Tuple[str, str]]:
+        if targets is not None:
+            allowed_names = set(targets)
+
+        members = []
+        for name in zf.namelist():
+            filename = os.path.basename(name)
+            if not filename:
+                continue
+            # Only extract files that belong to this batch
+            if allowed_names is not None and filename not in allowed_names:
+                continue
+            if targets is not None:
+                dest_path = os.path.join(destination_dir, targets[filename])
+                create_directory(os.path.dirname(dest_path))
+            else:
+                dest_path = os.path.join(destination_dir, filename)
+            members.append((name, dest_path))
+        return members
 
-            return success, failure
+    def _extract_archive(
+        self,
+        archive: IO[bytes],
+        destination_dir: str,
+        allowed_names: Optional[set] = None,
+        targets: Optional[Dict[str, str]] = None,
+        cache_keys: Optional[Dict[str, str]] = None,
+    ) -> int:
+        # cache_keys maps an upload name to the digest of its encoded source;
+        # those members are also stored, unwatermarked, in the decode cache.
+        with zipfile.ZipFile(archive) as zf:
+            count = 0
+            for name, dest_path in self._select_members(zf, destination_dir, allowed_names, targets):
+                with zf.open(name) as src, open(dest_path, "wb") as f, self.tracer.span("watermark", file=name):
+                    is_php = os.path.basename(name).lower().endswith(".php")
+                    _write_member(self._watermark_engine, src, f, is_php)
+                count += 1
+                digest = cache_keys.get(os.path.basename(name)) if cache_keys else None
+                if digest and self.decode_cache is not None:
+                    try:
+                        with zf.open(name) as src:
+                            self.decode_cache.put(digest, src)
+                    except Exception as e:
+                        logger.warning(f"Could not store {name} in decode cache: {e}")
+            expected = len(targets) if targets is not None else len(allowed_names or ())
+            logger.info(f"Extracted {count}/{expected or '?'} files")
+        return count
 
-        except Exception as e:
-            logger.error(f"Error parsing upload result: {e}")
-            return [], []
+    def _submit_archive(
+        self,
+        archive: IO[bytes],
+        targets: Dict[str, str],
+        on_done: Callable[[Optional[Exception]], None],
+        cache_keys: Optional[Dict[str, str]] = None,
+    ) -> None:
+        # Hands every member to the process pool and returns immediately;
+        # on_done runs once all members are written (or one of them failed).
+        assert self._process_pool is not None
+        archive.flush()
+        with zipfile.ZipFile(archive.name) as zf:
+            members = self._select_members(zf, "", targets=targets)
+        logger.info(f"Extracting {len(members)}/{len(targets)} files in worker processes")
+
+        pending = [len(members)]
+        errors: List[Exception] = []
+        state_lock = threading.Lock()
+
+        def member_done(future: Future) -> None:
+            with state_lock:
+                exc = future.exception()
+                if exc is not None:
+                    errors.append(exc)  # type: ignore[arg-type]
+                elif future.result() and self.decode_cache is not None:
+                    self.decode_cache.added(future.result())
+                pending[0] -= 1
+                if pending[0]:
+                    return
+            self._discard_archive(archive)
+            on_done(errors[0] if errors else None)
+
+        if not members:
+            self._discard_archive(archive)
+            on_done(None)
+            return
+        for name, dest_path in members:
+            digest = cache_keys.get(os.path.basename(name)) if cache_keys else None
+            cache_path = (
+                self.decode_cache.path_for(digest)
+                if digest and self.decode_cache is not None else None
+            )
+            future = self._process_pool.submit(
+                _extract_member, archive.name, name, dest_path, self.custom_watermark, cache_path
+            )
+            future.add_done_callback(member_done)
 
     def download_decoded_files(
-        self, destination_dir: str, allowed_names: Optional[set] = None
+        self,
+        destination_dir: str,
+        allowed_names: Optional[set] = None,
+        targets: Optional[Dict[str, str]] = None,
     ) -> bool:
+        # targets maps an upload name to its output path (relative paths are
+        # taken from destination_dir) and implies allowed_names.
         create_directory(destination_dir)
 
         def do_download() -> bool:
-            response = self.session_manager.get(
-                f"{self.base_url}/download.php?id=all", timeout=120
-            )
-            response.raise_for_status()
-
-            if not response.headers.get("content-type", "").startswith("application/zip"):
-                raise DownloadError("Response is not a ZIP archive")
-
-            with zipfile.ZipFile(BytesIO(response.content)) as zf:
-                count = 0
-                for name in zf.namelist():
-                    filename = os.path.basename(name)
-                    if not filename:
-                        continue
-                    # Only extract files that belong to this batch
-                    if allowed_names is not None and filename not in allowed_names:
-                        continue
-                    data = zf.read(name)
-                    if filename.lower().endswith(".php"):
-                        data = self._replace_watermark(data)
-                    dest_path = os.path.join(destination_dir, filename)
-                    with open(dest_path, "wb") as f:
-                        f.write(data)
-                    count += 1
-                logger.info(f"Extracted {count}/{len(allowed_names) if allowed_names else '?'} files")
+            archive = self._fetch_archive()
+            try:
+                self._extract_archive(archive, destination_dir, allowed_names, targets)
+            finally:
+                self._discard_archive(archive)
             return True
 
+        # Retried by the caller, as part of the batch
         try:
-            return self._retry(do_download)
+            return do_download()
         except Exception as e:
-            logger.error(f"Download failed after all retries: {e}")
+            logger.error(f"Download failed: {e}")
             raise DownloadError(f"Failed to download files: {e}")
 
     def copy_files(self, source_dir: str, dest_dir: str, files: List[str]) -> None:
+        with self.tracer.span("copy_files", dir=source_dir, files=len(files)):
+            self._copy_files(source_dir, dest_dir, files)
+
+    def _copy_files(self, source_dir: str, dest_dir: str, files: List[str]) -> None:
         copied = 0
         for filename in files:
             try:
@@ -318,117 +851,532 @@ class IonicubeDecoder:
         if copied:
             logger.info(f"Copied {copied} non-PHP files")
 
-    def _process_batch(
+    def _upload_batch(self, batch: List[BatchItem]) -> Tuple[List[str], List[str]]:
+        # Remove stale files from previous batches/runs before uploading
+        with self.metrics.phase("queue_clear"):
+            self._prepare_queue()
+        # Item paths are complete, so no source_dir prefix is needed
+        return self.upload_files(
+            "",
+            [item.source_path for item in batch],
+            upload_names=[item.upload_name for item in batch],
+        )
+
+    def _note_failures(self, batch: List[BatchItem], failure: List[str]) -> None:
+        by_upload_name = {item.upload_name: item for item in batch}
+        failed: List[str] = []
+        for f in failure:
+            item = by_upload_name.get(f)
+            if item is None:
+                failed.append(f)
+                continue
+            failed.extend(copy.source_path for copy in with_copies([item]))
+        with self._lock:
+            self.not_decoded.extend(failed)
+
+    def _fan_out(self, batch: List[BatchItem]) -> None:
+        # Duplicates get the representative's finished (watermarked) output
+        for item in batch:
+            if not item.copies or not os.path.exists(item.dest_path):
+                continue
+            for copy in item.copies:
+                try:
+                    shutil.copyfile(item.dest_path, copy.dest_path)
+                except OSError as e:
+                    logger.warning(f"Could not copy {item.rel_path} to {copy.rel_path}: {e}")
+                    with self._lock:
+                        self.not_decoded.append(copy.source_path)
+
+    def _mark_batch_done(self, batch: List[BatchItem], progress: Progress, task_id: TaskID) -> None:
+        batch = with_copies(batch)
+        with self._lock:
+            self.processed_count += len(batch)
+            for item in batch:
+                self._done_files.add(item.rel_path)
+        self._record_progress([item.rel_path for item in batch])
+        progress.advance(task_id, len(batch))
+
+    def _record_progress(self, rel_paths: List[str]) -> None:
+        # The journal has its own lock, so workers do not wait on self._lock
+        # while a record is fsynced.
+        if self._journal is None:
+            return
+        try:
+            self._journal.append(rel_paths)
+        except Exception as e:
+            logger.warning(f"Could not save progress: {e}")
+
+    def _mark_batch_failed(
+        self, batch: List[BatchItem], batch_label: str, exc: Exception, progress: Progress, task_id: TaskID
+    ) -> None:
+        logger.error(f"{batch_label} failed: {exc}")
+        batch = with_copies(batch)
+        with self._lock:
+            self.not_decoded.extend([item.source_path for item in batch])
+        progress.advance(task_id, len(batch))
+
+    def _complete_batch(
         self,
-        source_dir: str,
-        dest_dir: str,
-        batch: List[str],
+        batch: List[BatchItem],
         batch_label: str,
+        archive: Optional[IO[bytes]],
+        failure: List[str],
         progress: Progress,
-        task_id,
+        task_id: TaskID,
     ) -> bool:
-        batch_names = set(batch)
+        """Extract a fetched archive (if any) and record the batch outcome"""
+        if archive is None:
+            self._note_failures(batch, failure)
+            self._mark_batch_done(batch, progress, task_id)
+            return True
 
-        def attempt_batch() -> None:
-            # Clear any stale files from previous batches/runs before uploading
-            self.clear_decoder_queue()
-            success, failure = self.upload_files(source_dir, batch)
-            if success:
-                self.download_decoded_files(dest_dir, allowed_names=batch_names)
-            if failure:
-                with self._lock:
-                    self.not_decoded.extend([os.path.join(source_dir, f) for f in failure])
+        targets = {item.upload_name: item.dest_path for item in batch}
+        cache_keys = (
+            {item.upload_name: item.digest for item in batch if item.digest}
+            if self.decode_cache is not None else None
+        )
 
-        try:
-            self._retry(attempt_batch)
-            with self._lock:
-                self.processed_count += len(batch)
-                for f in batch:
-                    rel = os.path.relpath(os.path.join(source_dir, f), self._source_root).replace("\\", "/")
-                    self._done_files.add(rel)
-                if self.progress_file:
-                    try:
-                        with open(self.progress_file, "w") as pf:
-                            json.dump({"done": list(self._done_files)}, pf)
-                    except Exception as e:
-                        logger.warning(f"Could not save progress: {e}")
-            progress.advance(task_id, len(batch))
+        started = time.monotonic()
+        if self._process_pool is not None:
+            def on_done(exc: Optional[Exception]) -> None:
+                # Includes the wait for a free extraction process
+                elapsed = time.monotonic() - started
+                self.metrics.observe("extract", elapsed)
+                self.tracer.add("extract", started, elapsed, batch=batch_label)
+                if exc is not None:
+                    self._mark_batch_failed(batch, batch_label, exc, progress, task_id)
+                    return
+                self._fan_out(batch)
+                self._note_failures(batch, failure)
+                self._mark_batch_done(batch, progress, task_id)
+
+            try:
+                self._submit_archive(archive, targets, on_done, cache_keys)
+            except Exception as e:
+                self._discard_archive(archive)
+                self._mark_batch_failed(batch, batch_label, e, progress, task_id)
+                return False
             return True
+
+        try:
+            with self.metrics.phase("extract"):
+                self._extract_archive(archive, "", targets=targets, cache_keys=cache_keys)
         except Exception as e:
-            logger.error(f"{batch_label} failed: {e}")
-            with self._lock:
-                self.not_decoded.extend([os.path.join(source_dir, f) for f in batch])
-            progress.advance(task_id, len(batch))
+            self._mark_batch_failed(batch, batch_label, e, progress, task_id)
             return False
+        finally:
+            self._discard_archive(archive)
+        self._fan_out(batch)
+        self._note_failures(batch, failure)
+        self._mark_batch_done(batch, progress, task_id)
+        return True
+
+    def _timed(self, fn: Callable[[], T]) -> T:
+        # Feeds the latency and outcome of one upload or download to the batcher
+        if self.batcher is None:
+            return fn()
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception as e:
+            self.batcher.record(time.monotonic() - started, False, _is_timeout(e))
+            raise
+        self.batcher.record(time.monotonic() - started, True)
+        return result
+
+    def _batches(self, items: List[BatchItem], progress: Progress, task_id: TaskID) -> Iterator[List[BatchItem]]:
+        """Yield upload batches; adaptive batches are packed only when needed"""
+        if self.batcher is None:
+            yield from pack_batches(items, self.batch_size)
+            return
+        for batch in self.batcher.batches(items):
+            progress.update(
+                task_id, description=f"[bold]Decoding[/] [dim]({self.batcher.describe()})[/]"
+            )
+            yield batch
+
+    def _upload_and_fetch(self, batch: List[BatchItem]) -> Tuple[Optional[IO[bytes]], List[str]]:
+        """Upload a batch and fetch its archive on the bound session"""
+        session_manager = self.session_manager
+        for _ in range(2):
+            logins = session_manager.logins
+            success, failure = self._timed(lambda: self._upload_batch(batch))
+            archive = self._timed(lambda: self._fetch_results(success)) if success else None
+            if session_manager.logins == logins:
+                return archive, failure
+            # The session logged in again in between, so the new server
+            # session's queue does not hold the upload; send it again now
+            if archive is not None:
+                self._discard_archive(archive)
+            logger.warning("Session renewed during a batch, uploading it again")
+        raise SessionExpiredError("Session expired repeatedly during one batch")
+
+    def _bisectable(self, batch: List[BatchItem], exc: Exception) -> bool:
+        # Splitting cannot help with a rejected login or a service that is down
+        return len(batch) > 1 and classify(exc) != FATAL and not self.retry_policy.breaker.tripped
+
+    def _halves(
+        self, batch: List[BatchItem], batch_label: str, exc: Exception
+    ) -> List[Tuple[List[BatchItem], str]]:
+        logger.warning(f"{batch_label} failed ({exc}); retrying its {len(batch)} files in halves")
+        with self._lock:
+            self.bisected += 1
+        mid = len(batch) // 2
+        # Upload names stay unique, since both halves keep their names
+        return [(batch[:mid], f"{batch_label}.1"), (batch[mid:], f"{batch_label}.2")]
+
+    def _batch_failed(
+        self, batch: List[BatchItem], batch_label: str, exc: Exception, progress: Progress, task_id: TaskID
+    ) -> bool:
+        """
+        Handle a batch whose upload or download kept failing
+
+        One malformed file usually breaks a whole upload, so the batch is
+        split in halves that are processed again on the bound session, down
+        to single files. Only the files that still fail are recorded.
+        """
+        if self._abort_on(exc):
+            return False
+        if not self._bisectable(batch, exc):
+            self._mark_batch_failed(batch, batch_label, exc, progress, task_id)
+            return False
+        results = [
+            self._process_batch(half, label, progress, task_id, self.bisect_policy)
+            for half, label in self._halves(batch, batch_label, exc)
+        ]
+        return all(results)
+
+    def _process_batch(
+        self,
+        batch: List[BatchItem],
+        batch_label: str,
+        progress: Progress,
+        task_id: TaskID,
+        policy: Optional[RetryPolicy] = None,
+    ) -> bool:
+        if self._aborted is not None:
+            return False
+        policy = policy or self.retry_policy
+        with self.tracer.span("batch", label=batch_label, files=len(batch)):
+            try:
+                archive, failure = policy.call(lambda: self._upload_and_fetch(batch))
+            except Exception as e:
+                return self._batch_failed(batch, batch_label, e, progress, task_id)
+            return self._complete_batch(batch, batch_label, archive, failure, progress, task_id)
 
     def process_directory_batch(
         self,
         source_dir: str,
         dest_dir: str,
         php_files: List[str],
-        batch_size: int = 20,
+        batch_size: Optional[int] = None,
         progress: Optional[Progress] = None,
         task_id=None,
     ) -> None:
         if not php_files:
             return
 
-        batches = batch_list(php_files, batch_size)
+        root = self._source_root or source_dir
+        items = [
+            BatchItem(
+                os.path.join(source_dir, filename),
+                os.path.join(dest_dir, filename),
+                os.path.relpath(os.path.join(source_dir, filename), root).replace("\\", "/"),
+            )
+            for filename in php_files
+        ]
+        batches = pack_batches(items, batch_size or self.batch_size)
         for i, batch in enumerate(batches):
             label = f"batch {i + 1}/{len(batches)} in {os.path.basename(source_dir)}"
-            self._process_batch(source_dir, dest_dir, batch, label, progress, task_id)
-
-    def decode_directory(self, source_path: str, dest_path: str, overwrite: bool = False) -> bool:
-        logger.info(f"Starting decode: {source_path} -> {dest_path}")
-        self._source_root = source_path
+            self._process_batch(batch, label, progress, task_id)
+
+    def _serve_cached(
+        self, items: List[BatchItem], progress: Progress, task_id: TaskID
+    ) -> List[BatchItem]:
+        """Write cache hits straight to their destination and return the misses"""
+        if self.decode_cache is None:
+            return items
+
+        misses: List[BatchItem] = []
+        served: List[str] = []
+        for item in items:
+            try:
+                if item.digest is None:
+                    item.digest = file_digest(item.source_path)
+                cached = self.decode_cache.get(item.digest)
+                if cached is None:
+                    misses.append(item)
+                    continue
+                with open(cached, "rb") as src, open(item.dest_path, "wb") as dst, \
+                        self.tracer.span("watermark", file=item.rel_path):
+                    _write_member(self._watermark_engine, src, dst, True)
+            except Exception as e:
+                logger.warning(f"Decode cache lookup failed for {item.rel_path}: {e}")
+                misses.append(item)
+                continue
+            self._fan_out([item])
+            served.extend(copy.rel_path for copy in with_copies([item]))
 
-        if not self.login():
-            logger.error("Login failed")
+        if served:
+            with self._lock:
+                self.processed_count += len(served)
+                self._done_files.update(served)
+            self._record_progress(served)
+            progress.advance(task_id, len(served))
+            logger.info(f"Decode cache: served {len(served)} files without uploading")
+        return misses
+
+    def _run_worker_batch(
+        self,
+        batch: List[BatchItem],
+        batch_label: str,
+        progress: Progress,
+        task_id: TaskID,
+    ) -> bool:
+        if self._aborted is not None:
             return False
+        try:
+            session_manager = self._worker_session()
+        except Exception as e:
+            if not self._abort_on(e):
+                self._mark_batch_failed(batch, batch_label, e, progress, task_id)
+            return False
+        with self._bind_session(session_manager):
+            return self._process_batch(batch, batch_label, progress, task_id)
+
+    def _run_pipeline(
+        self,
+        batches: Iterable[Tuple[List[BatchItem], str]],
+        progress: Progress,
+        task_id: TaskID,
+    ) -> None:
+        # The decoder queue of a session is cleared before every upload, so the
+        # next upload on a session must wait until the previous archive has
+        # been fetched. The token is taken by the upload stage and released by
+        # the download stage; extraction never holds it.
+        tokens: Dict[int, threading.Semaphore] = {}
+
+        def token_for(session_manager: SessionManager) -> threading.Semaphore:
+            with self._lock:
+                return tokens.setdefault(id(session_manager), threading.Semaphore(1))
+
+        def retry_batch(job: _PipelineJob, exc: Exception) -> None:
+            # The batch is the retry unit: its first attempt is split across
+            # the upload and download stages, and once either fails, the
+            # remaining attempts upload and fetch it in one go, right here
+            job.archive, job.failure = self.retry_policy.call(
+                lambda: self._upload_and_fetch(job.batch), failed=exc
+            )
+
+        def upload_stage(job: _PipelineJob) -> Optional[_PipelineJob]:
+            if self._aborted is not None:
+                return None
+            try:
+                job.session = self._worker_session() if self.workers > 1 else self._session_manager
+            except Exception as e:
+                if not self._abort_on(e):
+                    self._mark_batch_failed(job.batch, job.label, e, progress, task_id)
+                return None
+            token = token_for(job.session)
+            token.acquire()
+            job.logins = job.session.logins
+            with self._bind_session(job.session):
+                try:
+                    try:
+                        job.success, job.failure = self._timed(lambda: self._upload_batch(job.batch))
+                    except Exception as e:
+                        # Leaves the archive fetched; the download stage passes it on
+                        retry_batch(job, e)
+                except Exception as e:
+                    # Bisected while the token is still held
+                    try:
+                        self._batch_failed(job.batch, job.label, e, progress, task_id)
+                    finally:
+                        token.release()
+                    return None
+            if job.archive is None and not job.success:
+                token.release()
+                self._complete_batch(job.batch, job.label, None, job.failure, progress, task_id)
+                return None
+            return job
+
+        def download_stage(job: _PipelineJob) -> Optional[_PipelineJob]:
+            # Set by the upload stage
+            session = job.session
+            assert session is not None
+            try:
+                with self._bind_session(session):
+                    if job.archive is None:
+                        try:
+                            job.archive = self._timed(lambda: self._fetch_results(job.success))
+                            if session.logins != job.logins:
+                                # Renewed since the upload stage: the upload is gone
+                                self._discard_archive(job.archive)
+                                job.archive, job.failure = self._upload_and_fetch(job.batch)
+                        except Exception as e:
+                            retry_batch(job, e)
+            except Exception as e:
+                with self._bind_session(session):
+                    self._batch_failed(job.batch, job.label, e, progress, task_id)
+                return None
+            finally:
+                token_for(session).release()
+            return job
+
+        def extract_stage(job: _PipelineJob) -> None:
+            archive, job.archive = job.archive, None
+            self._complete_batch(job.batch, job.label, archive, job.failure, progress, task_id)
+            return None
+
+        pipeline = Pipeline([
+            Stage("upload", upload_stage, workers=self.workers),
+            Stage("download", download_stage, workers=self.workers),
+            Stage("extract", extract_stage),
+        ])
+        logger.info("Processing batches through the upload/download/extract pipeline")
+        pipeline.run(_PipelineJob(batch, label) for batch, label in batches)
+
+    def _run_batches(
+        self,
+        batches: Iterable[List[BatchItem]],
+        progress: Progress,
+        task_id: TaskID,
+    ) -> None:
+        # Batches may be produced lazily (adaptive sizing), so they are only
+        # pulled when a worker can take one.
+        batches = iter(batches)
+        first = next(batches, None)
+        if first is None:
+            return
+        labelled = itertools.takewhile(
+            # No more batches once a rejected login stops the run
+            lambda _: self._aborted is None,
+            ((batch, f"batch {i + 1}") for i, batch in enumerate(itertools.chain([first], batches))),
+        )
+        if self.process_workers:
+            self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers)
+
+        try:
+            if not self.pipeline and self.workers <= 1:
+                for batch, label in labelled:
+                    self._process_batch(batch, label, progress, task_id)
+            elif self.pipeline:
+                self._run_pipeline(labelled, progress, task_id)
+            else:
+                logger.info(f"Processing batches with {self.workers} workers")
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="decoder") as pool:
+                    pending: Set["Future[bool]"] = set()
+                    for batch, label in labelled:
+                        if len(pending) >= self.workers:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                future.result()
+                        pending.add(pool.submit(self._run_worker_batch, batch, label, progress, task_id))
+                    for future in as_completed(pending):
+                        future.result()
+        finally:
+            if self._process_pool is not None:
+                # Wait for outstanding extractions so every batch is recorded
+                self._process_pool.shutdown(wait=True)
+                self._process_pool = None
+            self._close_worker_sessions()
+        if self._aborted is not None:
+            raise self._aborted
+
+    def _scan_source(self, source_path: str, dest_path: str, safe: str) -> ScanIndex:
+        # Content digests are needed to find duplicates and for cache keys
+        hash_ioncube = self.dedupe or self.decode_cache is not None
+        if not self.use_scan_cache:
+            return scan_tree(source_path, hash_ioncube=hash_ioncube)
+
+        # Classification cache lives next to the progress file
+        create_directory(dest_path)
+        if not self.scan_cache_file:
+            self.scan_cache_file = os.path.join(dest_path, f".scan_cache_{safe}.sqlite")
+        cache = ScanCache(self.scan_cache_file, rescan=self.rescan)
+        try:
+            index = scan_tree(source_path, cache, hash_ioncube=hash_ioncube)
+            cache.save()
+        finally:
+            cache.close()
+        logger.info(f"Scan cache: {cache.hits} hits, {cache.misses} misses")
+        return index
+
+    def _plan(
+        self, source_path: str, dest_path: str, overwrite: bool
+    ) -> Tuple[List[BatchItem], List[Tuple[str, str, List[str]]]]:
+        """Load progress, scan the source tree and return the pending work"""
+        self._source_root = source_path
 
         # Resume support: load previously decoded file list
+        safe = re.sub(r"[^\w]", "_", os.path.basename(source_path.rstrip("/\\")))
         if not self.progress_file:
-            safe = re.sub(r"[^\w]", "_", os.path.basename(source_path.rstrip("/\\")))
-            self.progress_file = os.path.join(dest_path, f".decode_progress_{safe}.json")
-        if os.path.exists(self.progress_file):
-            try:
-                self._done_files = set(json.loads(open(self.progress_file).read()).get("done", []))
-                logger.info(f"Resuming: {len(self._done_files)} files already tracked")
-            except Exception:
-                self._done_files = set()
-        else:
+            self.progress_file = os.path.join(dest_path, f".decode_progress_{safe}.jsonl")
+        self._journal = ProgressJournal(self.progress_file)
+        try:
+            self._done_files = self._journal.load(
+                legacy_path=os.path.join(dest_path, f".decode_progress_{safe}.json")
+            )
+        except Exception as e:
+            logger.warning(f"Could not read progress journal: {e}")
             self._done_files = set()
-
-        total_ioncube = find_ioncube_files(source_path)
-        self.total_files = len(total_ioncube)
+        if self._done_files:
+            logger.info(f"Resuming: {len(self._done_files)} files already tracked")
+
+        # Single pass over the tree: every file is classified once and the
+        # index is reused for counting and for building the work items.
+        with self.tracer.span("scan"):
+            self.scan_index = self._scan_source(source_path, dest_path, safe)
+        self.total_files = self.scan_index.ioncube_count
         logger.info(f"Found {self.total_files} ionCube files")
 
-        work_items: List[Tuple[str, str, List[str], List[str]]] = []
-        for root, _, filenames in os.walk(source_path):
+        items: List[BatchItem] = []
+        copy_jobs: List[Tuple[str, str, List[str]]] = []
+        # Existing outputs, recorded with one journal append for the whole tree
+        skipped: List[str] = []
+        for scanned in self.scan_index.directories:
+            root = scanned.path
             rel = os.path.relpath(root, source_path)
             dest_dir = os.path.join(dest_path, rel).rstrip(".")
 
             create_directory(dest_dir)
 
-            php_files, other_files = [], []
-            for filename in filenames:
+            for filename in scanned.ioncube:
                 filepath = os.path.join(root, filename)
-                if filename.endswith(".php") and is_ioncube_file(filepath):
-                    dest_file = os.path.join(dest_dir, filename)
-                    rel_key = os.path.relpath(filepath, source_path).replace("\\", "/")
-                    if rel_key in self._done_files:
-                        continue
-                    if not overwrite and os.path.exists(dest_file):
-                        with self._lock:
-                            self._done_files.add(rel_key)
-                        continue
-                    php_files.append(filename)
-                else:
-                    other_files.append(filename)
-
-            work_items.append((root, dest_dir, php_files, other_files))
-
-        with Progress(
+                dest_file = os.path.join(dest_dir, filename)
+                rel_key = os.path.relpath(filepath, source_path).replace("\\", "/")
+                if rel_key in self._done_files:
+                    continue
+                if not overwrite and os.path.exists(dest_file):
+                    with self._lock:
+                        self._done_files.add(rel_key)
+                    skipped.append(rel_key)
+                    continue
+                item = BatchItem(filepath, dest_file, rel_key)
+                item.digest = self.scan_index.digest_of(filepath)
+                try:
+                    item.size = os.path.getsize(filepath)
+                except OSError:
+                    pass
+                items.append(item)
+            other_files = scanned.php + scanned.other
+            if other_files:
+                copy_jobs.append((root, dest_dir, other_files))
+        self._record_progress(skipped)
+
+        if self.dedupe:
+            pending = len(items)
+            items = dedupe_items(items)
+            self.dedup_saved = pending - len(items)
+            if self.dedup_saved:
+                logger.info(
+                    f"Deduplicated {pending} files to {len(items)} unique uploads "
+                    f"({self.dedup_saved} uploads saved)"
+                )
+        return items, copy_jobs
+
+    def _progress(self) -> Progress:
+        return Progress(
             SpinnerColumn(),
             TextColumn("[progress.description]{task.description}"),
             BarColumn(bar_width=40),
@@ -437,18 +1385,98 @@ class IonicubeDecoder:
             TimeRemainingColumn(),
             console=console,
             transient=False,
-        ) as progress:
-            task = progress.add_task("[bold]Decoding[/]", total=max(self.total_files, 1))
+        )
 
-            for root, dest_dir, php_files, other_files in work_items:
-                if other_files:
-                    self.copy_files(root, dest_dir, other_files)
-                if php_files:
-                    self.process_directory_batch(
-                        root, dest_dir, php_files, progress=progress, task_id=task
-                    )
+    def _take_failed(self, items: List[BatchItem], progress: Progress, task_id: TaskID) -> List[BatchItem]:
+        """
+        Pull the files of failed batches out of not_decoded for a final pass
+
+        Files the service itself reported as not decodable were recorded as
+        done and are left alone; retrying them gives the same answer.
+        """
+        if self.retry_policy.breaker.tripped:
+            logger.warning("Service unreachable, skipping the retry pass for failed files")
+            return []
+        with self._lock:
+            failed = set(self.not_decoded)
+            retry = [
+                item for item in items
+                if item.rel_path not in self._done_files
+                and any(copy.source_path in failed for copy in with_copies([item]))
+            ]
+            paths = {copy.source_path for copy in with_copies(retry)}
+            self.not_decoded = [f for f in self.not_decoded if f not in paths]
+        if retry:
+            # They count towards the progress bar again when they finish
+            progress.advance(task_id, -len(paths))
+            logger.info(f"Retry pass: {len(retry)} files of failed batches")
+        return retry
+
+    def _run_stats(self) -> Dict[str, float]:
+        # Gauges kept outside Metrics, pulled in whenever a report is written
+        with self._lock:
+            stats: Dict[str, float] = {
+                "files_total": self.total_files,
+                "files_decoded": self.processed_count,
+                "files_failed": len(self.not_decoded),
+                "queue_clears_skipped": self.clears_skipped,
+                "dedup_saved": self.dedup_saved,
+                "batches_bisected": self.bisected,
+                "selective_batches": self.selective_batches,
+            }
+        stats["retries"] = self.retry_policy.retries
+        stats["circuit_trips"] = self.retry_policy.breaker.trips
+        if self.decode_cache is not None:
+            stats["cache_hits"] = self.decode_cache.hits
+            stats["cache_misses"] = self.decode_cache.misses
+        return stats
+
+    @contextmanager
+    def _run_exports(self) -> Iterator[None]:
+        # Writes the configured metrics files during the run and once at its
+        # end, and the trace when the run is over
+        reporter = MetricsReporter(
+            self.metrics, self._run_stats, self.metrics_file, self.prometheus_file, self.metrics_interval
+        )
+        reporter.start()
+        try:
+            yield
+        finally:
+            reporter.stop()
+            if self.profile_file:
+                try:
+                    self.tracer.write(self.profile_file)
+                    logger.info(f"Trace written to {self.profile_file}")
+                except OSError as e:
+                    logger.warning(f"Could not write trace: {e}")
 
+    def _report(self) -> None:
         logger.info(f"Decoded: {self.processed_count} | Failed: {len(self.not_decoded)}")
+        if self.clears_skipped:
+            logger.info(f"Queue clears skipped: {self.clears_skipped}")
+        if self.dedup_saved:
+            logger.info(f"Deduplication: {self.dedup_saved} uploads saved")
+        if self.retry_policy.retries or self.retry_policy.breaker.trips:
+            logger.info(f"Retries: {self.retry_policy.describe()}")
+        if self.bisected:
+            logger.info(f"Failed batches split: {self.bisected}")
+        if self.selective_batches:
+            # Leftover entries are assumed to be the size of an average decoded file
+            average = self._selective_bytes / max(self._selective_files, 1)
+            logger.info(
+                f"Selective downloads: {self.selective_batches} batches, "
+                f"{self.selective_skipped} other queue entries skipped "
+                f"(~{self.selective_skipped * average / 1024:.1f} KB saved)"
+            )
+        if self.decode_cache is not None:
+            cache = self.decode_cache
+            logger.info(
+                f"Decode cache: {cache.hits} hits, {cache.misses} misses "
+                f"({cache.hit_rate:.0%} hit rate)"
+            )
+        summary = self.metrics.summary()
+        if summary:
+            logger.info(f"Time per phase:\n{summary}")
 
         if self.not_decoded:
             logger.warning("Failed files:")
@@ -458,6 +1486,40 @@ class IonicubeDecoder:
             for f in self.not_decoded:
                 print(f"  {f}", file=sys.stderr)
 
+    def decode_directory(self, source_path: str, dest_path: str, overwrite: bool = False) -> bool:
+        logger.info(f"Starting decode: {source_path} -> {dest_path}")
+
+        with self._run_exports():
+            # With several workers every worker logs in on a session of its
+            # own and the main session is never used
+            logged_in = self._login_workers() if self.workers > 1 else self.login()
+            if not logged_in:
+                logger.error("Login failed")
+                return False
+
+            with self.metrics.phase("plan"):
+                items, copy_jobs = self._plan(source_path, dest_path, overwrite)
+
+            with self._progress() as progress:
+                task = progress.add_task("[bold]Decoding[/]", total=max(self.total_files, 1))
+
+                for root, dest_dir, other_files in copy_jobs:
+                    self.copy_files(root, dest_dir, other_files)
+
+                items = self._serve_cached(items, progress, task)
+
+                try:
+                    # Batches are packed across directories so small directories share uploads
+                    self._run_batches(self._batches(items, progress, task), progress, task)
+                    retry = self._take_failed(items, progress, task)
+                    if retry:
+                        self._run_batches(self._batches(retry, progress, task), progress, task)
+                finally:
+                    if self._journal is not None:
+                        self._journal.close()
+
+            self._report()
+        # The spare session is left over if there was nothing to upload
+        self._close_worker_sessions()
         self.session_manager.close()
         return True
-
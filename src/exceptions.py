@@ -4,11 +4,12 @@ Custom exceptions for EasyToYou decoder
 
 class EasyToYouError(Exception):
     """Base exception for all EasyToYou related errors"""
-    pass
+    # Whether trying the same operation again may succeed; see retry.classify()
+    retryable = True
 
 class LoginError(EasyToYouError):
     """Raised when login to easytoyou.eu fails"""
-    pass
+    retryable = False
 
 class UploadError(EasyToYouError):
     """Raised when file upload fails"""
@@ -22,10 +23,14 @@ class NetworkError(EasyToYouError):
     """Raised when network operations fail"""
     pass
 
+class SessionExpiredError(EasyToYouError):
+    """Raised when the server session expired and logging in again did not help"""
+    pass
+
 class FormNotFoundError(EasyToYouError):
     """Raised when upload form cannot be found"""
-    pass
+    retryable = False
 
 class DecoderNotAvailableError(EasyToYouError):
     """Raised when specified decoder version is not available"""
-    pass
+    retryable = False
@@ -0,0 +1,131 @@
+"""
+Append-only progress journal for resumable runs
+"""
+
+import json
+import os
+import threading
+import logging
+from typing import IO, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Paths per line when writing a compacted snapshot
+_SNAPSHOT_CHUNK = 1000
+
+
+class ProgressJournal:
+    """
+    Records decoded files as JSON lines, one fsynced record per batch
+
+    Appending costs the size of the batch instead of the size of the whole
+    run, and the journal is periodically compacted into a snapshot so replay
+    stays fast.
+    """
+
+    def __init__(self, path: str, compact_every: int = 500):
+        """
+        Args:
+            path: Journal file (JSON lines)
+            compact_every: Appended records after which the journal is compacted
+        """
+        self.path = path
+        self.compact_every = max(1, compact_every)
+        self.done: Set[str] = set()
+        self._records = 0
+        self._needs_newline = False
+        self._file: Optional[IO[str]] = None
+        self._lock = threading.Lock()
+
+    def load(self, legacy_path: Optional[str] = None) -> Set[str]:
+        """
+        Replay the journal
+
+        Args:
+            legacy_path: Old single-JSON progress file, imported if no journal
+                exists yet
+
+        Returns:
+            Set of files recorded as done
+        """
+        self.done = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                line = ""
+                for line in f:
+                    try:
+                        self.done.update(json.loads(line).get("done", []))
+                    except ValueError:
+                        # A torn last line from an interrupted run; skip it
+                        logger.debug(f"Skipping unreadable journal line in {self.path}")
+            # Terminate a torn last line so the next record starts cleanly
+            self._needs_newline = bool(line) and not line.endswith("\n")
+        elif legacy_path and os.path.exists(legacy_path):
+            try:
+                with open(legacy_path, "r", encoding="utf-8") as f:
+                    self.done = set(json.load(f).get("done", []))
+                self.compact()
+                os.remove(legacy_path)
+                logger.info(f"Migrated progress file to journal {self.path}")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not import progress file {legacy_path}: {e}")
+        return set(self.done)
+
+    def _open(self) -> IO[str]:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+            if self._needs_newline:
+                self._file.write("\n")
+                self._needs_newline = False
+        return self._file
+
+    @staticmethod
+    def _write_record(f: IO[str], paths: List[str]) -> None:
+        f.write(json.dumps({"done": paths}) + "\n")
+
+    def append(self, paths: Iterable[str]) -> None:
+        """Durably record a batch of decoded files"""
+        paths = list(paths)
+        if not paths:
+            return
+        with self._lock:
+            f = self._open()
+            self._write_record(f, paths)
+            f.flush()
+            os.fsync(f.fileno())
+            self.done.update(paths)
+            self._records += 1
+            if self._records >= self.compact_every:
+                self._compact()
+
+    def compact(self) -> None:
+        """Rewrite the journal as a snapshot of everything recorded so far"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        tmp_path = self.path + ".tmp"
+        paths = sorted(self.done)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for i in range(0, len(paths), _SNAPSHOT_CHUNK):
+                self._write_record(f, paths[i:i + _SNAPSHOT_CHUNK])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._records = 0
+        self._needs_newline = False
+
+    def close(self) -> None:
+        """Compact and close the journal"""
+        with self._lock:
+            if self._records:
+                try:
+                    self._compact()
+                except OSError as e:
+                    logger.warning(f"Could not compact progress journal: {e}")
+            if self._file is not None:
+                self._file.close()
+                self._file = None
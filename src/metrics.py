@@ -0,0 +1,250 @@
+"""
+Run metrics: per-phase latency histograms, counters and their export
+"""
+
+import io
+import json
+import os
+import threading
+import time
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from decode_cache import write_atomic
+from tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; wide enough for both HTTP requests and multi-minute uploads
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, in the Prometheus layout"""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf bucket; not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if n and seen + n >= rank:
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+            lower = upper
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "max": round(self.max, 6),
+        }
+
+
+class Metrics:
+    """
+    Thread-safe collection of the measurements of one run
+
+    Phases ("login", "queue_clear", "upload", "download", "extract", ...)
+    are timed into histograms with phase(); counters ("bytes_up",
+    "http_requests", ...) may carry labels. Gauges that other objects already
+    keep (decoded files, retries) are pulled in at export time through the
+    stats callable of snapshot(). With a tracer, every phase sample is also
+    recorded as a span.
+    """
+
+    def __init__(self, tracer: Optional[Tracer] = None):
+        self.started = time.time()
+        self.tracer = tracer
+        self._phases: Dict[str, Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the enclosed block, failed or not, as one sample of a phase"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.observe(name, elapsed)
+            if self.tracer is not None:
+                self.tracer.add(name, started, elapsed)
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._phases.get(name)
+            if histogram is None:
+                histogram = self._phases[name] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter(self, name: str) -> float:
+        """Total of a counter over all of its labels"""
+        with self._lock:
+            return sum(v for (n, _), v in self._counters.items() if n == name)
+
+    def snapshot(self, stats: Optional[Dict[str, float]] = None) -> Dict:
+        """
+        Return the run report as a JSON-serializable dict
+
+        Args:
+            stats: Current gauges of the run (e.g. files_decoded)
+        """
+        elapsed = max(time.time() - self.started, 1e-9)
+        with self._lock:
+            phases = {name: h.to_dict() for name, h in sorted(self._phases.items())}
+            counters: Dict[str, Any] = {}
+            for (name, labels), value in sorted(self._counters.items()):
+                if labels:
+                    counters.setdefault(name, {})[",".join(f"{k}={v}" for k, v in labels)] = value
+                else:
+                    counters[name] = value
+        stats = dict(stats or {})
+        decoded = stats.get("files_decoded", 0)
+        return {
+            "started": self.started,
+            "elapsed_seconds": round(elapsed, 3),
+            "files_per_second": round(decoded / elapsed, 3),
+            "stats": stats,
+            "counters": counters,
+            "phases": phases,
+        }
+
+    def prometheus(self, stats: Optional[Dict[str, float]] = None, prefix: str = "easytoyou") -> str:
+        """Render the metrics in the Prometheus text exposition format"""
+        report = self.snapshot(stats)
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str) -> str:
+            full = f"{prefix}_{name}"
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        full = metric("phase_seconds", "histogram", "Time spent per phase of the decode run")
+        with self._lock:
+            phases = sorted(self._phases.items())
+            counters = sorted(self._counters.items())
+        for name, h in phases:
+            cumulative = 0
+            for bound, n in zip(list(h.buckets) + ["+Inf"], h.counts):
+                cumulative += n
+                le = bound if isinstance(bound, str) else f"{bound:g}"
+                lines.append(f'{full}_bucket{{phase="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{full}_sum{{phase="{name}"}} {h.sum:.6f}')
+            lines.append(f'{full}_count{{phase="{name}"}} {h.count}')
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                metric(f"{name}_total", "counter", f"Total {name.replace('_', ' ')}")
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{prefix}_{name}_total{{{label_text}}} {value:g}" if labels else f"{prefix}_{name}_total {value:g}")
+
+        for name, value in sorted(report["stats"].items()):
+            full = metric(name, "gauge", name.replace("_", " ").capitalize())
+            lines.append(f"{full} {value:g}")
+        full = metric("files_per_second", "gauge", "Decoded files per second since the start of the run")
+        lines.append(f"{full} {report['files_per_second']:g}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """One line per phase for the log"""
+        with self._lock:
+            phases = sorted(self._phases.items())
+        return "\n".join(
+            f"  {name:<12} n={h.count:<5} total={h.sum:8.1f}s  p50={h.quantile(0.5):.3f}s  "
+            f"p95={h.quantile(0.95):.3f}s  max={h.max:.3f}s"
+            for name, h in phases
+        )
+
+
+class MetricsReporter:
+    """Writes the JSON report and/or Prometheus textfile every interval seconds"""
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        stats: Callable[[], Dict[str, float]],
+        json_path: Optional[str] = None,
+        prometheus_path: Optional[str] = None,
+        interval: float = 10.0,
+    ):
+        """
+        Args:
+            metrics: Metrics to export
+            stats: Returns the current gauges of the run
+            json_path: JSON run report
+            prometheus_path: Textfile for the node_exporter textfile collector
+            interval: Seconds between writes during the run
+        """
+        self.metrics = metrics
+        self.stats = stats
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = max(1.0, interval)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self) -> None:
+        stats = self.stats()
+        try:
+            if self.json_path:
+                body = json.dumps(self.metrics.snapshot(stats), indent=2).encode("utf-8")
+                write_atomic(os.path.abspath(self.json_path), io.BytesIO(body))
+            if self.prometheus_path:
+                body = self.metrics.prometheus(stats).encode("utf-8")
+                write_atomic(os.path.abspath(self.prometheus_path), io.BytesIO(body))
+        except Exception as e:
+            logger.warning(f"Could not write metrics: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self) -> None:
+        if not (self.json_path or self.prometheus_path):
+            return
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the periodic writes and write the final report"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.json_path or self.prometheus_path:
+            self.write()
@@ -0,0 +1,442 @@
+"""
+Local stand-in for easytoyou.eu, for benchmarks and offline testing
+"""
+
+import argparse
+import email
+import email.policy
+import html
+import io
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+import zipfile
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Type
+from urllib.parse import parse_qs, parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Replaces the encoded header of an uploaded file in its "decoded" output
+DECODED_HEADER = b"<?php\n// Decoded by mock server\n"
+
+
+def _page(body: str) -> bytes:
+    return (
+        "<!DOCTYPE html><html><head><title>easytoyou.eu</title></head>"
+        f"<body><div class=\"container\">{body}</div></body></html>"
+    ).encode("utf-8")
+
+
+def _login_page(prefix: str = "") -> bytes:
+    return _page(
+        prefix +
+        '<form method="post" action="/login">'
+        f'<input type="hidden" name="token" value="{uuid.uuid4().hex}">'
+        '<input type="text" name="loginname"><input type="password" name="password">'
+        '<input type="submit" value="Login"></form>'
+    )
+
+
+def _decode(content: bytes) -> bytes:
+    # Keeps everything after the first line, so the output can be traced
+    # back to its source
+    _, _, rest = content.partition(b"\n")
+    return DECODED_HEADER + rest
+
+
+class _Session:
+    def __init__(self) -> None:
+        self.requests = 0
+        # Queue ID -> (upload name, decoded content), in upload order
+        self.queue: Dict[str, Tuple[str, bytes]] = {}
+
+
+class MockServer:
+    """
+    HTTP server that mimics the parts of easytoyou.eu the decoder uses
+
+    Implements the login form (any credentials unless a password is set), the decoder page
+    with its upload form and ``file[]`` queue listing, queue deletion, uploads
+    answered with success/failure alerts, and ``download.php`` for single queue
+    entries or the ``id=all`` ZIP archive. Latency, injected failures and
+    session expiry are configurable; every request is counted.
+
+    Usage::
+
+        with MockServer(latency=0.02) as server:
+            decoder = IonicubeDecoder("user", "pass", base_url=server.url)
+            decoder.decode_directory("src", "out")
+            print(server.stats())
+    """
+
+    def __init__(
+        self,
+        decoder: str = "ic11php74",
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        decode_latency: float = 0.0,
+        failure_rate: float = 0.0,
+        reject_rate: float = 0.0,
+        expire_after: int = 0,
+        page_size: int = 10,
+        seed: Optional[int] = None,
+        password: Optional[str] = None,
+    ):
+        """
+        Args:
+            decoder: Decoder version served under /decoder/<decoder>
+            host: Interface to bind
+            port: Port to bind; 0 picks a free one (see url)
+            latency: Seconds added to every request
+            decode_latency: Seconds added to an upload per uploaded file
+            failure_rate: Fraction of requests answered with 502 Bad Gateway
+            reject_rate: Fraction of uploaded files reported as not decodable
+            expire_after: Requests after which a session is logged out; 0 never
+            page_size: Queue entries listed per decoder page
+            seed: Seed for the injected failures, for reproducible runs
+            password: Only password the login form accepts; any if None
+        """
+        self.decoder = decoder
+        self.latency = latency
+        self.decode_latency = decode_latency
+        self.failure_rate = failure_rate
+        self.reject_rate = reject_rate
+        self.expire_after = max(0, expire_after)
+        self.page_size = max(1, page_size)
+        self.password = password
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._sessions: Dict[str, _Session] = {}
+        self._lock = threading.Lock()
+        self._counts: "Counter[str]" = Counter()
+        self._host = host
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self._host}:{self._httpd.server_port}"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Mock server listening on {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the request counters
+
+        Keys are "requests", "logins", "queue_pages", "deletes", "uploads",
+        "files_uploaded", "downloads", "bytes_in", "bytes_out", "failures"
+        (injected 502s), "expired" (sessions logged out by expire_after) and
+        "logins_rejected" (wrong password).
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self) -> None:
+        """Forget all sessions and zero the counters"""
+        with self._lock:
+            self._sessions.clear()
+            self._counts.clear()
+
+    def _count(self, **amounts: int) -> None:
+        with self._lock:
+            self._counts.update(amounts)
+
+    def _session(self, sid: Optional[str]) -> Optional[_Session]:
+        # Counts the request against the session and expires it when due
+        if not sid:
+            return None
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is None:
+                return None
+            session.requests += 1
+            if self.expire_after and session.requests > self.expire_after:
+                del self._sessions[sid]
+                self._counts["expired"] += 1
+                return None
+            return session
+
+    def _accepts(self, fields: Dict[str, List[str]]) -> bool:
+        return self.password is None or fields.get("password") == [self.password]
+
+    def _login(self) -> str:
+        sid = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[sid] = _Session()
+            self._counts["logins"] += 1
+        return sid
+
+    def _fail(self) -> bool:
+        if self.failure_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    def _reject(self) -> bool:
+        if self.reject_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.reject_rate
+
+    def _decoder_page(self, session: _Session, prefix: str = "") -> bytes:
+        with self._lock:
+            listed = list(session.queue.items())[:self.page_size]
+        rows = "".join(
+            f'<tr><td><input type="checkbox" name="file[]" value="{html.escape(file_id)}"></td>'
+            f"<td>{html.escape(name)}</td></tr>"
+            for file_id, (name, _) in listed
+        )
+        form = (
+            '<form method="post" enctype="multipart/form-data">'
+            '<input type="file" id="uploadfileblue" name="uploadfile[]" multiple>'
+            '<input type="submit" name="submit" value="Decode"></form>'
+        )
+        queue = (
+            f'<form method="post"><table>{rows}</table>'
+            '<input type="submit" name="submit" value="Delete"></form>'
+        )
+        return _page(prefix + form + queue)
+
+    def _upload(self, session: _Session, files: List[Tuple[str, bytes]]) -> bytes:
+        if self.decode_latency:
+            time.sleep(self.decode_latency * len(files))
+        alerts = []
+        for name, content in files:
+            if self._reject():
+                alerts.append(
+                    f'<div class="alert alert-danger">Could not decode {html.escape(name)} '
+                    "(unsupported encoder version)</div>"
+                )
+                continue
+            file_id = f"{next(self._ids):08d}_{name}"
+            with self._lock:
+                session.queue[file_id] = (name, _decode(content))
+            alerts.append(f'<div class="alert alert-success">File {html.escape(name)} decoded successfully</div>')
+        self._count(uploads=1, files_uploaded=len(files))
+        return self._decoder_page(session, "".join(alerts))
+
+    def _archive(self, session: _Session) -> bytes:
+        with self._lock:
+            entries = list(session.queue.values())
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, content in entries:
+                zf.writestr(f"decoded/{name}", content)
+        return buffer.getvalue()
+
+    def _handler_class(self) -> Type["_Handler"]:
+        server = self
+
+        class Handler(_Handler):
+            mock = server
+
+        return Handler
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real service, so connection reuse is measured too
+    protocol_version = "HTTP/1.1"
+    mock: MockServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _reply(
+        self,
+        status: int = 200,
+        body: bytes = b"",
+        content_type: str = "text/html; charset=utf-8",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+        self.mock._count(bytes_out=len(body))
+
+    def _redirect(self, location: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._reply(302, b"", headers=dict(headers or {}, Location=location))
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        self.mock._count(bytes_in=len(body))
+        return body
+
+    def _sid(self) -> Optional[str]:
+        for part in (self.headers.get("Cookie") or "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "PHPSESSID":
+                return value
+        return None
+
+    def _form(self, body: bytes) -> Tuple[Dict[str, List[str]], List[Tuple[str, bytes]]]:
+        # Returns the plain fields and the uploaded (filename, content) pairs
+        content_type = self.headers.get("Content-Type", "")
+        fields: Dict[str, List[str]] = {}
+        files: List[Tuple[str, bytes]] = []
+        if content_type.startswith("multipart/form-data"):
+            message = email.message_from_bytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body,
+                policy=email.policy.HTTP,
+            )
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                filename = part.get_filename()
+                payload = part.get_payload(decode=True)
+                if not isinstance(payload, bytes):
+                    payload = b""
+                if filename is not None:
+                    files.append((filename, payload))
+                elif isinstance(name, str) and name:
+                    fields.setdefault(name, []).append(payload.decode("utf-8", "replace"))
+        else:
+            for name, value in parse_qsl(body.decode("utf-8", "replace"), keep_blank_values=True):
+                fields.setdefault(name, []).append(value)
+        return fields, files
+
+    def _handle(self) -> None:
+        mock = self.mock
+        mock._count(requests=1)
+        body = self._body() if self.command == "POST" else b""
+        if mock.latency:
+            time.sleep(mock.latency)
+        if mock._fail():
+            mock._count(failures=1)
+            self._reply(502, _page("<h1>502 Bad Gateway</h1>"))
+            return
+
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/")
+        if path == "/login":
+            if self.command != "POST":
+                self._reply(body=_login_page())
+            elif mock._accepts(self._form(body)[0]):
+                sid = mock._login()
+                self._redirect("/account", {"Set-Cookie": f"PHPSESSID={sid}; Path=/; HttpOnly"})
+            else:
+                mock._count(logins_rejected=1)
+                self._reply(body=_login_page('<div class="alert alert-danger">Invalid username or password</div>'))
+            return
+
+        session = mock._session(self._sid())
+        if session is None:
+            self._redirect("/login")
+            return
+
+        if path == "/account":
+            self._reply(body=_page("<h1>Account</h1>"))
+        elif path == f"/decoder/{mock.decoder}":
+            self._decoder(session, body)
+        elif path == "/download.php":
+            self._download(session, parse_qs(url.query).get("id", [""])[0])
+        else:
+            self._reply(404, _page("<h1>Not Found</h1>"))
+
+    def _decoder(self, session: _Session, body: bytes) -> None:
+        mock = self.mock
+        if self.command != "POST":
+            mock._count(queue_pages=1)
+            self._reply(body=mock._decoder_page(session))
+            return
+        fields, files = self._form(body)
+        if fields.get("submit") == ["Delete"]:
+            with mock._lock:
+                for file_id in fields.get("file[]", []):
+                    session.queue.pop(file_id, None)
+            mock._count(deletes=1)
+            self._reply(body=mock._decoder_page(session))
+            return
+        self._reply(body=mock._upload(session, files))
+
+    def _download(self, session: _Session, file_id: str) -> None:
+        mock = self.mock
+        mock._count(downloads=1)
+        if file_id == "all":
+            self._reply(
+                body=mock._archive(session),
+                content_type="application/zip",
+                headers={"Content-Disposition": 'attachment; filename="decoded.zip"'},
+            )
+            return
+        with mock._lock:
+            entry = session.queue.get(file_id)
+        if entry is None:
+            self._reply(404, _page("<h1>File not found</h1>"))
+            return
+        name, content = entry
+        self._reply(
+            body=content,
+            content_type="application/x-php",
+            headers={"Content-Disposition": f'attachment; filename="{name}"'},
+        )
+
+    do_GET = do_POST = do_HEAD = _handle
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a local stand-in for easytoyou.eu")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="port to bind (default: 8765)")
+    parser.add_argument("-d", "--decoder", default="ic11php74", help="decoder version to serve (default: ic11php74)")
+    parser.add_argument("--latency", type=float, default=0.0, metavar="SEC", help="delay added to every request")
+    parser.add_argument("--decode-latency", type=float, default=0.0, metavar="SEC", help="delay per uploaded file")
+    parser.add_argument("--failure-rate", type=float, default=0.0, metavar="P", help="fraction of requests answered with 502")
+    parser.add_argument("--reject-rate", type=float, default=0.0, metavar="P", help="fraction of files reported as not decodable")
+    parser.add_argument("--expire-after", type=int, default=0, metavar="N", help="log sessions out after N requests")
+    parser.add_argument("--password", help="only accept this password at login (default: any)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = MockServer(
+        decoder=args.decoder,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        decode_latency=args.decode_latency,
+        failure_rate=args.failure_rate,
+        reject_rate=args.reject_rate,
+        expire_after=args.expire_after,
+        password=args.password,
+    )
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        logger.info(f"Served: {server.stats()}")
+
+
+if __name__ == "__main__":
+    main()
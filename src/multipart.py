@@ -0,0 +1,195 @@
+"""
+Streaming multipart/form-data request bodies for uploads
+"""
+
+import io
+import os
+import uuid
+from typing import IO, Iterator, List, Optional, Sequence, Tuple, Union
+
+CRLF = b"\r\n"
+
+
+def _quote(value: str) -> str:
+    # Same escaping as browsers (and urllib3) for names in Content-Disposition
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class FilePart:
+    """A file field of a multipart body, read from disk only while it is sent"""
+
+    __slots__ = ("name", "filename", "path", "content_type", "size")
+
+    def __init__(self, name: str, filename: str, path: str, content_type: str = "application/octet-stream"):
+        """
+        Args:
+            name: Form field name
+            filename: File name sent to the server
+            path: File to send
+            content_type: Content-Type of the part
+
+        Raises:
+            OSError: If the file cannot be accessed
+        """
+        self.name = name
+        self.filename = filename
+        self.path = path
+        self.content_type = content_type
+        self.size = os.path.getsize(path)
+
+
+class MultipartEncoder:
+    """
+    multipart/form-data body that is produced while it is sent
+
+    Unlike requests' files= argument, which builds the whole body in memory
+    with every file open, only the file currently being sent is open and at
+    most one read() worth of it is in memory. The length is known up front,
+    so the body goes out with a Content-Length instead of chunked, and
+    seek(0) rewinds it for another attempt.
+
+    Passed as data= to requests (with content_type as the Content-Type
+    header), or read() chunk by chunk for aiohttp.
+    """
+
+    def __init__(
+        self,
+        files: Sequence[FilePart],
+        fields: Sequence[Tuple[str, str]] = (),
+        boundary: Optional[str] = None,
+    ):
+        """
+        Args:
+            files: File parts, sent in order
+            fields: Plain (name, value) fields, sent after the files
+            boundary: Multipart boundary; a random one if omitted
+        """
+        self.boundary = boundary or uuid.uuid4().hex
+        # Each segment is literal bytes or a file part
+        self._segments: List[Union[bytes, FilePart]] = []
+        for part in files:
+            self._segments.append(self.part_header(self.boundary, part.name, part.filename, part.content_type))
+            self._segments.append(part)
+            self._segments.append(CRLF)
+        for name, value in fields:
+            self._segments.append(self.part_header(self.boundary, name) + value.encode("utf-8") + CRLF)
+        self._segments.append(b"--" + self.boundary.encode("ascii") + b"--" + CRLF)
+        self._length = sum(s.size if isinstance(s, FilePart) else len(s) for s in self._segments)
+        self._index = 0
+        self._offset = 0
+        self._position = 0
+        self._file: Optional[IO[bytes]] = None
+
+    @staticmethod
+    def part_header(
+        boundary: str, name: str, filename: Optional[str] = None, content_type: Optional[str] = None
+    ) -> bytes:
+        disposition = f'form-data; name="{_quote(name)}"'
+        if filename is not None:
+            disposition += f'; filename="{_quote(filename)}"'
+        header = f"--{boundary}\r\nContent-Disposition: {disposition}\r\n"
+        if content_type is not None:
+            header += f"Content-Type: {content_type}\r\n"
+        return (header + "\r\n").encode("utf-8")
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self._length
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Rewind to the start; other positions are not supported"""
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("MultipartEncoder can only be rewound to the start")
+        self.close()
+        self._index = self._offset = self._position = 0
+        return 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length - self._position
+        chunks = []
+        while size > 0 and self._index < len(self._segments):
+            segment = self._segments[self._index]
+            segment_size = segment.size if isinstance(segment, FilePart) else len(segment)
+            if self._offset < segment_size:
+                if isinstance(segment, FilePart):
+                    chunk = self._read_file(segment, size)
+                else:
+                    chunk = segment[self._offset:self._offset + size]
+                self._offset += len(chunk)
+                size -= len(chunk)
+                chunks.append(chunk)
+            if self._offset >= segment_size:
+                self.close()
+                self._index += 1
+                self._offset = 0
+        data = b"".join(chunks)
+        self._position += len(data)
+        return data
+
+    def _read_file(self, part: FilePart, size: int) -> bytes:
+        if self._file is None:
+            self._file = open(part.path, "rb")
+        # Never more than the size the Content-Length was computed from
+        chunk = self._file.read(min(size, part.size - self._offset))
+        if not chunk:
+            raise OSError(f"{part.path} shrank while it was being uploaded")
+        return chunk
+
+    def __iter__(self) -> Iterator[bytes]:
+        # requests only streams bodies that are iterable
+        while True:
+            chunk = self.read(64 * 1024)
+            if not chunk:
+                return
+            yield chunk
+
+
+def split_parts(
+    files: Sequence[FilePart], max_bytes: int, fields: Sequence[Tuple[str, str]] = ()
+) -> Tuple[List[List[FilePart]], List[FilePart]]:
+    """
+    Group file parts into request bodies of at most max_bytes, keeping their order
+
+    Args:
+        files: File parts to send
+        max_bytes: Largest body per request; 0 or less puts every part in one
+        fields: Plain fields sent with every request
+
+    Returns:
+        The groups, and the parts that exceed max_bytes on their own
+    """
+    if max_bytes <= 0:
+        return ([list(files)] if files else []), []
+    # Only the boundary length matters for the sizes
+    boundary = "0" * 32
+    base = len(MultipartEncoder([], fields, boundary))
+    groups: List[List[FilePart]] = []
+    too_large: List[FilePart] = []
+    current: List[FilePart] = []
+    size = base
+    for part in files:
+        part_size = len(MultipartEncoder.part_header(boundary, part.name, part.filename, part.content_type))
+        part_size += part.size + len(CRLF)
+        if base + part_size > max_bytes:
+            too_large.append(part)
+            continue
+        if current and size + part_size > max_bytes:
+            groups.append(current)
+            current, size = [], base
+        current.append(part)
+        size += part_size
+    if current:
+        groups.append(current)
+    return groups, too_large
@@ -0,0 +1,118 @@
+"""
+Fast extraction of the few fields the decoder needs from service pages
+"""
+
+import html
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Comments, scripts and styles may contain markup that is not part of the page
+_NOISE = re.compile(rb"<!--.*?-->|<(script|style)\b.*?</\1\s*>", re.S | re.I)
+_NOISE_HINTS = (b"<!--", b"<script", b"<SCRIPT", b"<style", b"<STYLE")
+
+# Quoted attribute values may contain ">"
+_INPUT = re.compile(rb"""<input\b((?:[^>"']|"[^"]*"|'[^']*')*)>""", re.I)
+_ALERT = re.compile(rb"""<(div|span)\b((?:[^>"']|"[^"]*"|'[^']*')*)>""", re.I)
+_ATTR = re.compile(
+    rb"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+)))?"""
+)
+_TAG = re.compile(rb"<[^>]*>")
+_NESTING = {
+    b"div": re.compile(rb"<(/?)div\b[^>]*>", re.I),
+    b"span": re.compile(rb"<(/?)span\b[^>]*>", re.I),
+}
+
+SUCCESS_CLASSES = frozenset({"alert-success", "success"})
+FAILURE_CLASSES = frozenset({"alert-danger", "error", "danger"})
+
+
+def _text(raw: bytes) -> str:
+    return html.unescape(raw.decode("utf-8", "replace"))
+
+
+def _clean(content: bytes) -> bytes:
+    if any(hint in content for hint in _NOISE_HINTS):
+        return _NOISE.sub(b"", content)
+    return content
+
+
+def _attrs(raw: bytes) -> Dict[str, str]:
+    # Later duplicates win, as with BeautifulSoup's html.parser builder
+    attrs = {}
+    for m in _ATTR.finditer(raw):
+        name, dq, sq, uq = m.groups()
+        value = dq if dq is not None else sq if sq is not None else uq
+        attrs[name.decode("latin-1").lower()] = _text(value) if value is not None else ""
+    return attrs
+
+
+def _inputs(content: bytes) -> Iterator[Dict[str, str]]:
+    for m in _INPUT.finditer(_clean(content)):
+        yield _attrs(m.group(1))
+
+
+def queued_file_ids(content: bytes) -> List[str]:
+    """Return the values of the ``file[]`` inputs that list the decoder queue"""
+    ids = []
+    for attrs in _inputs(content):
+        if attrs.get("name") == "file[]" and attrs.get("value"):
+            ids.append(attrs["value"])
+    return ids
+
+
+def upload_input_name(content: bytes) -> Optional[str]:
+    """
+    Return the name of the file input of the upload form
+
+    The input with id "uploadfileblue" is preferred, then the first file
+    input, then the first input whose name contains "file".
+
+    Returns:
+        The input name ("uploadfile[]" if the input has none), or None if the
+        page has no upload form
+    """
+    by_type = by_name = None
+    for attrs in _inputs(content):
+        if attrs.get("id") == "uploadfileblue":
+            return attrs.get("name", "uploadfile[]")
+        if by_type is None and attrs.get("type") == "file":
+            by_type = attrs
+        if by_name is None and "file" in attrs.get("name", "").lower():
+            by_name = attrs
+    found = by_type or by_name
+    if found is None:
+        return None
+    return found.get("name", "uploadfile[]")
+
+
+def _element_text(content: bytes, tag: bytes, start: int) -> str:
+    # Text from start up to the close tag matching the element's nesting
+    depth = 1
+    for m in _NESTING[tag].finditer(content, start):
+        depth += -1 if m.group(1) else 1
+        if depth == 0:
+            return _text(_TAG.sub(b"", content[start:m.start()]))
+    return _text(_TAG.sub(b"", content[start:]))
+
+
+def upload_result(content: bytes) -> Tuple[List[str], List[str]]:
+    """
+    Return the (decoded, failed) file names reported on an upload result page
+
+    Alerts are div/span elements: success alerts read "File <name> ...",
+    failure alerts carry the name as their fourth word.
+    """
+    content = _clean(content)
+    success, failure = [], []
+    for m in _ALERT.finditer(content):
+        classes = set(_attrs(m.group(2)).get("class", "").split())
+        is_success = bool(classes & SUCCESS_CLASSES)
+        is_failure = bool(classes & FAILURE_CLASSES)
+        if not (is_success or is_failure):
+            continue
+        parts = _element_text(content, m.group(1).lower(), m.end()).split()
+        if is_success and len(parts) > 1:
+            success.append(parts[1])
+        if is_failure and len(parts) > 3:
+            failure.append(parts[3])
+    return success, failure
@@ -0,0 +1,96 @@
+"""
+Staged processing pipeline with bounded queues
+"""
+
+import queue
+import threading
+import logging
+from typing import Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+    """A pipeline stage: fn is applied to every item by `workers` threads"""
+
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int = 1):
+        """
+        Args:
+            name: Stage name used in logs and thread names
+            fn: Called with each item; returns the item for the next stage,
+                or None to drop it
+            workers: Number of threads running this stage
+        """
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages
+
+    Every stage has its own threads and reads from a bounded queue, so a slow
+    stage applies back-pressure instead of letting work pile up, while the
+    stages themselves overlap across items.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 2):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self._queues: List["queue.Queue[Any]"] = []
+
+    def depths(self) -> str:
+        """Current queue depth of every stage, for logging"""
+        return ", ".join(
+            f"{stage.name}={q.qsize()}" for stage, q in zip(self.stages, self._queues)
+        )
+
+    def _worker(self, index: int) -> None:
+        stage = self.stages[index]
+        inbox = self._queues[index]
+        outbox: Optional["queue.Queue[Any]"] = (
+            self._queues[index + 1] if index + 1 < len(self._queues) else None
+        )
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                return
+            logger.debug(f"Pipeline queues: {self.depths()}")
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                logger.error(f"Pipeline stage {stage.name} failed: {e}")
+                continue
+            if result is not None and outbox is not None:
+                outbox.put(result)
+
+    def run(self, items: Iterable[Any]) -> None:
+        """Feed items through all stages and wait until every stage drains"""
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads: List[List[threading.Thread]] = []
+        for index, stage in enumerate(self.stages):
+            stage_threads = [
+                threading.Thread(
+                    target=self._worker,
+                    args=(index,),
+                    name=f"{stage.name}_{n}",
+                    daemon=True,
+                )
+                for n in range(stage.workers)
+            ]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+
+        for item in items:
+            self._queues[0].put(item)
+
+        # Shut the stages down in order once their upstream has drained
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                self._queues[index].put(_STOP)
+            for thread in threads[index]:
+                thread.join()
@@ -0,0 +1,373 @@
+"""
+Retry policy and circuit breaker shared by every batch of a run
+"""
+
+import asyncio
+import random
+import socket
+import threading
+import time
+import logging
+from typing import Awaitable, Callable, Iterator, Mapping, Optional, TypeVar
+
+import requests
+
+from session import parse_retry_after
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, only needed by the async engine
+    aiohttp = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Outcome classes of a failed attempt
+FATAL = "fatal"          # retrying cannot help (bad credentials, page layout changed, 4xx)
+OUTAGE = "outage"        # the service did not answer (connection, timeout, 502/503/504)
+TRANSIENT = "transient"  # the service answered, but not as expected
+
+# 4xx statuses that are worth another attempt
+_RETRYABLE_4XX = frozenset({408, 425, 429})
+# 5xx statuses of an unavailable service. A plain 500 is an application error,
+# often caused by one uploaded file, and says nothing about availability
+_OUTAGE_5XX = frozenset({502, 503, 504})
+
+
+def _chain(exc: Optional[BaseException]) -> Iterator[BaseException]:
+    # Errors are usually wrapped (e.g. UploadError from HTTPError), so the
+    # whole cause chain is inspected
+    seen = 0
+    while exc is not None and seen < 10:
+        yield exc
+        exc = exc.__cause__ or exc.__context__
+        seen += 1
+
+
+def _http_status(exc: BaseException) -> Optional[int]:
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return exc.response.status_code
+    if aiohttp is not None and isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status
+    return None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    for e in _chain(exc):
+        headers: Optional[Mapping[str, str]] = None
+        if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+            headers = e.response.headers
+        elif aiohttp is not None and isinstance(e, aiohttp.ClientResponseError):
+            headers = e.headers
+        if headers is not None:
+            delay: Optional[float] = parse_retry_after(headers.get("Retry-After"))
+            return delay
+    return None
+
+
+def _is_outage(exc: BaseException) -> bool:
+    if isinstance(exc, (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        ConnectionError,
+        socket.timeout,
+        asyncio.TimeoutError,
+    )):
+        return True
+    if aiohttp is not None and isinstance(exc, aiohttp.ClientConnectionError):
+        return True
+    return _http_status(exc) in _OUTAGE_5XX
+
+
+def classify(exc: BaseException) -> str:
+    """
+    Tell whether a failed attempt is worth repeating
+
+    Args:
+        exc: The exception the attempt raised
+
+    Returns:
+        FATAL for errors marked ``retryable = False`` in exceptions.py and for
+        4xx responses, OUTAGE when the service did not answer, TRANSIENT
+        otherwise
+    """
+    kind = TRANSIENT
+    for e in _chain(exc):
+        if getattr(e, "retryable", True) is False:
+            return FATAL
+        status = _http_status(e)
+        if status is not None and 400 <= status < 500 and status not in _RETRYABLE_4XX:
+            return FATAL
+        if _is_outage(e):
+            kind = OUTAGE
+    return kind
+
+
+class CircuitBreaker:
+    """
+    Pauses every worker while the service is down
+
+    After threshold consecutive outage failures (from any worker) the circuit
+    opens and no request is attempted for cooldown seconds. Then a single
+    probe is let through: if it succeeds every worker resumes, if it fails
+    the circuit opens again for twice as long, up to max_cooldown. Any answer
+    from the service counts as a success here, even an error page.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0, max_cooldown: float = 300.0):
+        """
+        Args:
+            threshold: Consecutive outage failures that open the circuit
+            cooldown: Seconds the circuit stays open the first time
+            max_cooldown: Upper bound for the doubled cooldown
+        """
+        self.threshold = max(1, threshold)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.cooldown = cooldown
+        self.failures = 0
+        # How often the circuit opened during the run
+        self.trips = 0
+        self._open_until = 0.0
+        # When the current probe was let through; 0 while none is out
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def tripped(self) -> bool:
+        """True while the circuit is open or half-open"""
+        with self._lock:
+            return self.failures >= self.threshold
+
+    def wait_time(self) -> float:
+        """Return seconds to wait before attempting a request; 0 to go ahead"""
+        with self._lock:
+            if self.failures < self.threshold:
+                return 0.0
+            now = time.monotonic()
+            if now < self._open_until:
+                return self._open_until - now
+            # Half-open: this caller is the probe. The others keep waiting
+            # until it reports back, or until the window ends if it never does
+            self._open_until = now + self.cooldown
+            self._probe_at = now
+            return 0.0
+
+    def success(self) -> None:
+        with self._lock:
+            if self.failures >= self.threshold:
+                logger.info("Service is answering again, resuming all workers")
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self._probe_at = 0.0
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            now = time.monotonic()
+            if self.failures == self.threshold:
+                self.trips += 1
+                self._open_until = now + self.cooldown
+                logger.warning(
+                    f"Service unreachable after {self.failures} consecutive failures; "
+                    f"pausing all workers for {self.cooldown:g}s"
+                )
+            elif self._probe_at:
+                # The probe failed. Requests that were already in flight when
+                # the circuit opened may fail too; those do not extend it
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self._open_until = now + self.cooldown
+                self._probe_at = 0.0
+                logger.warning(f"Service still unreachable; pausing all workers for {self.cooldown:g}s")
+
+
+class RetryBudget:
+    """
+    Retries allowed across a whole run
+
+    Shared by every policy of the run (see RetryPolicy.derive()), so the
+    limit holds no matter which policy a retry goes through.
+    """
+
+    def __init__(self, limit: int = 50):
+        """
+        Args:
+            limit: Retries allowed across the whole run
+        """
+        self.limit = max(0, limit)
+        self.used = 0
+        self._lock = threading.Lock()
+
+    @property
+    def left(self) -> int:
+        with self._lock:
+            return max(0, self.limit - self.used)
+
+    def take(self) -> bool:
+        """Claim one retry; False once the budget is spent"""
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+
+class RetryPolicy:
+    """
+    The single retry layer of a decode run
+
+    Every upload/download attempt goes through call() (or acall() on the
+    asyncio engine). Fatal errors are raised at once. Other failures are
+    retried up to max_attempts per call, after a decorrelated-jitter delay
+    (random between base_delay and three times the previous delay, capped at
+    max_delay, and never below a Retry-After the server sent). Retries also
+    draw from a budget shared by the whole run; once it is spent, failures
+    are no longer retried, so a run against a broken service ends instead of
+    sleeping through every batch. Outage failures feed the circuit breaker.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        run_budget: int = 50,
+        base_delay: float = 2.0,
+        max_delay: float = 120.0,
+        breaker: Optional[CircuitBreaker] = None,
+        budget: Optional[RetryBudget] = None,
+    ):
+        """
+        Args:
+            max_attempts: Attempts per call (per batch), including the first
+            run_budget: Retries allowed across the whole run
+            base_delay: Smallest delay between attempts, in seconds
+            max_delay: Largest delay between attempts, in seconds
+            breaker: Circuit breaker shared by all callers; one is created if omitted
+            budget: Run budget shared with other policies; replaces run_budget
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max(base_delay, max_delay)
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.budget = budget if budget is not None else RetryBudget(run_budget)
+        self.fatal = 0
+        self._lock = threading.Lock()
+
+    @property
+    def run_budget(self) -> int:
+        return self.budget.limit
+
+    @property
+    def retries(self) -> int:
+        """Retries used so far by every policy sharing the budget"""
+        return self.budget.used
+
+    @property
+    def budget_left(self) -> int:
+        return self.budget.left
+
+    def derive(self, max_attempts: int, base_delay: float, max_delay: float) -> "RetryPolicy":
+        """
+        Return a policy with other attempt limits and delays
+
+        The new policy draws from the same run budget and feeds the same
+        circuit breaker as this one.
+        """
+        return RetryPolicy(
+            max_attempts=max_attempts,
+            base_delay=base_delay,
+            max_delay=max_delay,
+            breaker=self.breaker,
+            budget=self.budget,
+        )
+
+    def _next_delay(self, exc: BaseException, attempt: int, previous: float) -> Optional[float]:
+        # Returns the delay before the next attempt, or None to give up
+        kind = classify(exc)
+        if kind == OUTAGE:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+        if kind == FATAL:
+            with self._lock:
+                self.fatal += 1
+            logger.error(f"Not retrying: {exc}")
+            return None
+        if attempt + 1 >= self.max_attempts:
+            logger.error(f"All {self.max_attempts} attempts exhausted: {exc}")
+            return None
+        if not self.budget.take():
+            logger.error(f"Retry budget of {self.run_budget} spent for this run, giving up: {exc}")
+            return None
+
+        delay = min(self.max_delay, random.uniform(self.base_delay, max(previous, self.base_delay) * 3))
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        logger.warning(f"Attempt {attempt + 1}/{self.max_attempts} failed: {exc}. Retrying in {delay:.1f}s")
+        return delay
+
+    def call(self, fn: Callable[[], T], failed: Optional[Exception] = None) -> T:
+        """
+        Run fn, retrying it under this policy
+
+        Args:
+            fn: The attempt
+            failed: Error of a first attempt made elsewhere (e.g. split across
+                pipeline stages); fn then only runs as its retries
+        """
+        delay = 0.0
+        attempt = 0
+        if failed is not None:
+            next_delay = self._next_delay(failed, attempt, delay)
+            if next_delay is None:
+                raise failed
+            delay = next_delay
+            time.sleep(delay)
+            attempt += 1
+        while True:
+            wait = self.breaker.wait_time()
+            while wait > 0:
+                time.sleep(wait)
+                wait = self.breaker.wait_time()
+            try:
+                result = fn()
+            except Exception as exc:
+                next_delay = self._next_delay(exc, attempt, delay)
+                if next_delay is None:
+                    raise
+                delay = next_delay
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.success()
+            return result
+
+    async def acall(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """Async counterpart of call(); waits without blocking the event loop"""
+        delay = 0.0
+        attempt = 0
+        while True:
+            wait = self.breaker.wait_time()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.breaker.wait_time()
+            try:
+                result = await fn()
+            except Exception as exc:
+                next_delay = self._next_delay(exc, attempt, delay)
+                if next_delay is None:
+                    raise
+                delay = next_delay
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.success()
+            return result
+
+    def describe(self) -> str:
+        text = f"{self.retries}/{self.run_budget} retries used"
+        if self.breaker.trips:
+            text += f", circuit opened {self.breaker.trips}x"
+        return text
@@ -0,0 +1,102 @@
+"""
+Persistent classification cache for source tree scans
+"""
+
+import os
+import sqlite3
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[int, int, int, int]
+CacheEntry = Tuple[bool, Optional[str]]
+
+class ScanCache:
+    """
+    On-disk cache of ionCube classifications
+
+    Entries are keyed by (dev, inode, size, mtime_ns), so a file that has not
+    changed since the previous scan is classified from its stat result alone
+    and never opened. The content digest of ionCube files is kept alongside.
+    """
+
+    def __init__(self, path: str, rescan: bool = False):
+        """
+        Args:
+            path: Location of the sqlite cache file
+            rescan: Ignore existing entries and classify every file again
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[CacheKey, CacheEntry] = {}
+        self._seen: Dict[CacheKey, CacheEntry] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+                "ioncube INTEGER, digest TEXT, PRIMARY KEY (dev, inode, size, mtime_ns))"
+            )
+            if not rescan:
+                for dev, inode, size, mtime_ns, ioncube, digest in self._conn.execute(
+                    "SELECT dev, inode, size, mtime_ns, ioncube, digest FROM files"
+                ):
+                    self._entries[(dev, inode, size, mtime_ns)] = (bool(ioncube), digest)
+        except sqlite3.Error as e:
+            logger.warning(f"Scan cache unavailable ({path}): {e}")
+            self.close()
+
+    @staticmethod
+    def key(st: os.stat_result) -> CacheKey:
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def lookup(self, st: os.stat_result) -> Optional[CacheEntry]:
+        """Return the cached (is_ioncube, digest), or None if the file must be read"""
+        key = self.key(st)
+        cached = self._entries.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._seen[key] = cached
+        return cached
+
+    def store(self, st: os.stat_result, is_ioncube: bool, digest: Optional[str] = None) -> None:
+        """Remember the classification (and digest) of a file that was just read"""
+        key = self.key(st)
+        if key in self._seen and key in self._entries:
+            # A cached classification upgraded with a digest counts as a miss
+            self.hits -= 1
+            self.misses += 1
+        self._seen[key] = (is_ioncube, digest)
+
+    def save(self) -> None:
+        """
+        Persist the entries seen during this scan
+
+        Entries for files that disappeared or changed are dropped. Nothing is
+        written when the tree is unchanged since the previous scan.
+        """
+        if self._conn is None:
+            return
+        if self.misses == 0 and len(self._seen) == len(self._entries):
+            return
+        try:
+            with self._conn:
+                self._conn.execute("DELETE FROM files")
+                self._conn.executemany(
+                    "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    [key + (int(ioncube), digest) for key, (ioncube, digest) in self._seen.items()],
+                )
+            self._entries = dict(self._seen)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not save scan cache: {e}")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
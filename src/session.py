@@ -8,49 +8,189 @@ from urllib3.util.retry import Retry
 import bs4
 import time
 import logging
-from typing import Optional, Dict, Any
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, List, Callable, Tuple
+from urllib.parse import urlparse
 
-from exceptions import LoginError, NetworkError
+from exceptions import EasyToYouError, LoginError, NetworkError, SessionExpiredError
+from metrics import Metrics
 
 logger = logging.getLogger(__name__)
 
+# Browser-like headers shared by the sync and async sessions
+BROWSER_HEADERS: Dict[str, str] = {
+    "Connection": "keep-alive",
+    "Cache-Control": "no-cache",
+    "Pragma": "no-cache",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate, br",
+    "DNT": "1",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "sec-ch-ua": '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"'
+}
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header
+
+    Args:
+        value: Header value, either delay-seconds or an HTTP date
+
+    Returns:
+        Seconds to wait, or None if the header is missing or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def is_login_page(url: str, content_type: str, body: Optional[bytes]) -> bool:
+    """
+    Tell whether a response is the login page instead of what was requested
+    
+    Args:
+        url: Final URL of the response, after redirects
+        content_type: Content-Type header
+        body: Response body, or None if it must not be read (e.g. archives)
+        
+    Returns:
+        True if the session is logged out
+    """
+    if urlparse(url).path.rstrip("/").endswith("/login"):
+        return True
+    if body is None or not content_type.startswith("text/html"):
+        return False
+    return b'name="loginname"' in body
+
+class RateLimiter:
+    """
+    Token bucket shared by every session that talks to the service
+
+    Requests are spaced at the current rate, with bursts of up to burst
+    requests after an idle period. A 429 response halves the rate and pauses
+    all sessions for Retry-After; every successful request raises the rate
+    again by a small step, up to the configured maximum, so the run settles
+    at the highest rate the server tolerates.
+    """
+
+    def __init__(self, rate: float = 5.0, burst: int = 10, min_rate: float = 0.2):
+        """
+        Args:
+            rate: Maximum requests per second
+            burst: Requests allowed back to back after an idle period
+            min_rate: Floor the rate never drops below
+        """
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.throttled = 0
+        self._next = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            interval = 1.0 / self.rate
+            start = max(self._next, now - (self.burst - 1) * interval, self._paused_until)
+            self._next = start + interval
+            return max(0.0, start - now)
+
+    def acquire(self) -> None:
+        """Block until a request may be sent"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def throttle(self, retry_after: Optional[float] = None) -> float:
+        """
+        Slow down after the server answered 429
+
+        Args:
+            retry_after: Seconds from the Retry-After header, if any
+
+        Returns:
+            Seconds all sessions are paused for
+        """
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            rate = self.rate
+        logger.warning(f"Rate limited by server: pausing {pause:.1f}s, now {rate:.2f} req/s")
+        return pause
+
+    def success(self) -> None:
+        """Additively raise the rate after a request that was not throttled"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
 class SessionManager:
     """Manages HTTP session with easytoyou.eu"""
     
-    def __init__(self, base_url: str = "https://easytoyou.eu"):
+    # A 429 is retried this many times before the response is returned
+    max_throttle_retries = 5
+    
+    def __init__(
+        self,
+        base_url: str = "https://easytoyou.eu",
+        limiter: Optional[RateLimiter] = None,
+        metrics: Optional[Metrics] = None,
+    ):
         self.base_url = base_url
+        # Shared pacing for all sessions; None sends requests unpaced
+        self.limiter = limiter
+        # Request latency and status counts, shared with the decoder
+        self.metrics = metrics
         self.session: Optional[requests.Session] = None
         self.is_authenticated = False
+        # IDs last seen in this session's decoder queue: [] when known empty,
+        # None when unknown (a full clear is needed)
+        self.queue_ids: Optional[List[str]] = None
+        # Called after every successful login, e.g. to save the new cookies
+        self.on_login: Optional[Callable[["SessionManager"], None]] = None
+        # Kept after the first login so an expired session can log in again
+        self.credentials: Optional[Tuple[str, str]] = None
+        # Successful logins so far; a change means the server queue was lost
+        self.logins = 0
         
         # Enhanced headers to avoid bot detection
-        self.headers = {
-            "Connection": "keep-alive",
-            "Cache-Control": "no-cache",
-            "Pragma": "no-cache",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-            "Accept-Language": "en-US,en;q=0.9",
-            "Accept-Encoding": "gzip, deflate, br",
-            "DNT": "1",
-            "Upgrade-Insecure-Requests": "1",
-            "Sec-Fetch-Dest": "document",
-            "Sec-Fetch-Mode": "navigate",
-            "Sec-Fetch-Site": "none",
-            "Sec-Fetch-User": "?1",
-            "sec-ch-ua": '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": '"Windows"'
-        }
+        self.headers = dict(BROWSER_HEADERS)
     
     def setup_session(self) -> requests.Session:
         """Setup session with retry strategy and connection pooling"""
         self.session = requests.Session()
         
-        # Retry strategy
+        # Only connection setup is retried here (e.g. a stale pooled
+        # connection); nothing has been sent yet, so that is safe for POST.
+        # Error responses and timeouts go to the caller's RetryPolicy, and 429
+        # to the RateLimiter, which slows every session down.
         retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
+            total=2,
+            connect=2,
+            read=0,
+            other=0,
+            backoff_factor=0.5,
+            respect_retry_after_header=False,
         )
         
         adapter = HTTPAdapter(
@@ -88,12 +228,9 @@ class SessionManager:
         try:
             # Get login page
             login_page = f"{self.base_url}/login"
-            response = self.session.get(login_page, timeout=30)
+            response = self.get(login_page, timeout=30)
             response.raise_for_status()
             
-            # Add delay to avoid rate limiting
-            time.sleep(1)
-            
             # Parse login form for hidden fields
             soup = bs4.BeautifulSoup(response.content, 'html.parser')
             login_form = soup.find('form')
@@ -118,7 +255,7 @@ class SessionManager:
             })
             
             # Submit login
-            resp = self.session.post(
+            resp = self.post(
                 login_page,
                 headers=post_headers,
                 data=login_data,
@@ -131,6 +268,12 @@ class SessionManager:
             if "/account" in resp.url or "dashboard" in resp.url.lower():
                 logger.info("Login successful!")
                 self.is_authenticated = True
+                self.credentials = (username, password)
+                self.logins += 1
+                # A new server session starts with a queue we know nothing about
+                self.queue_ids = None
+                if self.on_login is not None:
+                    self.on_login(self)
                 return True
             else:
                 logger.error(f"Login failed. Redirected to: {resp.url}")
@@ -152,17 +295,141 @@ class SessionManager:
             logger.error(f"Unexpected error during login: {e}")
             raise LoginError(f"Login failed: {e}")
     
-    def get(self, url: str, **kwargs) -> requests.Response:
-        """Make GET request with session"""
+    def export_cookies(self) -> List[Dict[str, Any]]:
+        """Return the session cookies in a JSON-serializable form"""
         if not self.session:
+            return []
+        return [
+            {
+                "name": c.name,
+                "value": c.value,
+                "domain": c.domain,
+                "path": c.path,
+                "expires": c.expires,
+                "secure": c.secure,
+            }
+            for c in self.session.cookies
+        ]
+    
+    def restore(self, cookies: List[Dict[str, Any]]) -> bool:
+        """
+        Resume an authenticated session from saved cookies
+        
+        Args:
+            cookies: Cookies from export_cookies() of an earlier run
+            
+        Returns:
+            True if the server still accepts the session; one GET is sent
+        """
+        if not cookies:
+            return False
+        session = self.session or self.setup_session()
+        for c in cookies:
+            session.cookies.set(
+                c["name"], c["value"],
+                domain=c.get("domain", ""), path=c.get("path", "/"),
+                expires=c.get("expires"), secure=c.get("secure", False),
+            )
+        try:
+            # An expired session is redirected to the login page
+            response = self.get(f"{self.base_url}/account", timeout=30)
+            valid = response.ok and "/login" not in response.url
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not validate saved session: {e}")
+            valid = False
+        if not valid:
+            session.cookies.clear()
+        self.is_authenticated = valid
+        return valid
+    
+    @staticmethod
+    def _rewind(data: Any, files: Any) -> None:
+        # Streamed bodies and uploaded file objects were read by the previous attempt
+        if hasattr(data, "seek"):
+            data.seek(0)
+        for field in files or ():
+            value = field[1] if isinstance(field, tuple) else field
+            fobj = value[1] if isinstance(value, tuple) and len(value) > 1 else value
+            if hasattr(fobj, "seek"):
+                fobj.seek(0)
+    
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """
+        Send a request, logging in again once if the session has expired
+        
+        The request is replayed right after the new login instead of failing
+        into the caller's retry schedule.
+        
+        Raises:
+            SessionExpiredError: If the response is still the login page
+                after logging in again
+        """
+        response = self._send(method, url, **kwargs)
+        if self.credentials is None or "/login" in url or not self._logged_out(response):
+            return response
+        
+        logger.warning("Session expired, logging in again")
+        response.close()
+        try:
+            self.login(*self.credentials)
+        except EasyToYouError as e:
+            raise SessionExpiredError(f"Session expired and login failed: {e}") from e
+        self._rewind(kwargs.get("data"), kwargs.get("files"))
+        response = self._send(method, url, **kwargs)
+        if self._logged_out(response):
+            response.close()
+            raise SessionExpiredError(f"Still logged out after logging in again: {url}")
+        return response
+    
+    @staticmethod
+    def _logged_out(response: requests.Response) -> bool:
+        content_type = response.headers.get("content-type", "")
+        # Only HTML is inspected; reading it keeps iter_content() usable
+        body = response.content if content_type.startswith("text/html") else None
+        return is_login_page(response.url, content_type, body)
+    
+    def _send(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        # Goes through the rate limiter, backing off on 429
+        if self.limiter is None:
+            return self._perform(method, url, **kwargs)
+        
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            response = self._perform(method, url, **kwargs)
+            if response.status_code != 429 or attempt >= self.max_throttle_retries:
+                if response.status_code != 429:
+                    self.limiter.success()
+                return response
+            self.limiter.throttle(parse_retry_after(response.headers.get("Retry-After")))
+            response.close()
+            self._rewind(kwargs.get("data"), kwargs.get("files"))
+            attempt += 1
+    
+    def _perform(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        # One HTTP exchange, timed without the rate limiter wait. Streamed
+        # responses are timed up to their headers.
+        session = self.session
+        if not session:
             raise NetworkError("Session not initialized")
-        return self.session.get(url, **kwargs)
+        if self.metrics is None:
+            return session.request(method, url, **kwargs)
+        try:
+            with self.metrics.phase("http"):
+                response = session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.metrics.inc("http_requests", method=method, status="error")
+            raise
+        self.metrics.inc("http_requests", method=method, status=str(response.status_code))
+        return response
+    
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        """Make GET request with session"""
+        return self.request("GET", url, **kwargs)
     
-    def post(self, url: str, **kwargs) -> requests.Response:
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
         """Make POST request with session"""
-        if not self.session:
-            raise NetworkError("Session not initialized")
-        return self.session.post(url, **kwargs)
+        return self.request("POST", url, **kwargs)
     
     def close(self):
         """Close session"""
@@ -170,3 +437,4 @@ class SessionManager:
             self.session.close()
             self.session = None
             self.is_authenticated = False
+            self.queue_ids = None
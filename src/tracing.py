@@ -0,0 +1,149 @@
+"""
+Profiling: spans in the Chrome trace format and a cProfile that sees every thread
+"""
+
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from types import FrameType
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from decode_cache import write_atomic
+
+
+class Tracer:
+    """
+    Records spans as Chrome trace events
+
+    The output opens in chrome://tracing and https://ui.perfetto.dev. Every
+    thread gets its own track, and so does every asyncio task, because spans of
+    coroutines sharing the event loop thread overlap without nesting. A
+    disabled tracer records nothing and costs one attribute check per span.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self._origin = time.monotonic()
+        self._events: List[Dict[str, Any]] = []
+        self._tracks: Dict[Tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+
+    def _track(self) -> int:
+        # Track of the running asyncio task, or of the current thread
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            key, name = ("task", id(task)), f"asyncio {task.get_name()}"
+        else:
+            thread = threading.current_thread()
+            key, name = ("thread", thread.ident or 0), thread.name
+        with self._lock:
+            tid = self._tracks.get(key)
+            if tid is None:
+                tid = self._tracks[key] = len(self._tracks) + 1
+                self._events.append({
+                    "name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name},
+                })
+        return tid
+
+    def add(self, name: str, started: float, duration: float, **args: Any) -> None:
+        """
+        Record a span measured by the caller, on the current track
+
+        Args:
+            name: Span name
+            started: Start time from time.monotonic()
+            duration: Length in seconds
+            **args: Details shown with the span
+        """
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": "decoder",
+            "ph": "X",
+            "ts": round((started - self._origin) * 1e6, 1),
+            "dur": round(duration * 1e6, 1),
+            "pid": self.pid,
+            "tid": self._track(),
+        }
+        if args:
+            event["args"] = {k: str(v) for k, v in args.items()}
+        with self._lock:
+            self._events.append(event)
+
+    @contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[None]:
+        """Record the enclosed block as a span, failed or not"""
+        if not self.enabled:
+            yield
+            return
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, started, time.monotonic() - started, **args)
+
+    def write(self, path: str) -> None:
+        """Write the trace as JSON"""
+        with self._lock:
+            trace = {
+                "traceEvents": list(self._events),
+                "displayTimeUnit": "ms",
+                "otherData": {"command": " ".join(sys.argv)},
+            }
+        body = json.dumps(trace, separators=(",", ":")).encode("utf-8")
+        write_atomic(os.path.abspath(path), io.BytesIO(body))
+
+
+class ThreadProfiler:
+    """
+    cProfile over every thread of the run, merged into one stats file
+
+    Before Python 3.12 a cProfile.Profile only sees the thread that enabled
+    it, so each thread started while profiling gets its own profile. From
+    3.12 on one profile sees all threads.
+    """
+
+    def __init__(self) -> None:
+        self._profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._main: Optional[cProfile.Profile] = None
+
+    def _bootstrap(self, frame: FrameType, event: str, arg: Any) -> None:
+        # First profile event of a new thread: hand it its own profiler,
+        # which replaces this hook for the thread
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def start(self) -> None:
+        self._main = cProfile.Profile()
+        self._profiles.append(self._main)
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._bootstrap)
+        self._main.enable()
+
+    def stop(self) -> None:
+        if self._main is None:
+            return
+        self._main.disable()
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+
+    def dump(self, path: str) -> None:
+        """Write the merged stats for pstats, snakeviz and the like"""
+        with self._lock:
+            profiles = list(self._profiles)
+        pstats.Stats(*profiles).dump_stats(path)
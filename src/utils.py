@@ -4,12 +4,21 @@ Utility functions for EasyToYou decoder
 
 import os
 import re
+import hashlib
 import logging
-from typing import List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 from pathlib import Path
 
+if TYPE_CHECKING:
+    from scan_cache import ScanCache
+
 logger = logging.getLogger(__name__)
 
+# Classification of scanned files
+FILE_IONCUBE = "ioncube"
+FILE_PHP = "php"
+FILE_OTHER = "other"
+
 def is_ioncube_file(filepath: str) -> bool:
     """
     Check if a file is ionCube encoded
@@ -21,13 +30,180 @@ def is_ioncube_file(filepath: str) -> bool:
         True if file is ionCube encoded, False otherwise
     """
     try:
-        with open(filepath, 'rb') as f:
-            content = f.read(1024)  # Read first 1KB
-            return b"ionCube Loader" in content or b"ioncube" in content.lower()
+        return _has_ioncube_header(filepath)
     except Exception as e:
         logger.warning(f"Could not read file {filepath}: {e}")
         return False
 
+def _has_ioncube_header(filepath: str) -> bool:
+    with open(filepath, 'rb') as f:
+        content = f.read(1024)  # Read first 1KB
+        return b"ionCube Loader" in content or b"ioncube" in content.lower()
+
+def file_digest(filepath: str) -> str:
+    """
+    Compute the SHA-256 digest of a file's content
+    
+    Args:
+        filepath: Path to the file
+        
+    Returns:
+        Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ScannedDirectory:
+    """Files of a single directory, grouped by classification"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ioncube: List[str] = []
+        self.php: List[str] = []
+        self.other: List[str] = []
+
+class ScanIndex:
+    """
+    Result of a single-pass scan of a source tree
+
+    Every file is classified exactly once; the index can then be shared by
+    anything that needs to know which files are ionCube encoded.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.directories: List[ScannedDirectory] = []
+        self._kinds: Dict[str, str] = {}
+        self._digests: Dict[str, str] = {}
+
+    def add(
+        self, directory: ScannedDirectory, filename: str, kind: str, digest: Optional[str] = None
+    ) -> None:
+        """Record a classified file of a scanned directory"""
+        getattr(directory, kind).append(filename)
+        path = os.path.join(directory.path, filename)
+        self._kinds[path] = kind
+        if digest is not None:
+            self._digests[path] = digest
+
+    def kind_of(self, filepath: str) -> Optional[str]:
+        """Return the classification of a scanned file, or None if unknown"""
+        kind = self._kinds.get(filepath)
+        if kind is None:
+            kind = self._kinds.get(os.path.normpath(filepath))
+        return kind
+
+    def digest_of(self, filepath: str) -> Optional[str]:
+        """Return the content digest computed during the scan, if any"""
+        digest = self._digests.get(filepath)
+        if digest is None:
+            digest = self._digests.get(os.path.normpath(filepath))
+        return digest
+
+    @property
+    def ioncube_count(self) -> int:
+        return sum(len(d.ioncube) for d in self.directories)
+
+    def ioncube_files(self) -> List[str]:
+        """List the full paths of all ionCube encoded files"""
+        return [
+            os.path.join(d.path, filename)
+            for d in self.directories
+            for filename in d.ioncube
+        ]
+
+
+
+def _read_php(path: str, hash_ioncube: bool) -> Tuple[bool, Optional[str], bool]:
+    # The last item is False when the file could not be read; that result
+    # is a guess and must not be cached
+    try:
+        is_ioncube = _has_ioncube_header(path)
+    except OSError as e:
+        logger.warning(f"Could not read file {path}: {e}")
+        return False, None, False
+    digest = None
+    if is_ioncube and hash_ioncube:
+        try:
+            digest = file_digest(path)
+        except OSError as e:
+            logger.warning(f"Could not hash file {path}: {e}")
+    return is_ioncube, digest, True
+
+
+def _classify_php(
+    entry: os.DirEntry, cache: Optional["ScanCache"], hash_ioncube: bool
+) -> Tuple[str, Optional[str]]:
+    st = None
+    if cache is not None:
+        try:
+            st = entry.stat()
+        except OSError:
+            pass
+
+    cached = cache.lookup(st) if cache is not None and st is not None else None
+    if cached is None or (hash_ioncube and cached[0] and cached[1] is None):
+        is_ioncube, digest, read = _read_php(entry.path, hash_ioncube)
+        if read and cache is not None and st is not None:
+            cache.store(st, is_ioncube, digest)
+    else:
+        is_ioncube, digest = cached
+    return (FILE_IONCUBE if is_ioncube else FILE_PHP), digest
+
+
+def scan_tree(
+    directory: str, cache: Optional["ScanCache"] = None, hash_ioncube: bool = False
+) -> ScanIndex:
+    """
+    Scan a directory tree once, classifying every file
+
+    PHP files are sniffed for the ionCube header a single time; everything
+    else is classified from its name alone. Directories are visited top-down
+    in the same order as os.walk, and symlinked directories are not followed.
+
+    Args:
+        directory: Directory to scan
+        cache: Optional scan cache; unchanged PHP files are not opened
+        hash_ioncube: Also record the SHA-256 of every ionCube file
+
+    Returns:
+        ScanIndex with every file classified as ionCube, plain PHP or other
+    """
+    index = ScanIndex(directory)
+    pending = [directory]
+
+    while pending:
+        path = pending.pop()
+        scanned = ScannedDirectory(path)
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                subdirs.append(entry.path)
+                            continue
+                    except OSError:
+                        pass
+                    digest = None
+                    if entry.name.lower().endswith('.php'):
+                        kind, digest = _classify_php(entry, cache, hash_ioncube)
+                    else:
+                        kind = FILE_OTHER
+                    index.add(scanned, entry.name, kind, digest)
+        except OSError as e:
+            logger.error(f"Error scanning directory {path}: {e}")
+            continue
+
+        index.directories.append(scanned)
+        pending.extend(reversed(subdirs))
+
+    return index
+
 def find_php_files(directory: str) -> List[str]:
     """
     Find all PHP files in a directory recursively
@@ -59,14 +235,7 @@ def find_ioncube_files(directory: str) -> List[str]:
     Returns:
         List of ionCube encoded PHP file paths
     """
-    ioncube_files = []
-    php_files = find_php_files(directory)
-    
-    for php_file in php_files:
-        if is_ioncube_file(php_file):
-            ioncube_files.append(php_file)
-    
-    return ioncube_files
+    return scan_tree(directory).ioncube_files()
 
 def create_directory(path: str) -> bool:
     """
@@ -147,24 +316,30 @@ def format_file_size(size_bytes: int) -> str:
         size_bytes /= 1024.0
     return f"{size_bytes:.1f} TB"
 
-def get_file_info(filepath: str) -> dict:
+def get_file_info(filepath: str, index: Optional[ScanIndex] = None) -> dict:
     """
     Get file information
     
     Args:
         filepath: Path to file
+        index: Optional scan index; avoids re-reading the file header
         
     Returns:
         Dictionary with file information
     """
     try:
         stat = os.stat(filepath)
+        kind = index.kind_of(filepath) if index is not None else None
+        if kind is None:
+            is_ioncube = is_ioncube_file(filepath)
+        else:
+            is_ioncube = kind == FILE_IONCUBE
         return {
             'name': os.path.basename(filepath),
             'size': stat.st_size,
             'size_formatted': format_file_size(stat.st_size),
             'modified': stat.st_mtime,
-            'is_ioncube': is_ioncube_file(filepath)
+            'is_ioncube': is_ioncube
         }
     except Exception as e:
         logger.error(f"Could not get file info for {filepath}: {e}")
@@ -0,0 +1,113 @@
+"""
+Watermark rewriting for decoded PHP files
+"""
+
+import re
+from typing import IO, Tuple
+
+# EasyToYou puts its banner right after the opening tag, so only the start of
+# a file is inspected. The header is extended to the end of the line (and any
+# blank lines following it) so no pattern is cut in half.
+HEADER_LIMIT = 8 * 1024
+_LINE_LIMIT = 4 * 1024
+_CHUNK_SIZE = 64 * 1024
+
+# Banner variants, removed one after another in this order. They are not
+# merged into one alternation: with DOTALL, the generic comment pattern would
+# then match from an earlier, unrelated /* ... */ (e.g. a licence) up to the
+# banner and delete both.
+_BANNER_PATTERNS = [
+    re.compile(rb"/\*\s*\*\s*@\s*https://EasyToYou\.eu.*?\*/\s*\n*", re.DOTALL | re.IGNORECASE),
+    re.compile(rb"/\*[^*]*\*\s*@\s*https://EasyToYou\.eu.*?\*/\s*\n*", re.DOTALL | re.IGNORECASE),
+    re.compile(rb"//\s*Decoded\s*file\s*for\s*php\s*version.*?\n", re.DOTALL | re.IGNORECASE),
+    re.compile(rb"/\*.*?EasyToYou\.eu.*?\*/\s*\n*", re.DOTALL | re.IGNORECASE),
+    re.compile(rb"//.*?EasyToYou\.eu.*?\n", re.DOTALL | re.IGNORECASE),
+    re.compile(rb"//\s*Decoder\s*version:.*?\n", re.IGNORECASE),
+    re.compile(rb"//\s*Release:.*?\n", re.IGNORECASE),
+    re.compile(rb"//\s*PHP\s*\d+\.\d+.*?\n", re.IGNORECASE),
+]
+_OPEN_TAG_RE = re.compile(rb"(<\?php\s*)", re.IGNORECASE)
+_BLANK_LINES_RE = re.compile(rb"\n{3,}")
+
+
+def split_header(content: bytes) -> int:
+    """
+    Return the length of the header region of content
+
+    Args:
+        content: File content, or at least its first HEADER_LIMIT + a few KB
+
+    Returns:
+        Offset where the header ends
+    """
+    if len(content) <= HEADER_LIMIT:
+        return len(content)
+    end = content.find(b"\n", HEADER_LIMIT, HEADER_LIMIT + _LINE_LIMIT)
+    if end == -1:
+        return HEADER_LIMIT
+    end += 1
+    while end < len(content) and content[end:end + 1] == b"\n":
+        end += 1
+    return end
+
+
+class WatermarkEngine:
+    """
+    Replaces the EasyToYou banner with a custom watermark
+
+    Works on bytes and only ever rewrites the header region, so the cost per
+    file is bounded no matter how large the file is.
+    """
+
+    def __init__(self, watermark: str):
+        # Same replacement template the str-based implementation used
+        self._template = b"\\1\\n" + watermark.encode("utf-8")
+        self._watermark = watermark.encode("utf-8")
+
+    def _rewrite_header(self, header: bytes) -> Tuple[bytes, bool]:
+        for pattern in _BANNER_PATTERNS:
+            header = pattern.sub(b"", header)
+        match = _OPEN_TAG_RE.search(header)
+        if match is None:
+            return header, False
+        header = header[:match.start()] + match.expand(self._template) + header[match.end():]
+        return _BLANK_LINES_RE.sub(b"\n\n", header), True
+
+    def rewrite(self, content: bytes) -> bytes:
+        """Rewrite a complete file"""
+        end = split_header(content)
+        header, tagged = self._rewrite_header(content[:end])
+        if tagged:
+            return header + content[end:]
+
+        match = _OPEN_TAG_RE.search(content, end)
+        if match is None:
+            return _BLANK_LINES_RE.sub(b"\n\n", self._watermark + header) + content[end:]
+
+        # The opening tag is further down (e.g. after inline HTML); the banner
+        # follows it, so the region starting at the tag is rewritten instead.
+        tail = content[match.start():]
+        tail_end = split_header(tail)
+        tail_header, _ = self._rewrite_header(tail[:tail_end])
+        return header + content[end:match.start()] + tail_header + tail[tail_end:]
+
+    def rewrite_stream(self, src: IO[bytes], dst: IO[bytes]) -> None:
+        """
+        Rewrite a file from src into dst
+
+        Only the header is held in memory; the rest is copied in chunks.
+        """
+        head = src.read(HEADER_LIMIT + _LINE_LIMIT)
+        end = split_header(head)
+        header, tagged = self._rewrite_header(head[:end])
+        if not tagged:
+            # Rare: the opening tag is not near the top, rewrite the whole file
+            dst.write(self.rewrite(head + src.read()))
+            return
+        dst.write(header)
+        dst.write(head[end:])
+        while True:
+            chunk = src.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
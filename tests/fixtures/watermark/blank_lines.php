@@ -0,0 +1,29 @@
+<?php
+
+
+
+/*
+ * @ https://EasyToYou.eu - IonCube v11 Decoder Online
+ * @ PHP 7.4
+ * @ Decoder version: 1.0.6
+ * @ Release: 10/08/2022
+ */
+
+// Decoded file for php version 74.
+
+
+
+
+namespace App\Http;
+
+class Kernel
+{
+    public function handle($request)
+    {
+        return $request; // done
+    }
+}
+
+
+
+
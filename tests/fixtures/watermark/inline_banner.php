@@ -0,0 +1,10 @@
+<?php /* EasyToYou.eu ionCube decoder */
+namespace App\Http;
+
+class Kernel
+{
+    public function handle($request)
+    {
+        return $request; // done
+    }
+}
@@ -0,0 +1,14 @@
+<?php
+// Decoded by EasyToYou.eu
+// Decoder version: 2.1
+// Release: 2023-01-01
+// PHP 8.1
+namespace App\Http;
+
+class Kernel
+{
+    public function handle($request)
+    {
+        return $request; // done
+    }
+}
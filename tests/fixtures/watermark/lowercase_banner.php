@@ -0,0 +1,13 @@
+<?php
+/*
+ * @ https://easytoyou.eu - ioncube decoder
+ */
+namespace App\Http;
+
+class Kernel
+{
+    public function handle($request)
+    {
+        return $request; // done
+    }
+}
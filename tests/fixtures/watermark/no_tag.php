@@ -0,0 +1,5 @@
+Plain template text
+
+
+
+with blank lines
@@ -0,0 +1,13 @@
+<?php
+/**
+*@https://EasyToYou.eu
+*/
+namespace App\Http;
+
+class Kernel
+{
+    public function handle($request)
+    {
+        return $request; // done
+    }
+}
@@ -0,0 +1,15 @@
+<?php
+/*
+ * @ https://EasyToYou.eu - IonCube v11 Decoder Online
+ * @ PHP 7.4
+ * @ Decoder version: 1.0.6
+ * @ Release: 10/08/2022
+ */
+
+// Decoded file for php version 74.
+echo 1;
+?>
+<p>x</p>
+<?php
+// PHP 7.4 runtime check
+echo 2;
@@ -0,0 +1,12 @@
+<?php
+/*
+ * @ https://EasyToYou.eu - decoder
+namespace App\Http;
+
+class Kernel
+{
+    public function handle($request)
+    {
+        return $request; // done
+    }
+}
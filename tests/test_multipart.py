@@ -0,0 +1,135 @@
+"""
+Streaming multipart bodies and their split into upload requests
+"""
+
+import email
+import email.policy
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from multipart import FilePart, MultipartEncoder, split_parts
+
+FIELDS = [("submit", "Decode"), ("note", "naïve \"quoted\" value")]
+
+
+@pytest.fixture
+def parts(tmp_path):
+    contents = {
+        "a.php": b"<?php echo 1;\n",
+        "empty.php": b"",
+        'we"ird\\name.php': bytes(range(256)) * 40,
+    }
+    result = []
+    for i, (name, content) in enumerate(contents.items()):
+        path = tmp_path / f"file{i}"
+        path.write_bytes(content)
+        result.append(FilePart("uploadfile[]", name, str(path), "application/x-php"))
+    return result
+
+
+def _read_all(encoder, size):
+    chunks = []
+    while True:
+        chunk = encoder.read(size)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def _parse(encoder, body):
+    message = email.message_from_bytes(
+        f"Content-Type: {encoder.content_type}\r\n\r\n".encode("latin-1") + body,
+        policy=email.policy.HTTP,
+    )
+    fields, files = [], []
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True)
+        if part.get_filename() is None:
+            fields.append((name, payload.decode("utf-8")))
+        else:
+            files.append((name, part.get_filename(), part.get_content_type(), payload))
+    return fields, files
+
+
+@pytest.mark.parametrize("size", [1, 7, 64 * 1024, -1])
+def test_streamed_length_matches_len(parts, size):
+    encoder = MultipartEncoder(parts, FIELDS)
+    body = _read_all(encoder, size)
+    assert len(body) == len(encoder) == encoder.tell()
+    # requests iterates over the body
+    assert b"".join(MultipartEncoder(parts, FIELDS, encoder.boundary)) == body
+
+
+def test_body_parses_back(parts):
+    encoder = MultipartEncoder(parts, FIELDS)
+    fields, files = _parse(encoder, _read_all(encoder, 1000))
+
+    assert fields == FIELDS
+    # Quotes in names are sent as %22, like browsers do
+    assert files == [
+        (part.name, part.filename.replace('"', "%22"), part.content_type, Path(part.path).read_bytes())
+        for part in parts
+    ]
+
+
+def test_seek_replays_identical_body(parts):
+    encoder = MultipartEncoder(parts, FIELDS)
+    expected = _read_all(MultipartEncoder(parts, FIELDS, encoder.boundary), 4096)
+
+    # Rewound halfway through the last file
+    encoder.read(5000)
+    assert encoder.seek(0) == 0
+    assert encoder.tell() == 0
+    assert _read_all(encoder, 333) == expected
+
+    encoder.seek(0)
+    assert _read_all(encoder, 4096) == expected
+
+
+def _request_size(group, fields=()):
+    return len(MultipartEncoder(group, fields, "0" * 32))
+
+
+def test_split_at_exact_limit(parts):
+    pair = _request_size(parts[:2], FIELDS)
+
+    # Exactly the size of both parts in one request: they share it
+    assert split_parts(parts[:2], pair, FIELDS) == ([parts[:2]], [])
+    # One byte less: the second part starts a new request
+    assert split_parts(parts[:2], pair - 1, FIELDS) == ([[parts[0]], [parts[1]]], [])
+
+    # Every request stays within the limit and the order is kept
+    largest = max(_request_size([part], FIELDS) for part in parts)
+    for limit in (largest, largest + 1, _request_size(parts, FIELDS) - 1):
+        groups, too_large = split_parts(parts, limit, FIELDS)
+        assert too_large == []
+        assert all(_request_size(group, FIELDS) <= limit for group in groups)
+        assert [part for group in groups for part in group] == parts
+
+
+def test_part_larger_than_limit(parts):
+    limit = _request_size([parts[2]], FIELDS) - 1
+    groups, too_large = split_parts(parts, limit, FIELDS)
+    assert too_large == [parts[2]]
+    assert groups == [parts[:2]]
+
+    # A part that fits the limit exactly is sent
+    groups, too_large = split_parts([parts[2]], limit + 1, FIELDS)
+    assert (groups, too_large) == ([[parts[2]]], [])
+
+
+def test_no_limit_keeps_one_request(parts):
+    assert split_parts(parts, 0, FIELDS) == ([parts], [])
+    assert split_parts([], 0) == ([], [])
+
+
+def test_file_shrinking_during_upload_fails(parts):
+    encoder = MultipartEncoder(parts, FIELDS)
+    Path(parts[2].path).write_bytes(b"short")
+    with pytest.raises(OSError):
+        _read_all(encoder, 1024)
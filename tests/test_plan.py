@@ -0,0 +1,40 @@
+"""
+Planning a run over a partly decoded tree
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from decoder import IonicubeDecoder
+from journal import ProgressJournal
+
+ENCODED = b"<?php // ionCube Loader\n"
+
+
+def test_existing_outputs_recorded_in_one_append(tmp_path, monkeypatch):
+    source, dest = tmp_path / "src", tmp_path / "out"
+    for d in range(5):
+        for name in ("done.php", "todo.php"):
+            (source / f"d{d}").mkdir(parents=True, exist_ok=True)
+            (source / f"d{d}" / name).write_bytes(ENCODED + f"{d}/{name}\n".encode())
+        (dest / f"d{d}").mkdir(parents=True)
+        (dest / f"d{d}" / "done.php").write_bytes(b"<?php\n")
+
+    appends = []
+    append = ProgressJournal.append
+
+    def counting_append(self, paths):
+        appends.append(list(paths))
+        append(self, paths)
+
+    monkeypatch.setattr(ProgressJournal, "append", counting_append)
+
+    decoder = IonicubeDecoder("user", "pass", use_scan_cache=False)
+    items, _ = decoder._plan(str(source), str(dest), overwrite=False)
+    decoder._journal.close()
+
+    assert sorted(item.rel_path for item in items) == [f"d{d}/todo.php" for d in range(5)]
+    assert [sorted(paths) for paths in appends] == [[f"d{d}/done.php" for d in range(5)]]
+    assert ProgressJournal(decoder.progress_file).load() == {f"d{d}/done.php" for d in range(5)}
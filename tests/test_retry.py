@@ -0,0 +1,47 @@
+"""
+Run budget shared between retry policies
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from retry import RetryPolicy
+
+
+def _failing():
+    raise ValueError("boom")
+
+
+def test_derived_policy_shares_budget():
+    policy = RetryPolicy(max_attempts=5, run_budget=3, base_delay=0.0, max_delay=0.0)
+    short = policy.derive(max_attempts=2, base_delay=0.0, max_delay=0.0)
+    assert short.breaker is policy.breaker
+
+    with pytest.raises(ValueError):
+        short.call(_failing)
+    assert policy.retries == short.retries == 1
+
+    with pytest.raises(ValueError):
+        policy.call(_failing)
+    # Two retries left in the shared budget, not four
+    assert policy.retries == 3
+    assert short.budget_left == 0
+
+
+def test_failed_first_attempt_counts():
+    policy = RetryPolicy(max_attempts=3, run_budget=10, base_delay=0.0, max_delay=0.0)
+    calls = []
+
+    def attempt():
+        calls.append(1)
+        raise ValueError("again")
+
+    with pytest.raises(ValueError):
+        policy.call(attempt, failed=ValueError("first"))
+    # The attempt made elsewhere was the first of three
+    assert len(calls) == 2
+    assert policy.retries == 2
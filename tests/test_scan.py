@@ -0,0 +1,35 @@
+"""
+Scan cache handling of files that cannot be read
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import utils
+from scan_cache import ScanCache
+from utils import scan_tree
+
+
+def test_unreadable_file_is_not_cached(tmp_path, monkeypatch):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "a.php").write_bytes(b"<?php // ionCube Loader\n")
+
+    def unreadable(path):
+        raise PermissionError(13, "Permission denied", path)
+
+    cache = ScanCache(str(tmp_path / "scan.db"))
+    monkeypatch.setattr(utils, "_has_ioncube_header", unreadable)
+    scan_tree(str(source), cache)
+    cache.save()
+    cache.close()
+
+    # Once readable again, the file is read rather than taken from the cache
+    monkeypatch.undo()
+    cache = ScanCache(str(tmp_path / "scan.db"))
+    index = scan_tree(str(source), cache)
+    assert cache.misses == 1
+    assert index.ioncube_count == 1
+    cache.close()
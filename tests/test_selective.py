@@ -0,0 +1,135 @@
+"""
+Downloads by queue ID against the mock server
+"""
+
+import asyncio
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from decoder import IonicubeDecoder
+from mock_server import DECODED_HEADER, MockServer
+
+
+@pytest.fixture
+def server():
+    with MockServer() as mock:
+        yield mock
+
+
+@pytest.fixture
+def source(tmp_path):
+    for name in ("left1.php", "left2.php", "left3.php", "x.php", "y.php"):
+        (tmp_path / name).write_bytes(b"<?php // ionCube Loader\n" + name.encode() + b"\n")
+    return str(tmp_path)
+
+
+def _decoder(server, **options):
+    decoder = IonicubeDecoder("user", "pass", base_url=server.url, rate_limit=0, use_scan_cache=False, **options)
+    assert decoder.login()
+    return decoder
+
+
+def _downloads(server):
+    return server.stats().get("downloads", 0)
+
+
+def _members(archive):
+    with zipfile.ZipFile(archive) as zf:
+        return {name.rsplit("/", 1)[-1]: zf.read(name) for name in zf.namelist()}
+
+
+def test_small_batch_with_leftovers_fetched_by_id(server, source):
+    decoder = _decoder(server)
+    # Left in the queue, as after a failed clear
+    decoder.upload_files(source, ["left1.php", "left2.php", "left3.php"])
+    success, failure = decoder.upload_files(source, ["x.php", "y.php"])
+    assert (sorted(success), failure) == (["x.php", "y.php"], [])
+    assert len(decoder.session_manager.queue_ids) == 5
+
+    before = _downloads(server)
+    members = _members(decoder._fetch_results(success))
+
+    assert sorted(members) == ["x.php", "y.php"]
+    assert members["x.php"] == DECODED_HEADER + b"x.php\n"
+    assert _downloads(server) - before == 2
+    assert (decoder.selective_batches, decoder.selective_skipped) == (1, 3)
+
+
+def test_queue_holding_only_the_batch_uses_archive(server, source):
+    decoder = _decoder(server)
+    success, _ = decoder.upload_files(source, ["x.php", "y.php"])
+
+    before = _downloads(server)
+    members = _members(decoder._fetch_results(success))
+
+    assert sorted(members) == ["x.php", "y.php"]
+    assert _downloads(server) - before == 1
+    assert decoder.selective_batches == 0
+
+
+@pytest.mark.filterwarnings("ignore:Duplicate name")
+def test_ambiguous_ids_fall_back_to_archive(server, source):
+    decoder = _decoder(server)
+    # Two queue entries for x.php: the listing cannot tell them apart
+    decoder.upload_files(source, ["x.php", "left1.php"])
+    success, _ = decoder.upload_files(source, ["x.php"])
+
+    before = _downloads(server)
+    members = _members(decoder._fetch_results(success))
+
+    assert "x.php" in members
+    assert _downloads(server) - before == 1
+    assert decoder.selective_batches == 0
+
+
+@pytest.mark.parametrize("limit", [0, 1])
+def test_batches_over_the_limit_use_archive(server, source, limit):
+    decoder = _decoder(server, selective_download=limit)
+    decoder.upload_files(source, ["left1.php"])
+    success, _ = decoder.upload_files(source, ["x.php", "y.php"])
+
+    before = _downloads(server)
+    members = _members(decoder._fetch_results(success))
+
+    assert sorted(members) == ["left1.php", "x.php", "y.php"]
+    assert _downloads(server) - before == 1
+
+
+def test_async_engine_fetches_by_id(server, source, monkeypatch):
+    pytest.importorskip("aiohttp")
+    from async_decoder import AsyncIonicubeDecoder
+    from async_session import AsyncSessionManager
+    from batching import BatchItem
+
+    async def keep_queue(session_manager):
+        # Leaves the earlier upload queued, as after a failed clear
+        return None
+
+    async def run():
+        decoder = AsyncIonicubeDecoder("user", "pass", base_url=server.url, rate_limit=0, use_scan_cache=False)
+        monkeypatch.setattr(decoder, "_aprepare_queue", keep_queue)
+        session_manager = AsyncSessionManager(server.url)
+        try:
+            assert await session_manager.login("user", "pass")
+            batches = [
+                [BatchItem(str(Path(source, name)), "", name) for name in names]
+                for names in (["left1.php", "left2.php"], ["x.php"])
+            ]
+            for batch in batches:
+                success, _ = await decoder._aupload_batch(session_manager, batch)
+            before = _downloads(server)
+            archive = await decoder._afetch_results(session_manager, success)
+            return decoder, _members(archive), _downloads(server) - before
+        finally:
+            await session_manager.close()
+
+    decoder, members, downloads = asyncio.run(run())
+
+    assert sorted(members) == ["x.php"]
+    assert downloads == 1
+    assert (decoder.selective_batches, decoder.selective_skipped) == (1, 2)
@@ -0,0 +1,82 @@
+"""
+Byte-identity of WatermarkEngine with the original str-based implementation
+"""
+
+import io
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from watermark import HEADER_LIMIT, WatermarkEngine
+
+FIXTURES = sorted((Path(__file__).parent / "fixtures" / "watermark").glob("*.php"))
+
+WATERMARKS = [
+    "/*\n * Decoded by RBW-Tech\n * https://rbwtech.io\n */\n\n",
+    "// custom watermark\n",
+]
+
+
+def legacy_replace_watermark(content: bytes, custom_watermark: str) -> bytes:
+    # IonicubeDecoder._replace_watermark before WatermarkEngine, verbatim
+    # apart from the decode fallbacks, which UTF-8 fixtures never reach
+    content_str = content.decode("utf-8")
+
+    patterns = [
+        r"/\*\s*\*\s*@\s*https://EasyToYou\.eu.*?\*/\s*\n*",
+        r"/\*[^*]*\*\s*@\s*https://EasyToYou\.eu.*?\*/\s*\n*",
+        r"//\s*Decoded\s*file\s*for\s*php\s*version.*?\n",
+        r"/\*.*?EasyToYou\.eu.*?\*/\s*\n*",
+        r"//.*?EasyToYou\.eu.*?\n",
+    ]
+    for pattern in patterns:
+        content_str = re.sub(pattern, "", content_str, flags=re.DOTALL | re.IGNORECASE)
+
+    content_str = re.sub(r"//\s*Decoder\s*version:.*?\n", "", content_str, flags=re.IGNORECASE)
+    content_str = re.sub(r"//\s*Release:.*?\n", "", content_str, flags=re.IGNORECASE)
+    content_str = re.sub(r"//\s*PHP\s*\d+\.\d+.*?\n", "", content_str, flags=re.IGNORECASE)
+
+    php_pattern = r"(<\?php\s*)"
+    if re.search(php_pattern, content_str, re.IGNORECASE):
+        content_str = re.sub(
+            php_pattern, r"\1\n" + custom_watermark,
+            content_str, count=1, flags=re.IGNORECASE,
+        )
+    else:
+        content_str = custom_watermark + content_str
+
+    content_str = re.sub(r"\n{3,}", "\n\n", content_str)
+    return content_str.encode("utf-8")
+
+
+def test_corpus_present():
+    assert FIXTURES
+    # Byte identity only holds for files that fit in the rewritten header
+    assert all(path.stat().st_size <= HEADER_LIMIT for path in FIXTURES)
+
+
+@pytest.mark.parametrize("watermark", WATERMARKS)
+@pytest.mark.parametrize("path", FIXTURES, ids=lambda p: p.name)
+def test_rewrite_matches_legacy(path, watermark):
+    content = path.read_bytes()
+    assert WatermarkEngine(watermark).rewrite(content) == legacy_replace_watermark(content, watermark)
+
+
+@pytest.mark.parametrize("watermark", WATERMARKS)
+@pytest.mark.parametrize("path", FIXTURES, ids=lambda p: p.name)
+def test_rewrite_stream_matches_legacy(path, watermark):
+    content = path.read_bytes()
+    dst = io.BytesIO()
+    WatermarkEngine(watermark).rewrite_stream(io.BytesIO(content), dst)
+    assert dst.getvalue() == legacy_replace_watermark(content, watermark)
+
+
+def test_comment_before_banner_is_kept():
+    content = (FIXTURES[0].parent / "copyright_before_banner.php").read_bytes()
+    rewritten = WatermarkEngine(WATERMARKS[0]).rewrite(content)
+    assert b"/* Copyright (c) 2021 Example Ltd. All rights reserved. */" in rewritten
+    assert b"EasyToYou" not in rewritten
@@ -0,0 +1,82 @@
+"""
+Logins of thread pool workers against the mock server
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import decoder
+from exceptions import LoginError
+from mock_server import MockServer
+
+decoder.console.quiet = True
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "src"
+    root.mkdir()
+    for i in range(12):
+        (root / f"f{i}.php").write_bytes(b"<?php // ionCube Loader\n" + f"{i}\n".encode())
+    return root
+
+
+def _decoder(server, password, **options):
+    return decoder.IonicubeDecoder(
+        "user", password, base_url=server.url, rate_limit=0, use_scan_cache=False,
+        workers=3, batch_size=2, adaptive_batching=False, **options
+    )
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_workers_decode_with_one_login_each(source, tmp_path, pipeline):
+    with MockServer(password="secret") as server:
+        instance = _decoder(server, "secret", pipeline=pipeline)
+        assert instance.decode_directory(str(source), str(tmp_path / "out"))
+        stats = server.stats()
+
+    assert instance.processed_count == 12
+    assert instance.not_decoded == []
+    # The session logged in before the run is taken over by a worker
+    assert stats["logins"] <= 3
+    assert "logins_rejected" not in stats
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_rejected_credentials_stop_before_the_run(source, tmp_path, pipeline):
+    with MockServer(password="secret") as server:
+        instance = _decoder(server, "wrong", pipeline=pipeline)
+        with pytest.raises(LoginError):
+            instance.decode_directory(str(source), str(tmp_path / "out"))
+        stats = server.stats()
+
+    assert stats["logins_rejected"] == 1
+    assert "uploads" not in stats
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_login_rejected_mid_run_aborts(source, tmp_path, pipeline, monkeypatch):
+    with MockServer(password="secret") as server:
+        instance = _decoder(server, "secret", pipeline=pipeline)
+        login_workers = instance._login_workers
+
+        def change_password():
+            # The password changes once the run has started, so the logins
+            # of the other workers are rejected
+            logged_in = login_workers()
+            server.password = "changed"
+            return logged_in
+
+        monkeypatch.setattr(instance, "_login_workers", change_password)
+        with pytest.raises(LoginError):
+            instance.decode_directory(str(source), str(tmp_path / "out"))
+        stats = server.stats()
+
+    # Each worker tries at most once, instead of once per batch and again in
+    # the retry pass
+    assert 1 <= stats["logins_rejected"] <= 2
+    assert instance.processed_count + len(instance.not_decoded) < 12